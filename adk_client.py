@@ -0,0 +1,264 @@
+"""Cliente HTTP reutilizable para el servidor del ADK.
+
+Mantiene un `requests.Session` con pool de conexiones keep-alive y timeouts de
+conexión/lectura, y recuerda en memoria las sesiones ya confirmadas para que
+`create_or_get_session` no vuelva a consultar SQLite ni el ADK después de la
+primera confirmación. `AsyncAdkClient` ofrece la misma interfaz sobre httpx.
+"""
+
+import asyncio
+import json
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from db import get_session, save_session, touch_session
+
+DEFAULT_APP_NAME = "multi_tool_agent"
+DEFAULT_USER_ID = "streamlit_user"
+# Timeouts en segundos: conexión y lectura (entre fragmentos en el caso de SSE)
+CONNECT_TIMEOUT = 3.05
+READ_TIMEOUT = 180
+POOL_SIZE = 20
+
+JSON_HEADERS = {
+    'Content-Type': 'application/json',
+    'Accept': 'application/json'
+}
+SSE_HEADERS = {
+    'Content-Type': 'application/json',
+    'Accept': 'text/event-stream'
+}
+
+
+def event_text_parts(event):
+    """Textos de un evento del agente (se ignoran los eventos del usuario)"""
+    # El evento con la respuesta del agente suele tener 'author' como 'model' o el nombre del agente
+    if not event.get("author") or event["author"] == "user":
+        return []
+    content = event.get("content")
+    if not content or not content.get("parts"):
+        return []
+    return [part["text"] for part in content["parts"] if part.get("text")]
+
+
+def parse_sse_line(line):
+    """Decodifica una línea `data: {...}` del stream SSE; None si no es de datos"""
+    if not line or not line.startswith("data:"):
+        return None
+    event = json.loads(line[len("data:"):].strip())
+    if "error" in event:
+        raise requests.exceptions.RequestException(event["error"])
+    return event
+
+
+class AdkClient:
+    """Cliente síncrono con conexiones persistentes hacia el servidor del ADK"""
+
+    def __init__(
+        self,
+        base_url,
+        app_name=DEFAULT_APP_NAME,
+        user_id=DEFAULT_USER_ID,
+        connect_timeout=CONNECT_TIMEOUT,
+        read_timeout=READ_TIMEOUT,
+        pool_size=POOL_SIZE,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.app_name = app_name
+        self.user_id = user_id
+        self.timeout = (connect_timeout, read_timeout)
+        self.http = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.http.mount("http://", adapter)
+        self.http.mount("https://", adapter)
+        self._confirmed_sessions = set()
+        self._lock = threading.Lock()
+
+    def session_url(self, session_id):
+        return f"{self.base_url}/apps/{self.app_name}/users/{self.user_id}/sessions/{session_id}"
+
+    def build_run_payload(self, session_id, text, streaming=False):
+        return {
+            "appName": self.app_name,
+            "userId": self.user_id,
+            "sessionId": session_id,
+            "newMessage": {
+                "parts": [
+                    {"text": text}
+                ],
+                "role": "user"
+            },
+            "streaming": streaming
+        }
+
+    def _confirm(self, session_id):
+        with self._lock:
+            self._confirmed_sessions.add(session_id)
+
+    def forget_session(self, session_id):
+        """Olvida una sesión confirmada (p. ej. si el ADK la rechaza)"""
+        with self._lock:
+            self._confirmed_sessions.discard(session_id)
+
+    def create_or_get_session(self, session_id):
+        """Crear una nueva sesión en el ADK o verificar si existe, y guardarla en SQLite"""
+        if session_id in self._confirmed_sessions:
+            # Solo se registra el uso; la escritura a SQLite ocurre en lote
+            touch_session(session_id)
+            return True
+
+        try:
+            # Verificar primero en la base de datos local
+            if get_session(session_id):
+                print("Sesión encontrada en la base de datos local")
+                self._confirm(session_id)
+                return True
+
+            # Intentar crear la sesión en el ADK (la especificación permite null para el body)
+            response = self.http.post(
+                self.session_url(session_id), json=None, headers=JSON_HEADERS, timeout=self.timeout
+            )
+            print(f"Sesión {session_id}: código de respuesta {response.status_code}")
+
+            # Manejar diferentes casos de respuesta
+            if response.status_code == 200:
+                print("Nueva sesión creada exitosamente")
+            elif response.status_code == 400 and "Session already exists" in response.text:
+                print("La sesión ya existía en el ADK")
+            else:
+                response.raise_for_status()
+
+            # Si todo fue exitoso, guardar o actualizar la sesión en la base de datos
+            if save_session(session_id, self.user_id, self.app_name):
+                self._confirm(session_id)
+                return True
+            return False
+
+        except requests.exceptions.RequestException as e:
+            print(f"Error al gestionar la sesión en el ADK: {e}")
+            if getattr(e, "response", None) is not None:
+                print(f"Detalles del error: {e.response.text}")
+            return False
+        except Exception as e:
+            print(f"Error al gestionar la sesión en la base de datos: {e}")
+            return False
+
+    def run(self, session_id, text):
+        """Ejecuta el agente con /run y regresa la lista completa de eventos"""
+        response = self.http.post(
+            f"{self.base_url}/run",
+            json=self.build_run_payload(session_id, text),
+            headers=JSON_HEADERS,
+            timeout=self.timeout,
+        )
+        response.raise_for_status()
+        return response.json()
+
+    def run_sse(self, session_id, text):
+        """Ejecuta el agente con /run_sse e itera los eventos conforme llegan"""
+        with self.http.post(
+            f"{self.base_url}/run_sse",
+            json=self.build_run_payload(session_id, text, streaming=True),
+            headers=SSE_HEADERS,
+            timeout=self.timeout,
+            stream=True,
+        ) as response:
+            response.raise_for_status()
+            for line in response.iter_lines(decode_unicode=True):
+                event = parse_sse_line(line)
+                if event is not None:
+                    yield event
+
+    def close(self):
+        self.http.close()
+
+
+class AsyncAdkClient(AdkClient):
+    """Variante asíncrona sobre `httpx.AsyncClient` (mismo pool keep-alive y timeouts)"""
+
+    def __init__(
+        self,
+        base_url,
+        app_name=DEFAULT_APP_NAME,
+        user_id=DEFAULT_USER_ID,
+        connect_timeout=CONNECT_TIMEOUT,
+        read_timeout=READ_TIMEOUT,
+        pool_size=POOL_SIZE,
+    ):
+        try:
+            import httpx
+        except ImportError as e:
+            raise ImportError("AsyncAdkClient requiere httpx: pip install httpx") from e
+
+        self.base_url = base_url.rstrip("/")
+        self.app_name = app_name
+        self.user_id = user_id
+        self._confirmed_sessions = set()
+        self._lock = threading.Lock()
+        self.http = httpx.AsyncClient(
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+        )
+
+    async def create_or_get_session(self, session_id):
+        """Crear una nueva sesión en el ADK o verificar si existe, y guardarla en SQLite.
+
+        Las funciones de db.py son bloqueantes: corren en un hilo para no detener el bucle de eventos.
+        """
+        if session_id in self._confirmed_sessions:
+            await asyncio.to_thread(touch_session, session_id)
+            return True
+
+        import httpx
+
+        try:
+            if await asyncio.to_thread(get_session, session_id):
+                self._confirm(session_id)
+                return True
+
+            response = await self.http.post(self.session_url(session_id), json=None, headers=JSON_HEADERS)
+            if response.status_code == 400 and "Session already exists" in response.text:
+                print("La sesión ya existía en el ADK")
+            else:
+                response.raise_for_status()
+
+            if await asyncio.to_thread(save_session, session_id, self.user_id, self.app_name):
+                self._confirm(session_id)
+                return True
+            return False
+
+        except httpx.HTTPError as e:
+            print(f"Error al gestionar la sesión en el ADK: {e}")
+            return False
+        except Exception as e:
+            print(f"Error al gestionar la sesión en la base de datos: {e}")
+            return False
+
+    async def run(self, session_id, text):
+        """Ejecuta el agente con /run y regresa la lista completa de eventos"""
+        response = await self.http.post(
+            f"{self.base_url}/run",
+            json=self.build_run_payload(session_id, text),
+            headers=JSON_HEADERS,
+        )
+        response.raise_for_status()
+        return response.json()
+
+    async def run_sse(self, session_id, text):
+        """Ejecuta el agente con /run_sse e itera los eventos conforme llegan"""
+        async with self.http.stream(
+            "POST",
+            f"{self.base_url}/run_sse",
+            json=self.build_run_payload(session_id, text, streaming=True),
+            headers=SSE_HEADERS,
+        ) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                event = parse_sse_line(line)
+                if event is not None:
+                    yield event
+
+    async def close(self):
+        await self.http.aclose()
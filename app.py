@@ -1,8 +1,11 @@
 import streamlit as st
 import requests
 import json
+import os
+import time
 import uuid
-from db import init_db, save_session, get_session, deactivate_session
+from adk_client import AdkClient, event_text_parts
+from db import get_messages, has_messages_before, init_db, save_message
 
 # Configuración de la página para ocultar el botón de deploy
 st.set_page_config(
@@ -25,80 +28,126 @@ footer {visibility: hidden;}
 """
 st.markdown(hide_streamlit_style, unsafe_allow_html=True)
 
-# Inicializar la base de datos
-init_db()
-
 # URLs para los endpoints del ADK
 BASE_URL = "http://0.0.0.0:4000"
-RUN_URL = f"{BASE_URL}/run"
-
-def create_or_get_session(session_id):
-    """Crear una nueva sesión en el ADK o verificar si existe, y guardarla en SQLite"""
-    try:
-        # Configurar los valores para la URL
-        app_name = "multi_tool_agent"
-        user_id = "streamlit_user"
-        
-        # Verificar primero en la base de datos local
-        if get_session(session_id):
-            print("Sesión encontrada en la base de datos local")
-            return True
-            
-        # Construir la URL específica para esta sesión
-        session_specific_url = f"{BASE_URL}/apps/{app_name}/users/{user_id}/sessions/{session_id}"
-        
-        headers = {
-            'Content-Type': 'application/json',
-            'Accept': 'application/json'
-        }
-        
-        # Intentar crear la sesión en el ADK
-        session_payload = None  # La especificación permite null para el body
-        response = requests.post(session_specific_url, json=session_payload, headers=headers)
-        
-        # Imprimir información de depuración
-        print(f"URL de la sesión: {session_specific_url}")
-        print(f"Payload enviado: {session_payload}")
-        print(f"Código de respuesta: {response.status_code}")
-        
-        success = False
-        
-        # Manejar diferentes casos de respuesta
-        if response.status_code == 200:
-            print("Nueva sesión creada exitosamente")
-            success = True
-        elif response.status_code == 400 and "Session already exists" in response.text:
-            print("La sesión ya existía en el ADK")
-            success = True
+# Mostrar la respuesta conforme se genera (endpoint SSE) en lugar de esperar a /run
+STREAMING = os.getenv("ADK_STREAMING", "TRUE").upper() == "TRUE"
+# Turnos (pregunta + respuesta) que se muestran al inicio y por cada página anterior
+CHAT_HISTORY_TURNS = int(os.getenv("CHAT_HISTORY_TURNS", "10"))
+# Máximo de mensajes que se conservan en st.session_state por pestaña
+CHAT_HISTORY_MAX_MESSAGES = int(os.getenv("CHAT_HISTORY_MAX_MESSAGES", "200"))
+HISTORY_PAGE_SIZE = CHAT_HISTORY_TURNS * 2
+
+
+@st.cache_resource
+def get_adk_client():
+    """Cliente del ADK compartido por todas las pestañas de este proceso de Streamlit"""
+    # Inicializar la base de datos una sola vez por proceso, no en cada rerun
+    init_db()
+    return AdkClient(BASE_URL)
+
+
+def render_streamed_response(client, session_id, prompt, placeholder):
+    """Muestra los textos del agente conforme llegan y regresa el mensaje completo.
+
+    Con streaming activado el ADK emite eventos parciales con fragmentos de
+    texto y después un evento final con el texto completo de ese mensaje, que
+    reemplaza a los fragmentos acumulados.
+    """
+    start = time.perf_counter()
+    first_token_at = None
+    final_parts = []
+    partial_text = ""
+    for event in client.run_sse(session_id, prompt):
+        texts = event_text_parts(event)
+        if not texts:
+            continue
+        if first_token_at is None:
+            first_token_at = time.perf_counter()
+        if event.get("partial"):
+            partial_text += "".join(texts)
         else:
-            response.raise_for_status()
-            
-        # Si todo fue exitoso, guardar o actualizar la sesión en la base de datos
-        if success and save_session(session_id, user_id, app_name):
-            return True
-            
-        return False
-        
-    except requests.exceptions.RequestException as e:
-        print(f"Error al gestionar la sesión en el ADK: {e}")
-        if hasattr(e.response, 'text'):
-            print(f"Detalles del error: {e.response.text}")
-        return False
-    except Exception as e:
-        print(f"Error al gestionar la sesión en la base de datos: {e}")
-        return False
+            final_parts.extend(texts)
+            partial_text = ""
+        placeholder.markdown("\n".join(final_parts + [partial_text]) + " ▌")
+
+    total = time.perf_counter() - start
+    ttft = (first_token_at - start) if first_token_at else total
+    print(f"Tiempo al primer token: {ttft:.2f}s - respuesta completa: {total:.2f}s")
+    return "\n".join(final_parts + ([partial_text] if partial_text else []))
+
+
+def add_message(role, content):
+    """Guarda el mensaje en SQLite y lo agrega a la ventana visible, que no crece sin límite"""
+    message_id = save_message(st.session_state.session_id, role, content)
+    st.session_state.messages.append({"id": message_id, "role": role, "content": content})
+    overflow = len(st.session_state.messages) - st.session_state.history_limit
+    if overflow > 0:
+        # Los mensajes que salen de la ventana se pueden volver a cargar desde la base
+        del st.session_state.messages[:overflow]
+        st.session_state.has_older = True
+
+
+def oldest_loaded_id():
+    return next((m["id"] for m in st.session_state.messages if m["id"] is not None), None)
+
+
+def load_older_messages():
+    """Antepone la página anterior del historial a la ventana visible"""
+    oldest_id = oldest_loaded_id()
+    if oldest_id is None:
+        st.session_state.has_older = False
+        return
+    page_size = min(HISTORY_PAGE_SIZE, CHAT_HISTORY_MAX_MESSAGES - len(st.session_state.messages))
+    older = get_messages(st.session_state.session_id, page_size, before_id=oldest_id) if page_size > 0 else []
+    st.session_state.messages[:0] = older
+    st.session_state.history_limit = min(
+        CHAT_HISTORY_MAX_MESSAGES, max(st.session_state.history_limit, len(st.session_state.messages))
+    )
+    st.session_state.has_older = bool(older) and has_messages_before(st.session_state.session_id, older[0]["id"])
+
+
+def run_agent(client, session_id, prompt):
+    """Envía la solicitud a /run y regresa el texto de la respuesta completa"""
+    start = time.perf_counter()
+    agent_response = client.run(session_id, prompt)
+    
+    # Para depuración
+    print("Respuesta del agente:", json.dumps(agent_response, indent=2))
+    print(f"Respuesta completa: {time.perf_counter() - start:.2f}s")
+
+    # La respuesta del endpoint /run tiene una estructura diferente
+    # Buscar el último evento que contenga un mensaje del agente
+    agent_message_parts = []
+    for event in agent_response:
+        agent_message_parts.extend(event_text_parts(event))
+    return "\n".join(agent_message_parts)
+
 
 st.title("Agente de Operaciones de Restaurantes")
 st.markdown("¡Hola! Soy tu asistente para consultas sobre políticas y procedimientos. Pregúntame lo que necesites.")
 
 
-# Inicializar el historial de chat y el ID de la sesión
-if "messages" not in st.session_state:
-    st.session_state.messages = []
+client = get_adk_client()
+
+# Inicializar el ID de la sesión y la ventana del historial de chat
 if "session_id" not in st.session_state:
     st.session_state.session_id = str(uuid.uuid4()) # Genera un ID de sesión único
-
-# Mostrar mensajes del historial al recargar la página
+if "messages" not in st.session_state:
+    # Solo los últimos turnos; los anteriores se leen de SQLite cuando se piden
+    st.session_state.messages = get_messages(st.session_state.session_id, HISTORY_PAGE_SIZE)
+    st.session_state.history_limit = HISTORY_PAGE_SIZE
+    oldest_id = oldest_loaded_id()
+    st.session_state.has_older = oldest_id is not None and has_messages_before(st.session_state.session_id, oldest_id)
+
+# Cargar páginas anteriores bajo demanda (hasta CHAT_HISTORY_MAX_MESSAGES en memoria)
+if st.session_state.has_older:
+    if len(st.session_state.messages) >= CHAT_HISTORY_MAX_MESSAGES:
+        st.caption(f"Se muestran los últimos {CHAT_HISTORY_MAX_MESSAGES} mensajes de la conversación.")
+    else:
+        st.button("Cargar mensajes anteriores", on_click=load_older_messages)
+
+# Mostrar solo la ventana del historial: el costo de cada rerun no crece con la conversación
 for message in st.session_state.messages:
     with st.chat_message(message["role"]):
         st.markdown(message["content"])
@@ -106,73 +155,39 @@ for message in st.session_state.messages:
 # Capturar la entrada del usuario
 if prompt := st.chat_input("Escribe tu pregunta aquí..."):
     # Añadir el mensaje del usuario al historial
-    st.session_state.messages.append({"role": "user", "content": prompt})
+    add_message("user", prompt)
     
     # Mostrar el mensaje del usuario en la interfaz
     with st.chat_message("user"):
         st.markdown(prompt)
 
     # Primero, asegurarse de que existe una sesión válida
-    if not create_or_get_session(st.session_state.session_id):
+    if not client.create_or_get_session(st.session_state.session_id):
         st.error("No se pudo crear o verificar la sesión con el agente")
         st.stop()
 
-    # Preparar la solicitud para la API del agente
-    payload = {
-        "appName": "multi_tool_agent",
-        "userId": "streamlit_user",
-        "sessionId": st.session_state.session_id,
-        "newMessage": {
-            "parts": [
-                {"text": prompt}
-            ],
-            "role": "user"
-        },
-        "streaming": False
-    }
-
     # Enviar la solicitud al agente ADK
-    with st.spinner("Buscando una respuesta..."):
+    with st.chat_message("assistant"):
+        placeholder = st.empty()
         try:
-            headers = {
-                'Content-Type': 'application/json',
-                'Accept': 'application/json'
-            }
-            response = requests.post(RUN_URL, json=payload, headers=headers)
-            response.raise_for_status()  # Lanza una excepción si hay un error HTTP
-            agent_response = response.json()
-            
-            # Para depuración
-            print("Payload enviado:", json.dumps(payload, indent=2))
-            print("Respuesta del agente:", json.dumps(agent_response, indent=2))
-
-            # La respuesta del endpoint /run tiene una estructura diferente
-            # Buscar el último evento que contenga un mensaje del agente
-            agent_message_parts = []
-            for event in agent_response:
-                # El evento con la respuesta del agente suele tener 'author' como 'model' o el nombre del agente
-                if event.get("author") and event["author"] != "user":
-                    content = event.get("content")
-                    if content and content.get("parts"):
-                        for part in content["parts"]:
-                            if part.get("text"):
-                                agent_message_parts.append(part["text"])
-
-            if agent_message_parts:
-                agent_message = "\n".join(agent_message_parts)
+            if STREAMING:
+                placeholder.markdown("_Buscando una respuesta..._")
+                agent_message = render_streamed_response(
+                    client, st.session_state.session_id, prompt, placeholder
+                )
             else:
+                with st.spinner("Buscando una respuesta..."):
+                    agent_message = run_agent(client, st.session_state.session_id, prompt)
+
+            if not agent_message:
                 agent_message = "No pude encontrar una respuesta."
 
-            # Añadir la respuesta del agente al historial
-            st.session_state.messages.append({"role": "assistant", "content": agent_message})
-            
-            # Mostrar la respuesta en la interfaz
-            with st.chat_message("assistant"):
-                st.markdown(agent_message)
+            # Añadir la respuesta del agente al historial y mostrarla completa
+            add_message("assistant", agent_message)
+            placeholder.markdown(agent_message)
         
         except requests.exceptions.RequestException as e:
             error_message = f"Error al conectar con el agente: {e}"
             st.error(error_message)
-            st.session_state.messages.append({"role": "assistant", "content": error_message})
-            with st.chat_message("assistant"):
-                st.markdown(error_message)
\ No newline at end of file
+            add_message("assistant", error_message)
+            placeholder.markdown(error_message)
@@ -0,0 +1,135 @@
+"""Benchmark del almacén binario de chunks contra la lectura de los JSONL.
+
+Compara, sobre el corpus real, la forma actual de obtener chunks (abrir el
+JSONL del documento y decodificar línea por línea, o cargar todo el corpus en
+memoria) con el almacén de multi_tool_agent/chunk_store.py:
+
+- carga: decodificar todo el corpus contra abrir el almacén (mmap),
+- búsqueda por ID de chunk,
+- todos los chunks de un `documento_origen`,
+- rango de chunks de un documento (`numero_chunk` en [start, stop)).
+
+El almacén se construye en un directorio temporal.
+
+    python benchmarks/bench_chunk_store.py --lookups 2000
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from multi_tool_agent.chunk_store import ChunkStore, build_chunk_store  # noqa: E402
+from multi_tool_agent.corpus import CORPUS_DIR, iter_chunks, iter_file_chunks, list_jsonl_files  # noqa: E402
+
+
+def jsonl_document_files(corpus_dir):
+    """documento_origen -> archivo JSONL (lo que guarda el índice de metadata)"""
+    files = {}
+    for path in list_jsonl_files(corpus_dir):
+        for chunk in iter_file_chunks(path):
+            files.setdefault(chunk["metadata"].get("documento_origen"), path)
+    return files
+
+
+def jsonl_document_chunks(files, document, start=None, stop=None):
+    return [
+        chunk for chunk in iter_file_chunks(files[document])
+        if chunk["metadata"].get("documento_origen") == document
+        and (start is None or chunk["metadata"].get("numero_chunk", -1) >= start)
+        and (stop is None or chunk["metadata"].get("numero_chunk", -1) < stop)
+    ]
+
+
+def jsonl_get(files, chunk_id):
+    document = chunk_id.rsplit("__chunk_", 1)[0]
+    for chunk in iter_file_chunks(files[document]):
+        if chunk["id"] == chunk_id:
+            return chunk
+    return None
+
+
+def timed(function, arguments):
+    """Latencias (ms) de llamar `function` con cada tupla de argumentos"""
+    latencies = []
+    for args in arguments:
+        start = time.perf_counter()
+        function(*args)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))] if ordered else 0.0
+
+
+def print_row(name, jsonl, store):
+    speedup = sum(jsonl) / sum(store) if sum(store) else float("inf")
+    print(
+        f"{name:<22} {sum(jsonl) / len(jsonl):>10.3f} {percentile(jsonl, 0.99):>10.3f} "
+        f"{sum(store) / len(store):>10.4f} {percentile(store, 0.99):>10.4f} {speedup:>9.0f}x"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus-dir", default=CORPUS_DIR)
+    parser.add_argument("--lookups", type=int, default=2000, help="Búsquedas por escenario")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(prefix="chunk_store_"), "chunks.bin")
+    start = time.perf_counter()
+    build_chunk_store(args.corpus_dir, path).close()
+    build_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    chunks = list(iter_chunks(args.corpus_dir))
+    jsonl_load_ms = (time.perf_counter() - start) * 1000
+    start = time.perf_counter()
+    store = ChunkStore(path)
+    store_open_ms = (time.perf_counter() - start) * 1000
+
+    corpus_bytes = sum(os.path.getsize(file) for file in list_jsonl_files(args.corpus_dir))
+    print(f"corpus: {len(chunks)} chunks, {len(store.documents())} documentos, {corpus_bytes / 1e6:.1f} MB en JSONL")
+    print(f"almacén: {os.path.getsize(path) / 1e6:.1f} MB, construido en {build_seconds:.2f}s")
+    print(f"carga completa JSONL {jsonl_load_ms:.0f} ms, apertura del almacén {store_open_ms:.2f} ms\n")
+
+    files = jsonl_document_files(args.corpus_dir)
+    rng = random.Random(args.seed)
+    ids = [rng.choice(chunks)["id"] for _ in range(args.lookups)]
+    numbers = defaultdict(list)
+    for chunk in chunks:
+        numbers[chunk["metadata"]["documento_origen"]].append(chunk["metadata"]["numero_chunk"])
+    documents = [rng.choice(sorted(numbers)) for _ in range(args.lookups)]
+    ranges = []
+    for document in documents:
+        first = rng.choice(numbers[document])
+        ranges.append((document, first, first + 3))
+
+    # Mismos resultados antes de medir
+    for chunk_id in ids[:50]:
+        assert jsonl_get(files, chunk_id)["text"] == store.get(chunk_id)["text"]
+    for document, first, stop in ranges[:50]:
+        expected = sorted(chunk["text"] for chunk in jsonl_document_chunks(files, document, first, stop))
+        assert expected == sorted(chunk["text"] for chunk in store.document_chunks(document, first, stop))
+
+    print(f"{'escenario (ms)':<22} {'JSONL prom':>10} {'JSONL p99':>10} {'bin prom':>10} {'bin p99':>10} {'mejora':>10}")
+    print_row("por ID", timed(lambda i: jsonl_get(files, i), [(i,) for i in ids]),
+              timed(store.get, [(i,) for i in ids]))
+    print_row("por documento", timed(lambda d: jsonl_document_chunks(files, d), [(d,) for d in documents]),
+              timed(store.document_chunks, [(d,) for d in documents]))
+    print_row("rango de 3 chunks", timed(lambda *r: jsonl_document_chunks(files, *r), ranges),
+              timed(store.document_chunks, ranges))
+    store.close()
+    os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""Micro-benchmark de db.py con N escritores concurrentes.
+
+Compara el esquema anterior (una conexión nueva por operación, journal por
+defecto, last_used_at escrito en cada llamada) con el actual (pool de
+conexiones, WAL y actualizaciones de last_used_at en lote).
+
+    python benchmarks/bench_db.py --writers 1 4 16 --ops 500
+"""
+
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db  # noqa: E402
+
+
+def legacy_save_session(db_path, session_id):
+    conn = sqlite3.connect(db_path)
+    try:
+        now = datetime.now().isoformat()
+        conn.execute('''
+            INSERT INTO sessions_agent (session_id, user_id, app_name, created_at, last_used_at, is_active)
+            VALUES (?, ?, ?, ?, ?, 1)
+            ON CONFLICT(session_id) DO UPDATE SET last_used_at = ?, is_active = 1
+        ''', (session_id, "bench", "bench", now, now, now))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def legacy_get_session(db_path, session_id):
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute(
+            'SELECT * FROM sessions_agent WHERE session_id = ? AND is_active = 1', (session_id,)
+        ).fetchone() is not None
+    finally:
+        conn.close()
+
+
+def legacy_worker(db_path, ops, errors):
+    sessions = [str(uuid.uuid4()) for _ in range(10)]
+    for i in range(ops):
+        session_id = sessions[i % len(sessions)]
+        try:
+            # Cada mensaje: verificar la sesión y volver a escribir last_used_at
+            legacy_get_session(db_path, session_id)
+            legacy_save_session(db_path, session_id)
+        except sqlite3.OperationalError:
+            errors.append(1)
+
+
+def pooled_worker(db_path, ops, errors):
+    sessions = [str(uuid.uuid4()) for _ in range(10)]
+    for session_id in sessions:
+        db.save_session(session_id, "bench", "bench")
+    for i in range(ops):
+        session_id = sessions[i % len(sessions)]
+        if not db.get_session(session_id):
+            errors.append(1)
+
+
+def run(mode, writers, ops):
+    original_path = db.DB_PATH
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "bench.db")
+        db.set_db_path(db_path)
+        db.init_db()
+        if mode == "legacy":
+            # El esquema anterior usaba el journal por defecto
+            db.get_pool().close()
+            conn = sqlite3.connect(db_path)
+            conn.execute('PRAGMA journal_mode=DELETE')
+            conn.close()
+        target = legacy_worker if mode == "legacy" else pooled_worker
+        errors = []
+        threads = [threading.Thread(target=target, args=(db_path, ops, errors)) for _ in range(writers)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if mode == "pooled":
+            db.flush_touches()
+        elapsed = time.perf_counter() - start
+        # Cerrar el pool antes de borrar el directorio temporal
+        db.set_db_path(original_path)
+    return writers * ops / elapsed, len(errors)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--writers", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--ops", type=int, default=500, help="Operaciones por escritor")
+    args = parser.parse_args()
+
+    print(f"{'escritores':>10} {'antes (ops/s)':>15} {'después (ops/s)':>17} {'mejora':>8}")
+    for writers in args.writers:
+        legacy_ops, legacy_errors = run("legacy", writers, args.ops)
+        pooled_ops, pooled_errors = run("pooled", writers, args.ops)
+        note = f"  errores: {legacy_errors}/{pooled_errors}" if legacy_errors or pooled_errors else ""
+        print(f"{writers:>10} {legacy_ops:>15.0f} {pooled_ops:>17.0f} {pooled_ops / legacy_ops:>7.1f}x{note}")
+
+
+if __name__ == "__main__":
+    main()
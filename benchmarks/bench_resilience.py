@@ -0,0 +1,139 @@
+"""Benchmark de la política de resiliencia de RAG contra un backend falso.
+
+`FakeRagBackend` imita a Vertex RAG con latencia base, una cola lenta (una
+réplica lenta en una fracción de las llamadas) y errores transitorios
+inyectados. Se comparan tres escenarios:
+
+- cola lenta: latencia p50/p95/p99 sin y con hedging,
+- errores transitorios: tasa de éxito sin reintentos y con reintentos,
+- caída total: cuánto tarda cada solicitud antes y después de que el circuit
+  breaker se abre.
+
+    python benchmarks/bench_resilience.py --requests 300 --concurrency 20
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from multi_tool_agent.resilience import (  # noqa: E402
+    CircuitBreaker,
+    CircuitOpenError,
+    DeadlineExceededError,
+    ResiliencePolicy,
+)
+
+
+class TransientError(Exception):
+    """Error transitorio inyectado (equivalente a ServiceUnavailable)"""
+
+
+class FakeRagBackend:
+    """Backend asíncrono con latencia y errores inyectables"""
+
+    def __init__(self, latency=0.05, tail_rate=0.0, tail_latency=1.0, error_rate=0.0, down=False, seed=7):
+        self.latency = latency
+        self.tail_rate = tail_rate
+        self.tail_latency = tail_latency
+        self.error_rate = error_rate
+        self.down = down
+        self.calls = 0
+        self._random = random.Random(seed)
+
+    async def search(self, query):
+        self.calls += 1
+        slow = self._random.random() < self.tail_rate
+        await asyncio.sleep(self.tail_latency if slow else self.latency * self._random.uniform(0.8, 1.2))
+        if self.down or self._random.random() < self.error_rate:
+            raise TransientError("servicio no disponible")
+        return [{"text": f"resultado para {query}", "score": 0.1}]
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))] if ordered else 0.0
+
+
+async def run_load(policy, backend, requests, concurrency):
+    """Latencias (s) de las solicitudes exitosas y errores por tipo"""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, errors = [], {}
+
+    async def one(i):
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                await policy.call(lambda: backend.search(f"consulta {i}"))
+                latencies.append(time.perf_counter() - start)
+            except (TransientError, CircuitOpenError, DeadlineExceededError) as e:
+                errors[type(e).__name__] = errors.get(type(e).__name__, 0) + 1
+
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    return latencies, errors
+
+
+def make_policy(**kwargs):
+    defaults = dict(
+        retry_on=(TransientError,), deadline_seconds=3.0, max_attempts=1, initial_backoff=0.02,
+        max_backoff=0.2, breaker=CircuitBreaker(failure_threshold=10 ** 9), hedge=False, hedge_delay=0.2,
+    )
+    defaults.update(kwargs)
+    return ResiliencePolicy(**defaults)
+
+
+def print_row(name, latencies, errors, backend):
+    print(
+        f"{name:<28} {len(latencies):>6} {percentile(latencies, 0.5) * 1000:>8.0f} "
+        f"{percentile(latencies, 0.95) * 1000:>8.0f} {percentile(latencies, 0.99) * 1000:>8.0f} "
+        f"{backend.calls:>8} {errors or ''}"
+    )
+
+
+async def main_async(args):
+    print(f"{'escenario':<28} {'éxitos':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'llamadas':>8} errores")
+
+    # Cola lenta: 5% de las llamadas tarda 1 s
+    for name, hedge in (("cola lenta sin hedging", False), ("cola lenta con hedging", True)):
+        backend = FakeRagBackend(tail_rate=0.05, tail_latency=1.0)
+        policy = make_policy(hedge=hedge)
+        # Calentar la ventana de latencias para que el hedging use el p95 real
+        await run_load(policy, FakeRagBackend(), 50, args.concurrency)
+        latencies, errors = await run_load(policy, backend, args.requests, args.concurrency)
+        print_row(name, latencies, errors, backend)
+
+    # Errores transitorios: 20% de las llamadas falla
+    for name, attempts in (("errores sin reintentos", 1), ("errores con 3 intentos", 3)):
+        backend = FakeRagBackend(error_rate=0.2)
+        latencies, errors = await run_load(make_policy(max_attempts=attempts), backend, args.requests, args.concurrency)
+        print_row(name, latencies, errors, backend)
+
+    # Caída total: sin breaker cada solicitud agota sus intentos; con breaker fallan de inmediato
+    for name, breaker in (
+        ("caída sin circuit breaker", CircuitBreaker(failure_threshold=10 ** 9)),
+        ("caída con circuit breaker", CircuitBreaker(failure_threshold=5, reset_seconds=30)),
+    ):
+        backend = FakeRagBackend(latency=0.2, down=True)
+        start = time.perf_counter()
+        latencies, errors = await run_load(
+            make_policy(max_attempts=3, breaker=breaker), backend, args.requests, args.concurrency
+        )
+        elapsed = time.perf_counter() - start
+        print_row(name, latencies, errors, backend)
+        print(f"{'':<28} tiempo total {elapsed:.2f}s, {elapsed / args.requests * 1000:.0f} ms por solicitud")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--concurrency", type=int, default=20)
+    args = parser.parse_args()
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
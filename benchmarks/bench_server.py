@@ -0,0 +1,287 @@
+"""Benchmark de latencia y throughput del servidor FastAPI del ADK (main.py).
+
+Levanta `main.app` con uvicorn dentro del proceso, con Gemini y Vertex RAG
+reemplazados por stubs deterministas (benchmarks/stubs.py), y reproduce un
+conjunto de preguntas derivado de los documentos de data/outputs contra los
+endpoints de creación de sesión y `/run` con concurrencia controlada.
+
+Con `--workers N` el servidor se inicia con serve.py (modo de producción con
+N procesos) sirviendo benchmarks/stub_app.py en lugar de dentro del proceso.
+
+Reporta p50/p95/p99 y solicitudes por segundo y guarda los resultados en
+benchmarks/results/ junto con el commit, para compararlos entre versiones:
+
+    python benchmarks/bench_server.py --concurrency 1 8 32 --requests 200
+    python benchmarks/bench_server.py --concurrency 32 --workers 4
+    python benchmarks/bench_server.py --compare benchmarks/results/antes.json benchmarks/results/despues.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+RESULTS_DIR = os.path.join(REPO_ROOT, "benchmarks", "results")
+APP_NAME = "multi_tool_agent"
+USER_ID = "bench_user"
+
+QUERY_TEMPLATES = [
+    "¿Qué establece la política de {}?",
+    "¿Cuál es el procedimiento de {}?",
+    "¿Quién es responsable de {}?",
+    "Resume los puntos principales de {}",
+]
+
+
+def build_queries(count, seed=7):
+    """Preguntas deterministas a partir de los nombres de los documentos del corpus"""
+    from multi_tool_agent.corpus import SOURCE_DIR, list_jsonl_files
+
+    topics = [
+        # procesos-1_registro_y_control_de_morralla.jsonl -> "registro y control de morralla"
+        os.path.splitext(os.path.basename(path))[0].split("_", 1)[-1].replace("_", " ")
+        for path in list_jsonl_files(SOURCE_DIR)
+    ]
+    rng = random.Random(seed)
+    return [rng.choice(QUERY_TEMPLATES).format(rng.choice(topics)) for _ in range(count)]
+
+
+def percentile(values, fraction):
+    """Percentil por interpolación lineal"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def summarize(latencies, elapsed, errors):
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 1),
+    }
+
+
+def start_server(port, model_latency, retrieval_latency):
+    """Importa main.app con los stubs instalados y lo sirve en un hilo"""
+    import uvicorn
+
+    from benchmarks.stubs import install_stubs
+
+    install_stubs(model_latency=model_latency, retrieval_latency=retrieval_latency)
+    import main
+
+    config = uvicorn.Config(main.app, host="127.0.0.1", port=port, log_level="warning")
+    server = uvicorn.Server(config)
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    deadline = time.time() + 30
+    while not server.started:
+        if time.time() > deadline:
+            raise RuntimeError("El servidor no arrancó en 30s")
+        time.sleep(0.05)
+    return server, thread
+
+
+def start_workers(port, workers, model_latency, retrieval_latency):
+    """Inicia serve.py con `workers` procesos y espera a que responda"""
+    import httpx
+
+    env = {
+        **os.environ,
+        "BENCH_MODEL_LATENCY": str(model_latency),
+        "BENCH_RETRIEVAL_LATENCY": str(retrieval_latency),
+    }
+    process = subprocess.Popen(
+        [sys.executable, "serve.py", "--app", "benchmarks.stub_app:app",
+         "--host", "127.0.0.1", "--port", str(port), "--workers", str(workers)],
+        cwd=REPO_ROOT, env=env,
+    )
+    deadline = time.time() + 120
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"serve.py terminó con código {process.returncode}")
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/healthz", timeout=1).status_code == 200:
+                return process
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("serve.py no arrancó en 120s")
+
+
+async def run_load(base_url, queries, concurrency):
+    """Crea una sesión y ejecuta /run por cada pregunta con `concurrency` clientes"""
+    import httpx
+
+    session_latencies, run_latencies = [], []
+    errors = {"session": 0, "run": 0}
+    pending = list(queries)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=120, limits=limits) as http:
+        async def worker():
+            while pending:
+                query = pending.pop()
+                session_id = str(uuid.uuid4())
+                start = time.perf_counter()
+                response = await http.post(f"/apps/{APP_NAME}/users/{USER_ID}/sessions/{session_id}", json=None)
+                session_latencies.append(time.perf_counter() - start)
+                if response.status_code != 200:
+                    errors["session"] += 1
+                    continue
+
+                start = time.perf_counter()
+                response = await http.post("/run", json={
+                    "appName": APP_NAME,
+                    "userId": USER_ID,
+                    "sessionId": session_id,
+                    "newMessage": {"parts": [{"text": query}], "role": "user"},
+                    "streaming": False,
+                })
+                run_latencies.append(time.perf_counter() - start)
+                if response.status_code != 200:
+                    errors["run"] += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    return {
+        "concurrency": concurrency,
+        "seconds": round(elapsed, 3),
+        "session_create": summarize(session_latencies, elapsed, errors["session"]),
+        "run": summarize(run_latencies, elapsed, errors["run"]),
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "desconocido"
+
+
+def print_results(results):
+    print(f"\n{'endpoint':>15} {'conc.':>6} {'req':>6} {'err':>5} {'rps':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for level in results["levels"]:
+        for endpoint in ("session_create", "run"):
+            stats = level[endpoint]
+            print(
+                f"{endpoint:>15} {level['concurrency']:>6} {stats['requests']:>6} {stats['errors']:>5} "
+                f"{stats['rps']:>8.1f} {stats['p50_ms']:>9.1f} {stats['p95_ms']:>9.1f} {stats['p99_ms']:>9.1f}"
+            )
+
+
+def compare(before_path, after_path):
+    """Compara dos archivos de resultados por endpoint y nivel de concurrencia"""
+    with open(before_path, encoding="utf-8") as f:
+        before = json.load(f)
+    with open(after_path, encoding="utf-8") as f:
+        after = json.load(f)
+    previous = {level["concurrency"]: level for level in before["levels"]}
+
+    print(
+        f"{before['revision']} ({before.get('workers', 0)} workers) -> "
+        f"{after['revision']} ({after.get('workers', 0)} workers)"
+    )
+    print(f"{'endpoint':>15} {'conc.':>6} {'rps':>18} {'p95 ms':>20} {'p99 ms':>20}")
+    for level in after["levels"]:
+        old = previous.get(level["concurrency"])
+        if old is None:
+            continue
+        for endpoint in ("session_create", "run"):
+            a, b = old[endpoint], level[endpoint]
+            print(
+                f"{endpoint:>15} {level['concurrency']:>6} "
+                f"{a['rps']:>8.1f} -> {b['rps']:<7.1f} "
+                f"{a['p95_ms']:>9.1f} -> {b['p95_ms']:<8.1f} "
+                f"{a['p99_ms']:>9.1f} -> {b['p99_ms']:<8.1f}"
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--requests", type=int, default=100, help="Preguntas por nivel de concurrencia")
+    parser.add_argument("--model-latency", type=float, default=0.5, help="Segundos por llamada al modelo")
+    parser.add_argument("--retrieval-latency", type=float, default=0.3, help="Segundos por consulta RAG")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--workers", type=int, default=0,
+                        help="Procesos de serve.py (0 = servidor dentro de este proceso)")
+    parser.add_argument("--output", help="Archivo de resultados (por defecto benchmarks/results/<commit>.json)")
+    parser.add_argument("--compare", nargs=2, metavar=("ANTES", "DESPUES"), help="Comparar dos resultados")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # Base de sesiones temporal y sin cachés para medir el servidor completo
+        os.environ["SESSION_SERVICE_URI"] = f"sqlite:///{os.path.join(tmp, 'sessions.db')}"
+        os.environ["RAG_CACHE_ENABLED"] = "FALSE"
+        os.environ["ANSWER_CACHE_ENABLED"] = "FALSE"
+        os.environ["RAG_BACKEND"] = "vertex"
+
+        if args.workers:
+            process = start_workers(args.port, args.workers, args.model_latency, args.retrieval_latency)
+        else:
+            server, thread = start_server(args.port, args.model_latency, args.retrieval_latency)
+        base_url = f"http://127.0.0.1:{args.port}"
+        levels = []
+        try:
+            for concurrency in args.concurrency:
+                queries = build_queries(args.requests)
+                levels.append(asyncio.run(run_load(base_url, queries, concurrency)))
+        finally:
+            if args.workers:
+                # Apagado ordenado, igual que en producción
+                process.send_signal(signal.SIGTERM)
+                process.wait(timeout=60)
+            else:
+                server.should_exit = True
+                thread.join(timeout=10)
+
+    results = {
+        "revision": git_revision(),
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "requests_per_level": args.requests,
+        "workers": args.workers,
+        "model_latency": args.model_latency,
+        "retrieval_latency": args.retrieval_latency,
+        "levels": levels,
+    }
+    print_results(results)
+
+    suffix = f"-w{args.workers}" if args.workers else ""
+    output = args.output or os.path.join(RESULTS_DIR, f"{results['revision']}{suffix}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"\nResultados guardados en {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,18 @@
+"""main.app con los stubs de Gemini y Vertex RAG, para servirlo con serve.py.
+
+Cada worker importa este módulo e instala los stubs antes de cargar la app;
+las latencias se toman de BENCH_MODEL_LATENCY y BENCH_RETRIEVAL_LATENCY.
+
+    python serve.py --app benchmarks.stub_app:app --workers 4
+"""
+
+import os
+
+from benchmarks.stubs import install_stubs
+
+install_stubs(
+    model_latency=float(os.getenv("BENCH_MODEL_LATENCY", "0.5")),
+    retrieval_latency=float(os.getenv("BENCH_RETRIEVAL_LATENCY", "0.3")),
+)
+
+from main import app  # noqa: E402,F401
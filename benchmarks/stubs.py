@@ -0,0 +1,102 @@
+"""Stubs deterministas de Gemini y Vertex RAG para los benchmarks.
+
+`StubLlm` imita el flujo real del agente: la primera llamada del turno pide la
+herramienta `document_retrieval` con el texto del usuario y la segunda regresa
+una respuesta en dos secciones con sus referencias. `install_stubs` reemplaza
+el modelo de `root_agent` y la consulta a Vertex por estas versiones locales
+con latencia configurable, para poder medir el servidor sin red ni cuota.
+"""
+
+import asyncio
+import hashlib
+import time
+from typing import AsyncGenerator, List
+
+from google.adk.models.base_llm import BaseLlm
+from google.adk.models.llm_request import LlmRequest
+from google.adk.models.llm_response import LlmResponse
+from google.genai import types
+
+from multi_tool_agent.corpus import estimate_tokens, iter_chunks
+
+
+class StubLlm(BaseLlm):
+    """Modelo falso: llamada a la herramienta y luego respuesta fija"""
+
+    model: str = "stub-gemini"
+    latency_seconds: float = 0.5
+
+    @classmethod
+    def supported_models(cls) -> List[str]:
+        return [r"stub-.*"]
+
+    async def generate_content_async(
+        self, llm_request: LlmRequest, stream: bool = False
+    ) -> AsyncGenerator[LlmResponse, None]:
+        await asyncio.sleep(self.latency_seconds)
+        last = llm_request.contents[-1] if llm_request.contents else None
+        parts = (last.parts or []) if last else []
+        prompt_tokens = sum(
+            estimate_tokens(str(part.text or part.function_response or ""))
+            for content in llm_request.contents
+            for part in (content.parts or [])
+        )
+        tool_response = next((part.function_response for part in parts if part.function_response), None)
+
+        if tool_response is None:
+            query = " ".join(part.text for part in parts if part.text) or "consulta"
+            part = types.Part(function_call=types.FunctionCall(name="document_retrieval", args={"query": query}))
+            completion = estimate_tokens(query)
+        else:
+            matches = (tool_response.response or {}).get("matches") or []
+            first = matches[0] if matches else {"text": "", "metadata": {}}
+            title = first["metadata"].get("titulo") or first["metadata"].get("documento_origen") or "N/A"
+            text = (
+                "**Respuesta para el Colaborador**\n"
+                "Respuesta generada por el modelo de prueba.\n\n"
+                "**Referencias**\n"
+                f"* **Título del Documento:** {title}\n"
+                f"* **Texto Exacto:** \"{first['text'][:200]}\""
+            )
+            part = types.Part(text=text)
+            completion = estimate_tokens(text)
+
+        yield LlmResponse(
+            content=types.Content(role="model", parts=[part]),
+            usage_metadata=types.GenerateContentResponseUsageMetadata(
+                prompt_token_count=prompt_tokens,
+                candidates_token_count=completion,
+                total_token_count=prompt_tokens + completion,
+            ),
+        )
+
+
+class StubVertexSearch:
+    """Reemplazo de `_vertex_search`: resultados deterministas del corpus local"""
+
+    def __init__(self, latency_seconds: float = 0.3, top_k: int = 20):
+        self.latency_seconds = latency_seconds
+        self.top_k = top_k
+        self.chunks = [chunk for chunk in iter_chunks() if chunk["text"].strip()]
+
+    def __call__(self, tool, query: str):
+        time.sleep(self.latency_seconds)
+        start = int(hashlib.sha256(query.encode("utf-8")).hexdigest(), 16) % len(self.chunks)
+        selected = [self.chunks[(start + offset) % len(self.chunks)] for offset in range(self.top_k)]
+        return [
+            {
+                "text": chunk["text"],
+                "metadata": {"id": chunk["id"], **chunk["metadata"]},
+                "score": round(0.2 + 0.02 * rank, 4),
+            }
+            for rank, chunk in enumerate(selected)
+        ]
+
+
+def install_stubs(model_latency: float = 0.5, retrieval_latency: float = 0.3) -> None:
+    """Reemplaza Gemini y Vertex RAG en el agente cargado por stubs locales"""
+    from multi_tool_agent import agent
+
+    search = StubVertexSearch(latency_seconds=retrieval_latency)
+    agent.CustomVertexAiRagRetrieval._vertex_search = lambda tool, query, documents=None, timeout=None: search(tool, query)
+    agent.root_agent.model = StubLlm(latency_seconds=model_latency)
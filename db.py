@@ -1,82 +1,300 @@
+import atexit
+import queue
 import sqlite3
 import os
+import threading
+from contextlib import contextmanager
 from datetime import datetime
 
+from multi_tool_agent.usage_schema import create_usage_tables
+
+DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sessions.db')
+# Conexiones que se conservan abiertas para reutilizar entre llamadas
+POOL_SIZE = 8
+# Espera máxima (ms) cuando otra conexión tiene el candado de escritura
+BUSY_TIMEOUT_MS = 5000
+# Las actualizaciones de last_used_at se escriben en lote cada N segundos o N sesiones
+TOUCH_FLUSH_SECONDS = 2.0
+TOUCH_FLUSH_SIZE = 200
+
+
+def configure_connection(conn):
+    """Aplica los PRAGMA de rendimiento: WAL, synchronous NORMAL y busy_timeout"""
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute(f'PRAGMA busy_timeout={BUSY_TIMEOUT_MS}')
+    conn.execute('PRAGMA temp_store=MEMORY')
+    return conn
+
+
+class ConnectionPool:
+    """Pool pequeño de conexiones SQLite de larga vida compartidas entre hilos"""
+
+    def __init__(self, db_path, size=POOL_SIZE):
+        self.db_path = db_path
+        self.size = size
+        self._idle = queue.LifoQueue()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=BUSY_TIMEOUT_MS / 1000, check_same_thread=False)
+        return configure_connection(conn)
+
+    @contextmanager
+    def connection(self):
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = self._connect()
+        try:
+            yield conn
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            if self._idle.qsize() < self.size:
+                self._idle.put(conn)
+            else:
+                conn.close()
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Pool de conexiones del proceso (se crea en el primer uso)"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(DB_PATH)
+    return _pool
+
+
+def set_db_path(db_path):
+    """Cambiar la base de datos usada por el módulo (scripts y benchmarks)"""
+    global DB_PATH, _pool
+    flush_touches()
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+        DB_PATH = db_path
+        _pool = None
+
+
+def db_connection():
+    """Context manager que presta una conexión del pool"""
+    return get_pool().connection()
+
+
 def init_db():
     """Inicializar la base de datos SQLite"""
-    db_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sessions.db')
-    conn = sqlite3.connect(db_path)
-    c = conn.cursor()
-    
-    # Crear tabla de sesiones del agente si no existe
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS sessions_agent (
-            session_id TEXT PRIMARY KEY,
-            user_id TEXT NOT NULL,
-            app_name TEXT NOT NULL,
-            created_at TIMESTAMP NOT NULL,
-            last_used_at TIMESTAMP NOT NULL,
-            is_active BOOLEAN NOT NULL DEFAULT 1
-        )
-    ''')
-    
-    conn.commit()
-    conn.close()
+    with db_connection() as conn:
+        c = conn.cursor()
+
+        # Crear tabla de sesiones del agente si no existe
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS sessions_agent (
+                session_id TEXT PRIMARY KEY,
+                user_id TEXT NOT NULL,
+                app_name TEXT NOT NULL,
+                created_at TIMESTAMP NOT NULL,
+                last_used_at TIMESTAMP NOT NULL,
+                is_active BOOLEAN NOT NULL DEFAULT 1
+            )
+        ''')
+        # Índices para que el barrido de retención no recorra toda la tabla
+        c.execute('''
+            CREATE INDEX IF NOT EXISTS idx_sessions_agent_active_last_used
+            ON sessions_agent (is_active, last_used_at)
+        ''')
+        c.execute('''
+            CREATE INDEX IF NOT EXISTS idx_sessions_agent_user_last_used
+            ON sessions_agent (user_id, last_used_at)
+        ''')
+
+        # Historial de chat que muestra app.py (se lee por páginas, del más reciente al más antiguo)
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS chat_messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                session_id TEXT NOT NULL,
+                role TEXT NOT NULL,
+                content TEXT NOT NULL,
+                created_at TIMESTAMP NOT NULL
+            )
+        ''')
+        c.execute('''
+            CREATE INDEX IF NOT EXISTS idx_chat_messages_session
+            ON chat_messages (session_id, id)
+        ''')
+
+        # Consumo de tokens y de recuperación agregado por sesión y por día; el
+        # agente escribe estas tablas (multi_tool_agent/usage.py)
+        create_usage_tables(conn)
+
+        conn.commit()
 
 def get_db():
-    """Obtener conexión a la base de datos"""
-    db_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sessions.db')
-    return sqlite3.connect(db_path)
+    """Obtener una conexión nueva a la base de datos (el llamador debe cerrarla)"""
+    return configure_connection(sqlite3.connect(DB_PATH, timeout=BUSY_TIMEOUT_MS / 1000))
 
 def save_session(session_id, user_id, app_name):
     """Guardar o actualizar una sesión en la base de datos"""
-    conn = get_db()
-    c = conn.cursor()
     now = datetime.now().isoformat()
-    
+
     try:
-        c.execute('''
-            INSERT INTO sessions_agent (session_id, user_id, app_name, created_at, last_used_at, is_active)
-            VALUES (?, ?, ?, ?, ?, 1)
-            ON CONFLICT(session_id) DO UPDATE SET
-                last_used_at = ?,
-                is_active = 1
-        ''', (session_id, user_id, app_name, now, now, now))
-        
-        conn.commit()
+        with db_connection() as conn:
+            conn.execute('''
+                INSERT INTO sessions_agent (session_id, user_id, app_name, created_at, last_used_at, is_active)
+                VALUES (?, ?, ?, ?, ?, 1)
+                ON CONFLICT(session_id) DO UPDATE SET
+                    last_used_at = ?,
+                    is_active = 1
+            ''', (session_id, user_id, app_name, now, now, now))
+
+            conn.commit()
         return True
     except Exception as e:
         print(f"Error al guardar la sesión: {e}")
         return False
-    finally:
-        conn.close()
-
-def get_session(session_id):
-    """Obtener una sesión de la base de datos"""
-    conn = get_db()
-    c = conn.cursor()
-    
+
+def get_session(session_id, touch=True):
+    """Obtener una sesión de la base de datos (y registrar su uso si existe)"""
     try:
-        c.execute('SELECT * FROM sessions_agent WHERE session_id = ? AND is_active = 1', (session_id,))
-        session = c.fetchone()
+        with db_connection() as conn:
+            session = conn.execute(
+                'SELECT 1 FROM sessions_agent WHERE session_id = ? AND is_active = 1', (session_id,)
+            ).fetchone()
+        if session is not None and touch:
+            touch_session(session_id)
         return session is not None
     except Exception as e:
         print(f"Error al obtener la sesión: {e}")
         return False
-    finally:
-        conn.close()
 
 def deactivate_session(session_id):
     """Desactivar una sesión en la base de datos"""
-    conn = get_db()
-    c = conn.cursor()
-    
     try:
-        c.execute('UPDATE sessions_agent SET is_active = 0 WHERE session_id = ?', (session_id,))
-        conn.commit()
+        with db_connection() as conn:
+            conn.execute('UPDATE sessions_agent SET is_active = 0 WHERE session_id = ?', (session_id,))
+            conn.commit()
         return True
     except Exception as e:
         print(f"Error al desactivar la sesión: {e}")
         return False
-    finally:
-        conn.close()
+
+def save_message(session_id, role, content):
+    """Guardar un mensaje del chat; regresa su id o None si falla"""
+    try:
+        with db_connection() as conn:
+            cursor = conn.execute(
+                'INSERT INTO chat_messages (session_id, role, content, created_at) VALUES (?, ?, ?, ?)',
+                (session_id, role, content, datetime.now().isoformat()),
+            )
+            conn.commit()
+        return cursor.lastrowid
+    except Exception as e:
+        print(f"Error al guardar el mensaje: {e}")
+        return None
+
+def get_messages(session_id, limit, before_id=None):
+    """Hasta `limit` mensajes de la sesión anteriores a `before_id`, en orden cronológico"""
+    try:
+        with db_connection() as conn:
+            rows = conn.execute('''
+                SELECT id, role, content FROM chat_messages
+                WHERE session_id = ? AND id < ?
+                ORDER BY id DESC
+                LIMIT ?
+            ''', (session_id, before_id if before_id is not None else 2 ** 63 - 1, limit)).fetchall()
+        return [{"id": row[0], "role": row[1], "content": row[2]} for row in reversed(rows)]
+    except Exception as e:
+        print(f"Error al obtener los mensajes: {e}")
+        return []
+
+def has_messages_before(session_id, message_id):
+    """Indica si la sesión tiene mensajes anteriores a `message_id`"""
+    try:
+        with db_connection() as conn:
+            return conn.execute(
+                'SELECT 1 FROM chat_messages WHERE session_id = ? AND id < ? LIMIT 1', (session_id, message_id)
+            ).fetchone() is not None
+    except Exception as e:
+        print(f"Error al consultar el historial: {e}")
+        return False
+
+class TouchBuffer:
+    """Buffer write-behind para las actualizaciones de last_used_at.
+
+    Registrar el uso de una sesión solo escribe en memoria; un hilo en segundo
+    plano aplica todas las actualizaciones pendientes en una sola transacción.
+    """
+
+    def __init__(self, flush_seconds=TOUCH_FLUSH_SECONDS, flush_size=TOUCH_FLUSH_SIZE):
+        self.flush_seconds = flush_seconds
+        self.flush_size = flush_size
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def touch(self, session_id):
+        with self._lock:
+            self._pending[session_id] = datetime.now().isoformat()
+            pending = len(self._pending)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="db-touch-flusher", daemon=True)
+                self._thread.start()
+        if pending >= self.flush_size:
+            self._wakeup.set()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_seconds)
+            self._wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        """Escribe en lote las actualizaciones pendientes; regresa cuántas se aplicaron"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        try:
+            with db_connection() as conn:
+                conn.executemany(
+                    'UPDATE sessions_agent SET last_used_at = ? WHERE session_id = ?',
+                    [(used_at, session_id) for session_id, used_at in pending.items()],
+                )
+                conn.commit()
+            return len(pending)
+        except Exception as e:
+            print(f"Error al actualizar last_used_at: {e}")
+            # Reintentar en el siguiente ciclo sin perder usos más recientes
+            with self._lock:
+                for session_id, used_at in pending.items():
+                    self._pending.setdefault(session_id, used_at)
+            return 0
+
+
+_touch_buffer = TouchBuffer()
+
+
+def touch_session(session_id):
+    """Registrar el uso de una sesión (se escribe en lote, no de inmediato)"""
+    _touch_buffer.touch(session_id)
+
+
+def flush_touches():
+    """Forzar la escritura de los usos de sesión pendientes"""
+    return _touch_buffer.flush()
+
+
+atexit.register(flush_touches)
@@ -1 +1,20 @@
-from . import agent
\ No newline at end of file
+import importlib
+import os
+
+from dotenv import load_dotenv
+
+# Los módulos del paquete leen su configuración con os.getenv al importarse:
+# el .env de la raíz se carga aquí, antes de cualquiera de ellos (main.py,
+# serve.py, uvicorn y los scripts importan el paquete antes que el agente).
+# Las variables ya definidas en el entorno tienen prioridad.
+load_dotenv(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".env"))
+
+
+def __getattr__(name):
+    # El agente (ADK, Vertex AI) se importa hasta que alguien lo pide, así
+    # `multi_tool_agent.corpus`, `.metrics`, etc. se cargan sin el SDK completo.
+    if name == "agent":
+        return importlib.import_module(".agent", __name__)
+    if name == "root_agent":
+        return importlib.import_module(".agent", __name__).root_agent
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -12,19 +12,23 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import asyncio
 import os
 import logging
 import json
-from typing import Any, Dict
+import threading
+import time
+from typing import Any, Dict, List, Optional, Set, Tuple
 
 from google.adk.agents import Agent
 from google.adk.tools.retrieval.vertex_ai_rag_retrieval import VertexAiRagRetrieval
 from vertexai.preview import rag
-from google.api_core import retry
 from google.api_core import exceptions as google_exceptions
-import google.generativeai as genai
+from google.cloud import aiplatform_v1beta1
 
-from dotenv import load_dotenv
+from . import answer_cache, compaction, metrics, prefetch, resilience, usage
+from .cache import get_retrieval_cache
+from .postprocess import config_signature, postprocess_matches
 from .prompts import return_instructions_root
 
 # Configurar logging con formato detallado
@@ -34,69 +38,315 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-load_dotenv()
+# Backend de recuperación: "vertex" (Vertex RAG) o "local" (índice BM25 en proceso)
+RAG_BACKEND = os.getenv("RAG_BACKEND", "vertex").lower()
+# Usar el índice local cuando Vertex responde con errores de cuota/disponibilidad
+RAG_LOCAL_FALLBACK = os.getenv("RAG_LOCAL_FALLBACK", "TRUE").upper() == "TRUE"
+
+# Búsquedas exactas por código/título y filtro por área con el índice de metadata
+RAG_METADATA_FILTERS = os.getenv("RAG_METADATA_FILTERS", "TRUE").upper() == "TRUE"
+# Si el filtro por área deja menos resultados que esto, se busca en todo el corpus
+MIN_FILTERED_RESULTS = 3
+
+# Errores transitorios de Vertex que se reintentan
+RETRY_EXCEPTIONS = (
+    google_exceptions.ResourceExhausted,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.DeadlineExceeded,
+)
+# Errores que activan el respaldo con el índice local (incluye circuito abierto y presupuesto agotado)
+FALLBACK_EXCEPTIONS = RETRY_EXCEPTIONS + (
+    resilience.CircuitOpenError,
+    resilience.DeadlineExceededError,
+)
+
+
+_rag_clients: Dict[str, Any] = {}
+_rag_clients_lock = threading.Lock()
+
+
+def _rag_service_client(location: str):
+    """Cliente de Vertex RAG por región (los clientes gapic son seguros entre hilos)"""
+    with _rag_clients_lock:
+        client = _rag_clients.get(location)
+        if client is None:
+            client = _rag_clients[location] = aiplatform_v1beta1.VertexRagServiceClient(
+                client_options={"api_endpoint": f"{location}-aiplatform.googleapis.com"}
+            )
+        return client
+
 
 class CustomVertexAiRagRetrieval(VertexAiRagRetrieval):
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, backend: str = RAG_BACKEND, local_fallback: bool = RAG_LOCAL_FALLBACK, **kwargs):
         super().__init__(*args, **kwargs)
-    
-    @retry.Retry(
-        predicate=retry.if_exception_type(
-            google_exceptions.ResourceExhausted,
-            google_exceptions.ServiceUnavailable,
-            google_exceptions.DeadlineExceeded
+        self.backend = backend
+        self.local_fallback = local_fallback
+        self.cache = get_retrieval_cache()
+        self._metadata_index_failed = False
+        self.resilience = resilience.ResiliencePolicy(retry_on=RETRY_EXCEPTIONS)
+
+    async def process_llm_request(self, *, tool_context, llm_request) -> None:
+        # Con modelos Gemini 2 la clase base registra la recuperación nativa de
+        # Vertex y la herramienta nunca se ejecuta en el proceso. Se declara como
+        # función para que todas las consultas pasen por _arun.
+        await super(VertexAiRagRetrieval, self).process_llm_request(
+            tool_context=tool_context, llm_request=llm_request
         )
-    )
-    async def _arun(self, query: str) -> Dict[str, Any]:
-        """Ejecuta la búsqueda RAG con reintentos automáticos"""
+
+    async def run_async(self, *, args: Dict[str, Any], tool_context) -> Any:
+        start = time.perf_counter()
         try:
-            # Configurar el cliente RAG
-            corpus = rag.RAGCorpus(
-                project=os.getenv("GOOGLE_CLOUD_PROJECT"),
-                location="us-central1",
-                corpus_id="dintelligence-knowledge-base"
+            result = await self._arun(
+                args["query"],
+                session_id=metrics.session_id_of(tool_context),
+                area=tool_context.state.get("area"),
             )
+            usage.record_tool_result(tool_context, result)
+            return result
+        finally:
+            metrics.record_tool_time(tool_context, time.perf_counter() - start)
 
-            # Realizar la búsqueda
-            result = await corpus.search_async(
-                query=query,
-                max_results=5,  # Ajustar según necesidades
-                vectorize_query=True
-            )
+    def _metadata_index(self):
+        """Índice de metadata, o None si está deshabilitado o no se pudo cargar"""
+        if not RAG_METADATA_FILTERS or self._metadata_index_failed:
+            return None
+        from .metadata_index import get_metadata_index
+
+        try:
+            return get_metadata_index()
+        except Exception as e:
+            logger.warning(f"Índice de metadata no disponible, se busca sin filtros: {str(e)}")
+            self._metadata_index_failed = True
+            return None
 
-            # Procesar y retornar resultados
-            return {
-                "matches": [
-                    {
-                        "text": chunk.text,
-                        "metadata": chunk.metadata,
-                        "score": chunk.semantic_similarity_score
-                    }
-                    for chunk in result.chunks
+    def _vertex_search(
+        self, query: str, documents: Optional[Set[str]] = None, timeout: Optional[float] = None
+    ) -> List[Dict[str, Any]]:
+        """Consulta síncrona al corpus de Vertex RAG (limitada a `documents` si se indica).
+
+        Llama a `RetrieveContexts` directamente en lugar de `rag.retrieval_query`,
+        que no acepta timeout: el RPC termina con el presupuesto de la solicitud.
+        """
+        index = self._metadata_index()
+        rag_resources = self.vertex_rag_store.rag_resources or [
+            rag.RagResource(rag_corpus=corpus) for corpus in self.vertex_rag_store.rag_corpora or []
+        ]
+        if documents and index is not None:
+            from .metadata_index import rag_file_ids
+
+            file_ids = rag_file_ids(index.files_for_documents(documents))
+            if file_ids:
+                rag_resources = [
+                    rag.RagResource(rag_corpus=resource.rag_corpus, rag_file_ids=file_ids)
+                    for resource in rag_resources
                 ]
+        # projects/{proyecto}/locations/{región} del corpus
+        parent = "/".join(rag_resources[0].rag_corpus.split("/")[:4])
+        store = aiplatform_v1beta1.RetrieveContextsRequest.VertexRagStore
+        request = aiplatform_v1beta1.RetrieveContextsRequest(
+            parent=parent,
+            vertex_rag_store=store(
+                rag_resources=[
+                    store.RagResource(rag_corpus=resource.rag_corpus, rag_file_ids=list(resource.rag_file_ids or []))
+                    for resource in rag_resources
+                ],
+                vector_distance_threshold=self.vertex_rag_store.vector_distance_threshold,
+            ),
+            query=aiplatform_v1beta1.RagQuery(text=query, similarity_top_k=self.vertex_rag_store.similarity_top_k),
+        )
+        response = _rag_service_client(parent.split("/")[3]).retrieve_contexts(request=request, timeout=timeout)
+        # Solo los contextos: la metadata se completa fuera del presupuesto del RPC (_enrich_vertex_matches)
+        return [
+            {
+                "text": context.text,
+                "metadata": {
+                    "source_display_name": context.source_display_name,
+                    "source_uri": context.source_uri,
+                },
+                "score": context.score,
             }
+            for context in response.contexts.contexts
+        ]
+
+    def _enrich_vertex_matches(self, matches: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Completa los contextos de Vertex con id, documento_origen, parte y numero_chunk del chunk
+        local que corresponde al texto (para unir chunks adyacentes) y el encabezado de su política.
+
+        Corre después de la llamada a Vertex; usa el almacén de chunks solo si ya está construido.
+        """
+        index = self._metadata_index()
+        if index is None:
+            return matches
+        from .chunk_store import get_chunk_store
+
+        store = get_chunk_store(build=False)
+        for match in matches:
+            file_name = match["metadata"].get("source_display_name")
+            documents = index.by_file.get(os.path.basename(file_name or ""), [])
+            position = store.find_text(match["text"], documents) if store is not None else None
+            if position is None:
+                # Solo a partir del nombre del archivo
+                header = index.metadata_for_file(file_name)
+            else:
+                metadata = store.metadata(position)
+                header = {
+                    "id": store.chunk_id(position),
+                    "numero_chunk": metadata.get("numero_chunk"),
+                    **index.metadata_for_document(metadata.get("documento_origen") or documents[0], metadata.get("parte")),
+                }
+            match["metadata"] = {**header, **match["metadata"]}
+        return matches
+
+    def _local_search(self, query: str, documents: Optional[Set[str]] = None) -> List[Dict[str, Any]]:
+        """Consulta al índice BM25 local"""
+        from .local_retrieval import get_local_backend
+
+        return get_local_backend().search(
+            query, top_k=self.vertex_rag_store.similarity_top_k or 10, documents=documents
+        )
+
+    def _direct_lookup(self, query: str) -> Optional[List[Dict[str, Any]]]:
+        """Chunks del documento si la consulta es su código o su título exacto"""
+        index = self._metadata_index()
+        found = index.lookup(query) if index is not None else None
+        if found is None:
+            return None
+        document, part = found
+        logger.info(f"Consulta resuelta con el índice de metadata: {document} (parte {part})")
+        # Solo los chunks y el encabezado de esa política, no los de las demás del mismo archivo
+        header = index.metadata_for_document(document, part)
+        return [
+            {"text": chunk["text"], "metadata": {"id": chunk["id"], **chunk["metadata"], **header}, "score": 1.0}
+            for chunk in index.document_chunks(document, part)
+        ]
+
+    def _area_documents(self, query: str, area: Optional[str]) -> Optional[Set[str]]:
+        """Documentos del área de la sesión o de la nombrada en la consulta; None = sin filtro"""
+        index = self._metadata_index()
+        if index is None:
+            return None
+        area = area or index.detect_area(query)
+        documents = index.documents_in_area(area) if area else None
+        if documents:
+            logger.info(f"Búsqueda limitada al área {area!r} ({len(documents)} documentos)")
+            return documents
+        return None
+
+    async def _backend_search(
+        self, query: str, documents: Optional[Set[str]], deadline: resilience.Deadline
+    ) -> Tuple[List[Dict[str, Any]], bool]:
+        """Búsqueda en el backend configurado; regresa (resultados, se usó el respaldo local)"""
+        if self.backend == "local":
+            return await asyncio.to_thread(self._local_search, query, documents), False
+        try:
+            # Reintentos, circuit breaker y hedging dentro del presupuesto de la solicitud;
+            # cada intento corre en el pool acotado de la política con el tiempo restante como timeout
+            matches = await self.resilience.call(
+                lambda: self.resilience.run_blocking(
+                    self._vertex_search, query, documents, max(0.1, deadline.remaining())
+                ),
+                deadline,
+            )
+            return matches, False
+        except FALLBACK_EXCEPTIONS as e:
+            if not self.local_fallback:
+                raise
+            logger.warning(f"Vertex RAG no disponible, usando índice local: {str(e)}")
+            metrics.RETRIEVAL_FALLBACKS.inc(reason=type(e).__name__)
+            return await asyncio.to_thread(self._local_search, query, documents), True
+
+    def _resource_id(self) -> str:
+        """Identificador del recurso consultado, parte de la llave de caché"""
+        corpora = [
+            getattr(resource, "rag_corpus", "") or ""
+            for resource in (self.vertex_rag_store.rag_resources or [])
+        ]
+        corpora.extend(self.vertex_rag_store.rag_corpora or [])
+        return f"{self.backend}:{','.join(corpora)}:{config_signature()}"
+
+    async def _arun(
+        self,
+        query: str,
+        session_id: Optional[str] = None,
+        area: Optional[str] = None,
+        use_prefetch: bool = True,
+    ) -> Dict[str, Any]:
+        """Ejecuta la búsqueda RAG (prefetch, caché, índice de metadata y backend)"""
+        start = time.perf_counter()
+        prefetcher = prefetch.get_prefetcher()
+        # La búsqueda anticipada misma no puede reclamar su propio resultado
+        if use_prefetch and session_id is not None and prefetcher is not None:
+            prefetched = await prefetcher.claim(session_id, query, area)
+            if prefetched is not None:
+                self._record_metrics("prefetch", start, prefetched, session_id)
+                return prefetched
+
+        cache_key = None
+        if self.cache is not None:
+            cache_key = self.cache.make_key(
+                query,
+                self._resource_id() + (f":area={area}" if area else ""),
+                self.vertex_rag_store.similarity_top_k,
+                self.vertex_rag_store.vector_distance_threshold,
+            )
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                logger.info(f"Consulta RAG servida desde caché: {query} ({self.cache.stats()['hit_rate']:.0%} aciertos)")
+                self._record_metrics("cache", start, cached, session_id)
+                return cached
 
-        except Exception as e:
-            logger.error(f"Error en RAG retrieval: {str(e)}")
-            raise
         try:
             # Registrar la consulta que se está enviando
-            logger.info(f"Enviando consulta a RAG: {query}")
-            
-            result = await super()._arun(query)
-            
+            logger.info(f"Enviando consulta a RAG ({self.backend}): {query}")
+            used_fallback = False
+
+            matches = self._direct_lookup(query)
+            if matches is not None:
+                source = "metadata"
+            else:
+                deadline = self.resilience.deadline()
+                documents = self._area_documents(query, area)
+                matches, used_fallback = await self._backend_search(query, documents, deadline)
+                if documents is not None and len(matches) < MIN_FILTERED_RESULTS:
+                    logger.info("Pocos resultados dentro del área, buscando en todo el corpus")
+                    matches, used_fallback = await self._backend_search(query, None, deadline)
+                source = "fallback" if used_fallback else self.backend
+                if source == "vertex":
+                    matches = await asyncio.to_thread(self._enrich_vertex_matches, matches)
+
             # Registrar la respuesta exitosa
-            logger.info("Consulta RAG exitosa")
+            logger.info(f"Consulta RAG exitosa: {len(matches)} resultados")
+            # Vertex regresa distancias; el índice local, scores BM25
+            matches = postprocess_matches(
+                matches, score_is_distance=source == "vertex"
+            )
+            result = {"matches": matches}
+            # Los resultados del respaldo local no se guardan bajo la llave de Vertex
+            if cache_key is not None and not used_fallback:
+                self.cache.set(cache_key, result)
+            self._record_metrics(source, start, result, session_id)
             return result
-            
+
         except google_exceptions.InvalidArgument as e:
+            metrics.ERRORS.inc(stage="retrieval", type=type(e).__name__)
             logger.error("Error de argumento inválido en RAG: " + str(e))
             logger.error("Detalles de la solicitud: " + json.dumps({'query': query}))
             raise
         except Exception as e:
-            logger.error("Error inesperado en RAG: " + str(e))
+            metrics.ERRORS.inc(stage="retrieval", type=type(e).__name__)
+            logger.error(f"Error en RAG retrieval: {str(e)}")
             raise
 
+    def _record_metrics(self, source: str, start: float, result: Dict[str, Any], session_id: Optional[str]) -> None:
+        metrics.record_retrieval(
+            backend=self.backend,
+            source=source,
+            seconds=time.perf_counter() - start,
+            result_count=len(result["matches"]),
+            payload_bytes=len(json.dumps(result, ensure_ascii=False, default=str).encode("utf-8")),
+            session_id=session_id,
+        )
+
 class ProcessorAgent(Agent):
     """Agente principal para procesar documentos y responder consultas"""
     
@@ -121,7 +371,24 @@ class ProcessorAgent(Agent):
                 description="Agente experto en procesar y analizar documentos y procesos empresariales",
                 model="gemini-2.5-flash",
                 instruction=return_instructions_root(),
-                tools=[retrieval_tool]
+                tools=[retrieval_tool],
+                # La caché de respuestas va primero: si responde, el agente no se ejecuta
+                before_agent_callback=[
+                    answer_cache.before_agent_callback,
+                    prefetch.before_agent_callback,
+                    metrics.before_agent_callback,
+                    usage.before_agent_callback,
+                ],
+                # prefetch antes que usage: el espacio sin reclamar se cuenta en la invocación
+                after_agent_callback=[
+                    metrics.after_agent_callback,
+                    prefetch.after_agent_callback,
+                    usage.after_agent_callback,
+                    answer_cache.after_agent_callback,
+                ],
+                # La compactación reduce el historial antes de medir la llamada al modelo
+                before_model_callback=[compaction.before_model_callback, metrics.before_model_callback],
+                after_model_callback=[metrics.after_model_callback, usage.after_model_callback],
             )
             logger.info("Agente configurado exitosamente")
             logger.info("Modelo configurado: gemini-2.5-flash")
@@ -134,10 +401,29 @@ class ProcessorAgent(Agent):
             }))
             raise
 
-# Instanciar el agente principal
-try:
-    root_agent = ProcessorAgent()
-    logger.info("Agente principal instanciado correctamente")
-except Exception as e:
-    logger.error(f"Error al instanciar el agente principal: {str(e)}")
-    raise
\ No newline at end of file
+# Instancia del agente principal (construcción diferida)
+_root_agent = None
+_root_agent_lock = threading.Lock()
+
+
+def get_root_agent() -> ProcessorAgent:
+    """Agente principal, construido en el primer uso (o en el warmup)"""
+    global _root_agent
+    if _root_agent is None:
+        with _root_agent_lock:
+            if _root_agent is None:
+                try:
+                    _root_agent = ProcessorAgent()
+                    logger.info("Agente principal instanciado correctamente")
+                except Exception as e:
+                    logger.error(f"Error al instanciar el agente principal: {str(e)}")
+                    raise
+    return _root_agent
+
+
+def __getattr__(name):
+    # `root_agent` se construye al primer acceso (el cargador del ADK lo pide
+    # con getattr), no al importar el módulo.
+    if name == "root_agent":
+        return get_root_agent()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,264 @@
+"""Caché de respuestas completas para preguntas repetidas.
+
+Buena parte del tráfico es la misma pregunta de procedimiento con redacción
+casi idéntica, y cada vez se ejecuta el ciclo completo del agente (Gemini,
+recuperación y Gemini otra vez). Esta caché guarda la respuesta final de dos
+secciones con sus referencias y la sirve directamente desde
+`before_agent_callback`, sin llamar al modelo.
+
+- La llave son el área de la sesión (`state["area"]`) y los términos
+  normalizados de la pregunta (sin acentos, stopwords ni plurales, pero con
+  las negaciones: "¿se puede…?" y "¿no se puede…?" son preguntas distintas);
+  si no hay coincidencia exacta se busca una pregunta guardada de la misma
+  área y con las mismas negaciones con similitud de Jaccard mayor o igual a
+  `ANSWER_CACHE_SIMILARITY`.
+- Las entradas están asociadas a la versión del corpus, a la del prompt
+  (`return_instructions_root`) y a una generación compartida por los workers
+  (`ANSWER_CACHE_GENERATION_FILE`); si cualquiera cambia, se invalidan.
+  `invalidate` vacía la caché del worker que atiende la solicitud y cambia la
+  generación, así que los demás workers la vacían en su siguiente revisión de
+  versión (a lo más `CORPUS_VERSION_CHECK_SECONDS`).
+- Solo se sirve en el primer turno de una sesión (sin contexto previo) y solo
+  se guardan respuestas que usaron la herramienta de recuperación; las
+  sesiones con `skip_answer_cache` (lotes de validación) no leen ni escriben.
+"""
+
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+from typing import Any, Dict, Optional, Set
+
+from google.genai import types
+
+from . import metrics
+from .cache import RetrievalCache, get_corpus_version
+from .corpus import REPO_ROOT
+from .local_retrieval import strip_accents, tokenize
+from .prompts import return_instructions_root
+
+logger = logging.getLogger(__name__)
+
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "TRUE").upper() == "TRUE"
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "256"))
+ANSWER_CACHE_TTL_SECONDS = float(os.getenv("ANSWER_CACHE_TTL_SECONDS", "21600"))
+# Similitud mínima (Jaccard de términos) para reutilizar una pregunta parecida
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.85"))
+# Archivo con la generación de la caché, compartido por los workers del servidor
+ANSWER_CACHE_GENERATION_FILE = os.getenv(
+    "ANSWER_CACHE_GENERATION_FILE", os.path.join(REPO_ROOT, "data", "cache", "answer_cache_generation")
+)
+# Preguntas con menos términos (saludos, "gracias") no se guardan
+MIN_QUESTION_TERMS = 2
+# Negaciones: varias son stopwords de la búsqueda, pero cambian la respuesta
+NEGATION_WORDS = frozenset(
+    "no ni sin nada nunca jamas tampoco nadie ningun ninguna ninguno ningunos ningunas".split()
+)
+_WORD_RE = re.compile(r"[a-z0-9ñ]+")
+
+_prompt_version: Optional[str] = None
+
+
+def prompt_version() -> str:
+    """Hash corto del prompt del agente"""
+    global _prompt_version
+    if _prompt_version is None:
+        _prompt_version = hashlib.sha256(return_instructions_root().encode("utf-8")).hexdigest()[:12]
+    return _prompt_version
+
+
+def cache_generation(path: str = ANSWER_CACHE_GENERATION_FILE) -> str:
+    """Generación vigente de la caché (vacía si nunca se ha invalidado)"""
+    try:
+        with open(path, encoding="utf-8") as f:
+            return f.read().strip()
+    except OSError:
+        return ""
+
+
+def bump_generation(path: str = ANSWER_CACHE_GENERATION_FILE) -> str:
+    """Nueva generación: invalida la caché de respuestas en todos los workers"""
+    generation = f"{time.time():.6f}-{os.getpid()}"
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(generation)
+    os.replace(tmp_path, path)
+    return generation
+
+
+def answer_version() -> str:
+    """Versión de las respuestas: corpus + prompt + generación compartida"""
+    return f"{get_corpus_version()}:{prompt_version()}:{cache_generation()}"
+
+
+def question_terms(question: str) -> Set[str]:
+    """Términos de búsqueda de la pregunta más las negaciones que contiene"""
+    words = _WORD_RE.findall(strip_accents(question.lower()))
+    return set(tokenize(question)) | NEGATION_WORDS.intersection(words)
+
+
+def _content_text(content) -> str:
+    if content is None or not content.parts:
+        return ""
+    return "".join(part.text for part in content.parts if part.text)
+
+
+class AnswerCache(RetrievalCache):
+    """Caché LRU + TTL de respuestas finales con búsqueda aproximada"""
+
+    def __init__(
+        self,
+        max_entries: int = ANSWER_CACHE_MAX_ENTRIES,
+        ttl_seconds: float = ANSWER_CACHE_TTL_SECONDS,
+        similarity: float = ANSWER_CACHE_SIMILARITY,
+        version_provider=answer_version,
+    ):
+        super().__init__(max_entries=max_entries, ttl_seconds=ttl_seconds, version_provider=version_provider)
+        self.similarity = similarity
+        self.fuzzy_hits = 0
+
+    @staticmethod
+    def question_key(terms: Set[str], area: Optional[str] = None) -> str:
+        return f"{area or ''}|{' '.join(sorted(terms))}"
+
+    def _closest_key(self, terms: Set[str], area: Optional[str] = None) -> Optional[str]:
+        """Llave de la pregunta guardada más parecida (misma área y mismas negaciones) por Jaccard"""
+        negations = terms & NEGATION_WORDS
+        best, best_score = None, 0.0
+        with self._lock:
+            for key, (_, value) in self._entries.items():
+                stored = value["terms"]
+                if value.get("area") != area or stored & NEGATION_WORDS != negations:
+                    continue
+                score = len(terms & stored) / len(terms | stored)
+                if score > best_score:
+                    best, best_score = key, score
+        return best if best_score >= self.similarity else None
+
+    def lookup(self, question: str, area: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """Respuesta guardada para la pregunta en el área (exacta o aproximada)"""
+        terms = question_terms(question)
+        if len(terms) < MIN_QUESTION_TERMS:
+            return None
+        value = self.get(self.question_key(terms, area))
+        if value is not None:
+            metrics.ANSWER_CACHE_REQUESTS.inc(result="hit")
+            return value
+        closest = self._closest_key(terms, area)
+        if closest is not None:
+            value = self.get(closest)
+            with self._lock:
+                # La segunda consulta no cuenta como otro fallo
+                self.misses -= 1
+                if value is not None:
+                    self.fuzzy_hits += 1
+        metrics.ANSWER_CACHE_REQUESTS.inc(result="miss" if value is None else "fuzzy_hit")
+        return value
+
+    def store(self, question: str, answer: str, area: Optional[str] = None) -> bool:
+        terms = question_terms(question)
+        if len(terms) < MIN_QUESTION_TERMS or not answer.strip():
+            return False
+        self.set(
+            self.question_key(terms, area),
+            {"question": question, "answer": answer, "terms": terms, "area": area},
+        )
+        return True
+
+    def invalidate(self, question: Optional[str] = None) -> int:
+        """Borra una pregunta (exacta, en todas las áreas) o toda la caché; regresa las entradas borradas
+        en este worker.
+
+        Los demás workers no comparten la memoria: se cambia la generación
+        compartida y cada uno vacía toda su caché en su siguiente revisión de versión.
+        """
+        try:
+            bump_generation()
+        except OSError as e:
+            logger.warning(f"No se pudo propagar la invalidación a los demás workers: {str(e)}")
+        with self._lock:
+            if question is None:
+                removed = len(self._entries)
+                self._entries.clear()
+                return removed
+            terms = question_terms(question)
+            keys = [key for key, (_, value) in self._entries.items() if value["terms"] == terms]
+            for key in keys:
+                del self._entries[key]
+            return len(keys)
+
+    def stats(self) -> Dict[str, Any]:
+        stats = super().stats()
+        stats["fuzzy_hits"] = self.fuzzy_hits
+        stats["version"] = stats.pop("corpus_version")
+        stats.pop("persistent_hits")
+        return stats
+
+
+_default_cache: Optional[AnswerCache] = None
+_default_lock = threading.Lock()
+
+
+def get_answer_cache() -> Optional[AnswerCache]:
+    """Caché compartida por proceso, o `None` si está deshabilitada"""
+    global _default_cache
+    if not ANSWER_CACHE_ENABLED:
+        return None
+    with _default_lock:
+        if _default_cache is None:
+            _default_cache = AnswerCache()
+    return _default_cache
+
+
+# ---------------------------------------------------------------------------
+# Callbacks del agente
+# ---------------------------------------------------------------------------
+
+def _is_first_turn(callback_context) -> bool:
+    """La sesión no tiene eventos previos a la invocación actual"""
+    session = callback_context._invocation_context.session
+    return all(event.invocation_id == callback_context.invocation_id for event in session.events)
+
+
+def before_agent_callback(callback_context):
+    """Sirve la respuesta guardada y evita la ejecución del agente"""
+    cache = get_answer_cache()
+    if cache is None or not _is_first_turn(callback_context):
+        return None
+    # Los lotes de validación (batch.py) piden respuestas nuevas del modelo
+    if callback_context.state.get("skip_answer_cache"):
+        return None
+    question = _content_text(callback_context.user_content)
+    cached = cache.lookup(question, callback_context.state.get("area"))
+    if cached is None:
+        return None
+    logger.info(
+        f"Respuesta servida desde caché para: {question!r} "
+        f"(pregunta guardada: {cached['question']!r}, {cache.stats()['hit_rate']:.0%} aciertos)"
+    )
+    return types.Content(role="model", parts=[types.Part(text=cached["answer"])])
+
+
+def after_agent_callback(callback_context):
+    """Guarda la respuesta final del primer turno si se basó en la recuperación"""
+    cache = get_answer_cache()
+    if cache is None or not _is_first_turn(callback_context):
+        return None
+    # Las respuestas de los lotes de validación no se comparten con el tráfico normal
+    if callback_context.state.get("skip_answer_cache"):
+        return None
+    events = [
+        event for event in callback_context._invocation_context.session.events
+        if event.invocation_id == callback_context.invocation_id
+    ]
+    used_retrieval = any(event.get_function_calls() for event in events)
+    answers = [
+        _content_text(event.content) for event in events
+        if event.author != "user" and not event.partial and _content_text(event.content)
+    ]
+    if used_retrieval and answers:
+        cache.store(_content_text(callback_context.user_content), answers[-1], callback_context.state.get("area"))
+    return None
@@ -0,0 +1,185 @@
+"""Respuestas en lote para validar el agente con conjuntos de preguntas.
+
+El equipo de procesos validaba las respuestas pegando las preguntas una por
+una en la interfaz de Streamlit. Este módulo toma un archivo JSONL de
+preguntas y ejecuta cada una en su propia sesión (en memoria, sin historial
+compartido) con el `Runner` del ADK dentro del mismo proceso:
+
+- un semáforo limita las preguntas simultáneas (`--concurrency`),
+- todas comparten la caché de recuperación del proceso, así que los
+  documentos que se repiten entre preguntas se consultan una sola vez,
+- la caché de respuestas no se usa salvo que se pida (`--answer-cache`), para
+  que la validación mida respuestas nuevas del modelo,
+- los resultados se emiten como JSONL en el orden en que terminan, cada uno
+  con su latencia.
+
+Cada línea de entrada es un objeto con `question` (y opcionalmente `id`) o
+una cadena JSON. main.py expone lo mismo en `POST /batch` (solo si se configuró
+`ADMIN_TOKEN`, que se envía en el encabezado `X-Admin-Token`).
+
+    python -m multi_tool_agent.batch preguntas.jsonl -o resultados.jsonl --concurrency 8
+    cat preguntas.jsonl | python -m multi_tool_agent.batch - > resultados.jsonl
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+import uuid
+from typing import Any, AsyncIterator, Dict, Iterable, List
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "8"))
+# Límite superior para no agotar la cuota de Gemini/Vertex con un solo lote
+BATCH_MAX_CONCURRENCY = 32
+BATCH_APP_NAME = "multi_tool_agent"
+BATCH_USER_ID = "batch"
+# Clave del estado de sesión que desactiva la caché de respuestas (ver answer_cache)
+SKIP_ANSWER_CACHE_STATE_KEY = "skip_answer_cache"
+
+
+def parse_questions(lines: Iterable[str]) -> List[Dict[str, Any]]:
+    """Preguntas de un JSONL: objetos con `question` (e `id` opcional) o cadenas"""
+    items = []
+    for line_number, line in enumerate(lines, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            data = json.loads(line)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Línea {line_number}: JSON inválido ({e.msg})") from None
+        if isinstance(data, str):
+            data = {"question": data}
+        if not isinstance(data, dict) or not str(data.get("question") or "").strip():
+            raise ValueError(f"Línea {line_number}: se esperaba un objeto con 'question'")
+        items.append({**data, "id": data.get("id", line_number), "question": data["question"].strip()})
+    return items
+
+
+class BatchRunner:
+    """Ejecuta preguntas en sesiones aisladas con concurrencia limitada"""
+
+    def __init__(self, concurrency: int = BATCH_CONCURRENCY, use_answer_cache: bool = False):
+        from google.adk.runners import Runner
+        from google.adk.sessions import InMemorySessionService
+
+        from .agent import get_root_agent
+
+        self.concurrency = max(1, min(concurrency, BATCH_MAX_CONCURRENCY))
+        self.use_answer_cache = use_answer_cache
+        self.session_service = InMemorySessionService()
+        self.runner = Runner(app_name=BATCH_APP_NAME, agent=get_root_agent(), session_service=self.session_service)
+
+    async def answer(self, item: Dict[str, Any]) -> Dict[str, Any]:
+        """Respuesta final de una pregunta con su latencia y las consultas de recuperación"""
+        from google.genai import types
+
+        session_id = f"batch-{uuid.uuid4().hex}"
+        state = {} if self.use_answer_cache else {SKIP_ANSWER_CACHE_STATE_KEY: True}
+        result: Dict[str, Any] = {"id": item["id"], "question": item["question"]}
+        answer_parts: List[str] = []
+        queries: List[str] = []
+        start = time.perf_counter()
+        try:
+            await self.session_service.create_session(
+                app_name=BATCH_APP_NAME, user_id=BATCH_USER_ID, session_id=session_id, state=state
+            )
+            message = types.Content(role="user", parts=[types.Part(text=item["question"])])
+            async for event in self.runner.run_async(
+                user_id=BATCH_USER_ID, session_id=session_id, new_message=message
+            ):
+                queries.extend(str(call.args.get("query", "")) for call in event.get_function_calls())
+                if event.is_final_response() and event.content and event.content.parts:
+                    answer_parts.extend(part.text for part in event.content.parts if part.text)
+            result["answer"] = "\n".join(answer_parts)
+        except Exception as e:
+            logger.error(f"Error en la pregunta {item['id']!r}: {str(e)}")
+            metrics.ERRORS.inc(stage="batch", type=type(e).__name__)
+            result["answer"] = "\n".join(answer_parts)
+            result["error"] = f"{type(e).__name__}: {e}"
+        finally:
+            # Las sesiones del lote no se reutilizan; liberarlas mantiene acotada la memoria
+            await self.session_service.delete_session(
+                app_name=BATCH_APP_NAME, user_id=BATCH_USER_ID, session_id=session_id
+            )
+        result["latency_ms"] = round((time.perf_counter() - start) * 1000, 1)
+        result["retrieval_queries"] = queries
+        return result
+
+    async def run(self, items: List[Dict[str, Any]]) -> AsyncIterator[Dict[str, Any]]:
+        """Resultados en el orden en que terminan"""
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def limited(item):
+            async with semaphore:
+                return await self.answer(item)
+
+        tasks = [asyncio.create_task(limited(item)) for item in items]
+        try:
+            for finished in asyncio.as_completed(tasks):
+                yield await finished
+        finally:
+            # Si el cliente se desconecta, las preguntas pendientes se cancelan
+            for task in tasks:
+                task.cancel()
+
+
+def summarize(results: List[Dict[str, Any]], seconds: float) -> Dict[str, Any]:
+    latencies = sorted(result["latency_ms"] for result in results)
+    return {
+        "questions": len(results),
+        "errors": sum(1 for result in results if "error" in result),
+        "seconds": round(seconds, 2),
+        "p50_ms": latencies[len(latencies) // 2] if latencies else 0.0,
+        "p95_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] if latencies else 0.0,
+    }
+
+
+async def _run_cli(args) -> Dict[str, Any]:
+    if args.input == "-":
+        items = parse_questions(sys.stdin)
+    else:
+        with open(args.input, encoding="utf-8") as f:
+            items = parse_questions(f)
+    runner = BatchRunner(concurrency=args.concurrency, use_answer_cache=args.answer_cache)
+    print(f"{len(items)} preguntas con concurrencia {runner.concurrency}", file=sys.stderr)
+
+    output = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+    results = []
+    start = time.perf_counter()
+    try:
+        async for result in runner.run(items):
+            results.append(result)
+            output.write(json.dumps(result, ensure_ascii=False) + "\n")
+            output.flush()
+            print(f"[{len(results)}/{len(items)}] {result['id']}: {result['latency_ms']:.0f} ms"
+                  + (f" ({result['error']})" if "error" in result else ""), file=sys.stderr)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    return summarize(results, time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Responder un archivo JSONL de preguntas en lote")
+    parser.add_argument("input", help="Archivo JSONL de preguntas ('-' para leer de stdin)")
+    parser.add_argument("-o", "--output", help="Archivo JSONL de resultados (por defecto stdout)")
+    parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY, help="Preguntas simultáneas")
+    parser.add_argument("--answer-cache", action="store_true", help="Permitir respuestas de la caché de respuestas")
+    args = parser.parse_args()
+
+    summary = asyncio.run(_run_cli(args))
+    print("\nResumen del lote:", file=sys.stderr)
+    for key, value in summary.items():
+        print(f"- {key}: {value}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
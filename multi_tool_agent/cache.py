@@ -0,0 +1,213 @@
+"""Caché de resultados de recuperación con desalojo LRU + TTL.
+
+Las preguntas frecuentes ("cancelaciones en caja", "inventario físico") llegan
+cientos de veces por turno. Esta caché guarda la respuesta del backend de
+recuperación por consulta normalizada, recurso RAG, top_k y umbral de
+distancia. Opcionalmente persiste las entradas en SQLite para sobrevivir a
+reinicios del proceso. Todas las entradas quedan asociadas a la versión del
+corpus y se invalidan cuando ésta cambia.
+"""
+
+import copy
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from .corpus import REPO_ROOT, corpus_signature, snapshot_version
+from .local_retrieval import strip_accents
+
+logger = logging.getLogger(__name__)
+
+RAG_CACHE_ENABLED = os.getenv("RAG_CACHE_ENABLED", "TRUE").upper() == "TRUE"
+RAG_CACHE_MAX_ENTRIES = int(os.getenv("RAG_CACHE_MAX_ENTRIES", "512"))
+RAG_CACHE_TTL_SECONDS = float(os.getenv("RAG_CACHE_TTL_SECONDS", "3600"))
+# Archivo SQLite de la capa persistente, compartido por los workers (vacío = solo
+# memoria); las rutas relativas son relativas a la raíz del repositorio
+RAG_CACHE_DB = os.getenv("RAG_CACHE_DB", "")
+if RAG_CACHE_DB:
+    RAG_CACHE_DB = os.path.join(REPO_ROOT, RAG_CACHE_DB)
+# Cada cuántos segundos se vuelve a calcular la versión del corpus
+CORPUS_VERSION_CHECK_SECONDS = 60.0
+# Cada cuántos segundos se borran de SQLite las entradas expiradas
+PURGE_INTERVAL_SECONDS = 300.0
+
+_PUNCT_RE = re.compile(r"[^\w\s]")
+_SPACES_RE = re.compile(r"\s+")
+
+
+def normalize_query(query: str) -> str:
+    """Minúsculas, sin acentos, sin signos de puntuación y espacios colapsados"""
+    query = strip_accents(query.lower())
+    query = _PUNCT_RE.sub(" ", query)
+    return _SPACES_RE.sub(" ", query).strip()
+
+
+def get_corpus_version() -> str:
+    """Versión del corpus: `CORPUS_VERSION`, la del manifiesto de carga o una firma de data/outputs"""
+    return os.getenv("CORPUS_VERSION") or snapshot_version() or corpus_signature()
+
+
+class RetrievalCache:
+    """Caché LRU + TTL en memoria con una capa SQLite opcional"""
+
+    def __init__(
+        self,
+        max_entries: int = RAG_CACHE_MAX_ENTRIES,
+        ttl_seconds: float = RAG_CACHE_TTL_SECONDS,
+        sqlite_path: Optional[str] = None,
+        version_provider: Callable[[], str] = get_corpus_version,
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.sqlite_path = sqlite_path
+        self._version_provider = version_provider
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._corpus_version: Optional[str] = None
+        self._version_checked_at = 0.0
+        self._purged_at = 0.0
+        self.hits = 0
+        self.persistent_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if sqlite_path:
+            os.makedirs(os.path.dirname(os.path.abspath(sqlite_path)), exist_ok=True)
+            self._conn = sqlite3.connect(sqlite_path, check_same_thread=False)
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS retrieval_cache (
+                    cache_key TEXT PRIMARY KEY,
+                    corpus_version TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    value TEXT NOT NULL
+                )
+            ''')
+            # La purga de expiradas filtra por created_at
+            self._conn.execute(
+                'CREATE INDEX IF NOT EXISTS idx_retrieval_cache_created_at ON retrieval_cache (created_at)'
+            )
+            self._conn.commit()
+
+    @staticmethod
+    def make_key(query: str, rag_resource: str, top_k: Any, distance_threshold: Any) -> str:
+        """Llave de caché a partir de la consulta normalizada y la configuración RAG"""
+        payload = json.dumps(
+            [normalize_query(query), rag_resource, top_k, distance_threshold],
+            ensure_ascii=False,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    @property
+    def corpus_version(self) -> str:
+        """Versión vigente del corpus; si cambió, invalida toda la caché"""
+        now = time.monotonic()
+        if self._corpus_version is None or now - self._version_checked_at > CORPUS_VERSION_CHECK_SECONDS:
+            version = self._version_provider()
+            self._version_checked_at = now
+            if self._corpus_version is not None and version != self._corpus_version:
+                logger.info(f"Versión del corpus cambió ({self._corpus_version} -> {version}), invalidando caché")
+                self._invalidate(keep_version=version)
+            self._corpus_version = version
+        return self._corpus_version
+
+    def _invalidate(self, keep_version: Optional[str] = None) -> None:
+        with self._lock:
+            self._entries.clear()
+            if self._conn is not None:
+                if keep_version is None:
+                    self._conn.execute('DELETE FROM retrieval_cache')
+                else:
+                    self._conn.execute('DELETE FROM retrieval_cache WHERE corpus_version != ?', (keep_version,))
+                self._conn.commit()
+
+    def clear(self) -> None:
+        """Vacía la caché en memoria y la capa persistente"""
+        self._invalidate()
+
+    def get(self, key: str) -> Optional[Any]:
+        """Copia del valor guardado (el llamador puede modificarla), o None"""
+        version = self.corpus_version
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                created_at, value = entry
+                if now - created_at <= self.ttl_seconds:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return copy.deepcopy(value)
+                del self._entries[key]
+
+            if self._conn is not None:
+                row = self._conn.execute(
+                    'SELECT created_at, value FROM retrieval_cache WHERE cache_key = ? AND corpus_version = ?',
+                    (key, version),
+                ).fetchone()
+                if row is not None and now - row[0] <= self.ttl_seconds:
+                    value = json.loads(row[1])
+                    self._store(key, row[0], copy.deepcopy(value))
+                    self.hits += 1
+                    self.persistent_hits += 1
+                    return value
+
+            self.misses += 1
+            return None
+
+    def set(self, key: str, value: Any) -> None:
+        version = self.corpus_version
+        now = time.time()
+        with self._lock:
+            # Copia propia: cambios posteriores del llamador no alteran la entrada
+            self._store(key, now, copy.deepcopy(value))
+            if self._conn is not None:
+                self._conn.execute(
+                    'INSERT OR REPLACE INTO retrieval_cache (cache_key, corpus_version, created_at, value) VALUES (?, ?, ?, ?)',
+                    (key, version, now, json.dumps(value, ensure_ascii=False, default=str)),
+                )
+                if now - self._purged_at >= PURGE_INTERVAL_SECONDS:
+                    self._conn.execute(
+                        'DELETE FROM retrieval_cache WHERE created_at < ?', (now - self.ttl_seconds,)
+                    )
+                    self._purged_at = now
+                self._conn.commit()
+
+    def _store(self, key: str, created_at: float, value: Any) -> None:
+        self._entries[key] = (created_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Contadores de aciertos/fallos y tamaño actual"""
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "persistent_hits": self.persistent_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "corpus_version": self._corpus_version,
+        }
+
+
+_default_cache: Optional[RetrievalCache] = None
+
+
+def get_retrieval_cache() -> Optional[RetrievalCache]:
+    """Caché compartida por proceso, o `None` si está deshabilitada"""
+    global _default_cache
+    if not RAG_CACHE_ENABLED:
+        return None
+    if _default_cache is None:
+        _default_cache = RetrievalCache(sqlite_path=RAG_CACHE_DB or None)
+    return _default_cache
@@ -0,0 +1,217 @@
+"""Precalentamiento de la caché de recuperación con las consultas más frecuentes.
+
+Después de cada despliegue o reinicio la caché de recuperación está vacía y la
+primera ola de preguntas del turno de la mañana paga la latencia completa de
+Vertex. Este módulo lee las llamadas a `document_retrieval` guardadas por el
+ADK en sessions.db (tabla `events`), agrupa las consultas por su texto
+normalizado y ejecuta las N más frecuentes contra la versión actual del corpus
+con la herramienta de recuperación. Solo se consulta Vertex, nunca Gemini.
+
+Alcance: solo se precalienta la caché de recuperación. La caché de respuestas
+(answer_cache.py) no se llena aquí porque cada respuesta requiere llamar a
+Gemini; se llena con el tráfico real.
+
+El precalentamiento solo tiene sentido con la capa SQLite de la caché
+(`RAG_CACHE_DB`, configurada en .env y en el Dockerfile), que comparten los
+workers y sobrevive a reinicios: cada versión del corpus se precalienta una
+sola vez (otra vez solo si las entradas ya expiraron) y los demás workers leen
+las entradas de SQLite. Sin `RAG_CACHE_DB` se omite.
+
+startup.py lo ejecuta en segundo plano después de que /healthz reporta listo,
+para no retrasar el arranque: las primeras solicitudes pueden llegar antes de
+que termine. Para tener la caché llena antes de recibir tráfico, correr el CLI
+como paso del despliegue (también sirve para revisar las consultas):
+
+    python -m multi_tool_agent.cache_warmup --top 50 --dry-run
+    python -m multi_tool_agent.cache_warmup --top 50 --days 7
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from .cache import RAG_CACHE_DB, get_corpus_version, get_retrieval_cache, normalize_query
+
+logger = logging.getLogger(__name__)
+
+# Consultas frecuentes que se precalientan al arrancar (0 = no precalentar)
+WARMUP_TOP_QUERIES = int(os.getenv("WARMUP_TOP_QUERIES", "50"))
+# Días de historial que se consideran
+WARMUP_LOOKBACK_DAYS = float(os.getenv("WARMUP_LOOKBACK_DAYS", "14"))
+WARMUP_CONCURRENCY = int(os.getenv("WARMUP_CONCURRENCY", "4"))
+# Eventos más recientes que se leen como máximo del historial
+MAX_SCANNED_EVENTS = 50000
+RETRIEVAL_TOOL_NAME = "document_retrieval"
+
+
+def sessions_db_path() -> Optional[str]:
+    """Archivo SQLite de SESSION_SERVICE_URI (None si las sesiones no están en SQLite)"""
+    uri = os.getenv("SESSION_SERVICE_URI", "sqlite:///./sessions.db")
+    if not uri.startswith("sqlite") or ":///" not in uri or ":memory:" in uri:
+        return None
+    # Relativa al directorio actual, igual que la abre el servicio de sesiones
+    return os.path.abspath(uri.split(":///", 1)[1].split("?", 1)[0])
+
+
+def _retrieval_queries(conn: sqlite3.Connection, since: datetime) -> List[str]:
+    """Consultas enviadas a la herramienta de recuperación, de la más reciente a la más antigua"""
+    tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    if "events" not in tables:
+        return []
+    rows = conn.execute(
+        "SELECT content FROM events WHERE author != 'user' AND content LIKE ? AND timestamp >= ? "
+        "ORDER BY timestamp DESC LIMIT ?",
+        (f"%{RETRIEVAL_TOOL_NAME}%", since.strftime("%Y-%m-%d %H:%M:%S"), MAX_SCANNED_EVENTS),
+    ).fetchall()
+    queries = []
+    for (content,) in rows:
+        try:
+            parts = (json.loads(content) if isinstance(content, str) else content or {}).get("parts") or []
+        except ValueError:
+            continue
+        for part in parts:
+            call = part.get("function_call") or {}
+            query = (call.get("args") or {}).get("query")
+            if call.get("name") == RETRIEVAL_TOOL_NAME and isinstance(query, str) and query.strip():
+                queries.append(query)
+    return queries
+
+
+def top_queries(
+    top: int = WARMUP_TOP_QUERIES,
+    days: float = WARMUP_LOOKBACK_DAYS,
+    db_path: Optional[str] = None,
+) -> Tuple[List[Tuple[str, int]], int]:
+    """Las `top` consultas más frecuentes (texto más reciente, veces) y el total de consultas del periodo"""
+    db_path = db_path or sessions_db_path()
+    if not db_path or not os.path.exists(db_path):
+        return [], 0
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        queries = _retrieval_queries(conn, datetime.now() - timedelta(days=days))
+    finally:
+        conn.close()
+
+    counts: Counter = Counter()
+    latest: Dict[str, str] = {}
+    for text in queries:
+        key = normalize_query(text)
+        counts[key] += 1
+        latest.setdefault(key, text.strip())
+    return [(latest[key], count) for key, count in counts.most_common(top)], sum(counts.values())
+
+
+def claim_warmup(corpus_version: str, cache_db: str = RAG_CACHE_DB) -> bool:
+    """Registra el precalentamiento de esta versión del corpus; False si otro proceso ya lo hizo.
+
+    Un precalentamiento anterior a la vida de las entradas de la caché
+    (`RAG_CACHE_TTL_SECONDS`) ya no cuenta.
+    """
+    from .cache import RAG_CACHE_TTL_SECONDS
+
+    now = time.time()
+    conn = sqlite3.connect(cache_db, timeout=30)
+    try:
+        with conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache_warmups (corpus_version TEXT PRIMARY KEY, started_at REAL NOT NULL)"
+            )
+            # Una sola escritura atómica: solo un worker obtiene el registro
+            cursor = conn.execute(
+                "INSERT INTO cache_warmups (corpus_version, started_at) VALUES (?, ?) "
+                "ON CONFLICT(corpus_version) DO UPDATE SET started_at = excluded.started_at "
+                "WHERE cache_warmups.started_at < ?",
+                (corpus_version, now, now - RAG_CACHE_TTL_SECONDS),
+            )
+            return cursor.rowcount > 0
+    finally:
+        conn.close()
+
+
+async def warm_retrieval_cache(queries: List[str], concurrency: int = WARMUP_CONCURRENCY) -> Dict[str, Any]:
+    """Ejecuta las consultas con la herramienta de recuperación para llenar su caché"""
+    from .agent import get_root_agent
+
+    tool = next(tool for tool in get_root_agent().tools if getattr(tool, "name", None) == RETRIEVAL_TOOL_NAME)
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    errors = 0
+
+    async def warm(query: str) -> None:
+        nonlocal errors
+        async with semaphore:
+            try:
+                # Sin sesión: no usa búsquedas anticipadas ni cuenta en el consumo de sesiones
+                await tool._arun(query)
+            except Exception as e:
+                errors += 1
+                logger.warning(f"No se pudo precalentar la consulta {query!r}: {str(e)}")
+
+    await asyncio.gather(*(warm(query) for query in queries))
+    return {"warmed": len(queries) - errors, "errors": errors}
+
+
+def warm_from_history(
+    top: int = WARMUP_TOP_QUERIES,
+    days: float = WARMUP_LOOKBACK_DAYS,
+    concurrency: int = WARMUP_CONCURRENCY,
+    dry_run: bool = False,
+    force: bool = False,
+) -> Dict[str, Any]:
+    """Precalienta la caché de recuperación y regresa el reporte (duración y cobertura del historial)"""
+    start = time.perf_counter()
+    corpus_version = get_corpus_version()
+    report: Dict[str, Any] = {"corpus_version": corpus_version, "queries": 0, "warmed": 0, "errors": 0}
+    cache = get_retrieval_cache()
+    if not dry_run and (cache is None or not RAG_CACHE_DB):
+        # Sin capa persistente cada worker pagaría las consultas en cada arranque
+        report["skipped"] = "sin capa SQLite de la caché de recuperación (RAG_CACHE_DB)"
+    elif not dry_run and not force and not claim_warmup(corpus_version):
+        report["skipped"] = "versión del corpus ya precalentada"
+    else:
+        queries, total = top_queries(top, days)
+        covered = sum(count for _, count in queries)
+        report.update({
+            "queries": len(queries),
+            "historical_queries": total,
+            # Fracción de las consultas del periodo cuya versión normalizada queda en caché
+            "coverage": round(covered / total, 4) if total else 0.0,
+        })
+        if queries and not dry_run:
+            report.update(asyncio.run(warm_retrieval_cache([query for query, _ in queries], concurrency)))
+            report["retrieval_cache_entries"] = cache.stats()["entries"]
+    report["seconds"] = round(time.perf_counter() - start, 3)
+    logger.info(
+        f"Precalentamiento de la caché de recuperación: {report['warmed']}/{report['queries']} consultas "
+        f"en {report['seconds']}s (corpus {corpus_version})"
+        + (f", omitido: {report['skipped']}" if "skipped" in report else "")
+    )
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precalentar la caché de recuperación con las consultas más frecuentes")
+    parser.add_argument("--top", type=int, default=WARMUP_TOP_QUERIES or 50, help="Consultas a ejecutar")
+    parser.add_argument("--days", type=float, default=WARMUP_LOOKBACK_DAYS, help="Días de historial")
+    parser.add_argument("--concurrency", type=int, default=WARMUP_CONCURRENCY)
+    parser.add_argument("--dry-run", action="store_true", help="Solo listar las consultas y la cobertura")
+    parser.add_argument("--force", action="store_true", help="Precalentar aunque esta versión ya se haya hecho")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    if args.dry_run:
+        queries, _ = top_queries(args.top, args.days)
+        for query, count in queries:
+            print(f"{count:>6}  {query}")
+    report = warm_from_history(args.top, args.days, args.concurrency, dry_run=args.dry_run, force=args.force)
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
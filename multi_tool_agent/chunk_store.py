@@ -0,0 +1,420 @@
+"""Almacén binario del corpus con acceso por ID de chunk, documento o rango.
+
+El corpus son cientos de archivos JSONL pequeños con el texto doblemente
+codificado: obtener un chunk por ID (`cancelaciones_en_caja__chunk_0`) o todos
+los chunks de un `documento_origen` obliga a abrir y decodificar archivos línea
+por línea. `build_chunk_store` empaqueta el corpus en un solo archivo que se
+lee con mmap, sin parsear nada al abrirlo:
+
+    encabezado | registros | tabla hash de IDs | documentos | datos
+
+- registros: uno de tamaño fijo por chunk (desplazamiento de los datos,
+  longitudes, `numero_chunk`, subdocumento y documento), ordenados por
+  documento, subdocumento (`parte`) y número de chunk, así que los chunks de
+  un documento son un rango contiguo y los de cada política van juntos,
+- tabla hash (direccionamiento abierto, crc32 del ID): búsqueda por ID en O(1),
+- documentos: nombre, primer registro y número de chunks, ordenados por nombre,
+- datos: por chunk el ID, el texto ya decodificado en UTF-8 y la metadata como
+  JSON compacto.
+
+El extractor repite los IDs en cada política de un mismo archivo;
+`corpus.iter_file_chunks` ya los vuelve únicos (`…__chunk_0__parte_2`) y la
+construcción rechaza cualquier ID que aún se repita, así que `get` es una
+búsqueda exacta. `get_all` regresa el chunk con el ID original y sus copias
+renombradas.
+
+    python -m multi_tool_agent.chunk_store build
+    python -m multi_tool_agent.chunk_store get cancelaciones_en_caja__chunk_0
+    python -m multi_tool_agent.chunk_store document cancelaciones_en_caja --start 0 --stop 3
+"""
+
+import argparse
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from .corpus import CORPUS_DIR, REPO_ROOT, corpus_signature, iter_file_chunks, list_jsonl_files
+
+logger = logging.getLogger(__name__)
+
+CHUNK_STORE_PATH = os.getenv(
+    "CHUNK_STORE_PATH", os.path.join(REPO_ROOT, "data", "local_index", "chunks.bin")
+)
+MAGIC = b"TOKSCHNK"
+FORMAT_VERSION = 2
+
+# magic, versión, chunks, slots de la tabla hash, documentos, firma del corpus,
+# desplazamientos de registros, tabla hash, documentos y datos
+_HEADER = struct.Struct("<8sIIII16sQQQQ")
+# desplazamiento de los datos, longitud del ID, del texto y de la metadata,
+# numero_chunk (-1 si no tiene), subdocumento e índice del documento
+_RECORD = struct.Struct("<QIIIiII")
+# desplazamiento del nombre, longitud del nombre, primer registro, chunks
+_DOCUMENT = struct.Struct("<QIII")
+_SLOT = struct.Struct("<I")
+
+
+def _slot_count(chunks: int) -> int:
+    """Potencia de 2 con al menos el doble de slots que chunks (factor de carga <= 0.5)"""
+    size = 1
+    while size < chunks * 2:
+        size <<= 1
+    return size
+
+
+def _hash(key: bytes) -> int:
+    return zlib.crc32(key)
+
+
+def _collect(corpus_dir: str) -> List[Tuple[str, int, int, str, Dict[str, Any], str]]:
+    """Chunks del corpus como (documento, parte, numero_chunk, id, metadata, texto) en el orden del almacén"""
+    chunks = []
+    for path in list_jsonl_files(corpus_dir):
+        file_document = os.path.basename(path)[:-len(".jsonl")]
+        for chunk in iter_file_chunks(path):
+            metadata = chunk["metadata"]
+            number = metadata.get("numero_chunk")
+            chunks.append((
+                metadata.get("documento_origen") or file_document,
+                metadata.get("parte", 0),
+                number if isinstance(number, int) else -1,
+                str(chunk["id"] or ""),
+                metadata,
+                chunk["text"],
+            ))
+    # Orden estable: dentro de una política se conserva el orden del archivo
+    chunks.sort(key=lambda chunk: chunk[:3])
+    return chunks
+
+
+def write_chunk_store(
+    chunks: List[Tuple[str, int, int, str, Dict[str, Any], str]], path: str, signature: str = ""
+) -> None:
+    """Escribe el archivo binario con los chunks ya ordenados (ver `_collect`); los IDs deben ser únicos"""
+    documents: List[List[Any]] = []
+    records = bytearray()
+    data = bytearray()
+    positions: Dict[bytes, int] = {}
+    for position, (document, part, number, chunk_id, metadata, text) in enumerate(chunks):
+        if not documents or documents[-1][0] != document:
+            documents.append([document, position, 0])
+        documents[-1][2] += 1
+        id_bytes = chunk_id.encode("utf-8")
+        if id_bytes in positions:
+            raise ValueError(f"ID de chunk repetido en el corpus: {chunk_id!r} ({document})")
+        positions[id_bytes] = position
+        text_bytes = text.encode("utf-8")
+        metadata_bytes = json.dumps(metadata, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        records += _RECORD.pack(
+            len(data), len(id_bytes), len(text_bytes), len(metadata_bytes), number, part, len(documents) - 1
+        )
+        data += id_bytes + text_bytes + metadata_bytes
+
+    slot_count = _slot_count(len(chunks))
+    slots = [0] * slot_count
+    for id_bytes, position in positions.items():
+        slot = _hash(id_bytes) & (slot_count - 1)
+        while slots[slot]:
+            slot = (slot + 1) & (slot_count - 1)
+        # 0 marca un slot vacío: se guarda la posición + 1
+        slots[slot] = position + 1
+
+    document_table = bytearray()
+    for document, first, count in documents:
+        name = document.encode("utf-8")
+        document_table += _DOCUMENT.pack(len(data), len(name), first, count)
+        data += name
+
+    records_offset = _HEADER.size
+    slots_offset = records_offset + len(records)
+    documents_offset = slots_offset + slot_count * _SLOT.size
+    data_offset = documents_offset + len(document_table)
+    header = _HEADER.pack(
+        MAGIC, FORMAT_VERSION, len(chunks), slot_count, len(documents),
+        signature.encode("ascii")[:16].ljust(16, b"\0"),
+        records_offset, slots_offset, documents_offset, data_offset,
+    )
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(header)
+        f.write(records)
+        f.write(struct.pack(f"<{slot_count}I", *slots))
+        f.write(document_table)
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+class ChunkStore:
+    """Lector del almacén binario; los datos se leen del mmap sin cargar el archivo"""
+
+    def __init__(self, path: str = CHUNK_STORE_PATH):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._mmap)
+        try:
+            (
+                magic, version, self._count, self._slot_count, document_count, signature,
+                self._records_offset, self._slots_offset, self._documents_offset, self._data_offset,
+            ) = _HEADER.unpack_from(self._view, 0)
+        except struct.error:
+            self.close()
+            raise ValueError(f"Almacén de chunks incompleto en {path}")
+        if magic != MAGIC or version != FORMAT_VERSION:
+            self.close()
+            raise ValueError(f"Formato de almacén de chunks no soportado en {path}")
+        self.signature = signature.rstrip(b"\0").decode("ascii")
+        # Pocos cientos de documentos: el diccionario de nombres se arma al abrir
+        self._documents: Dict[str, Tuple[int, int]] = {}
+        self._document_names: List[str] = []
+        for index in range(document_count):
+            name_offset, name_length, first, count = _DOCUMENT.unpack_from(
+                self._view, self._documents_offset + index * _DOCUMENT.size
+            )
+            name = self._str(name_offset, name_length)
+            self._documents[name] = (first, count)
+            self._document_names.append(name)
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __contains__(self, chunk_id: str) -> bool:
+        return self.position(chunk_id) is not None
+
+    def __enter__(self) -> "ChunkStore":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Libera el mmap (falla con BufferError si siguen vivos memoryviews de `text_bytes`)"""
+        self._view.release()
+        self._mmap.close()
+
+    def _str(self, offset: int, length: int) -> str:
+        start = self._data_offset + offset
+        return str(self._view[start:start + length], "utf-8")
+
+    def _record(self, position: int) -> Tuple[int, int, int, int, int, int, int]:
+        if not 0 <= position < self._count:
+            raise IndexError(f"Posición fuera del almacén: {position}")
+        return _RECORD.unpack_from(self._view, self._records_offset + position * _RECORD.size)
+
+    # --- Lecturas por posición ---
+
+    def chunk_id(self, position: int) -> str:
+        offset, id_length = self._record(position)[:2]
+        return self._str(offset, id_length)
+
+    def text_bytes(self, position: int) -> memoryview:
+        """Texto UTF-8 del chunk como vista del mmap (sin copiar)"""
+        offset, id_length, text_length = self._record(position)[:3]
+        start = self._data_offset + offset + id_length
+        return self._view[start:start + text_length]
+
+    def text(self, position: int) -> str:
+        offset, id_length, text_length = self._record(position)[:3]
+        return self._str(offset + id_length, text_length)
+
+    def metadata(self, position: int) -> Dict[str, Any]:
+        offset, id_length, text_length, metadata_length = self._record(position)[:4]
+        return json.loads(self._str(offset + id_length + text_length, metadata_length))
+
+    def chunk(self, position: int) -> Dict[str, Any]:
+        """Chunk `{id, text, metadata}` con la misma forma que `corpus.parse_chunk`"""
+        offset, id_length, text_length, metadata_length = self._record(position)[:4]
+        return {
+            "id": self._str(offset, id_length),
+            "text": self._str(offset + id_length, text_length),
+            "metadata": json.loads(self._str(offset + id_length + text_length, metadata_length)),
+        }
+
+    def chunks(self, start: int = 0, stop: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Chunks de las posiciones [start, stop) en el orden del almacén"""
+        return [self.chunk(position) for position in range(*slice(start, stop).indices(self._count))]
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        for position in range(self._count):
+            yield self.chunk(position)
+
+    # --- Búsquedas por ID ---
+
+    def position(self, chunk_id: str) -> Optional[int]:
+        """Posición del chunk con el ID, o None"""
+        key = chunk_id.encode("utf-8")
+        mask = self._slot_count - 1
+        slot = _hash(key) & mask
+        while True:
+            (value,) = _SLOT.unpack_from(self._view, self._slots_offset + slot * _SLOT.size)
+            if not value:
+                return None
+            offset, id_length = self._record(value - 1)[:2]
+            start = self._data_offset + offset
+            if self._view[start:start + id_length] == key:
+                return value - 1
+            slot = (slot + 1) & mask
+
+    def get(self, chunk_id: str) -> Optional[Dict[str, Any]]:
+        position = self.position(chunk_id)
+        return self.chunk(position) if position is not None else None
+
+    def get_all(self, chunk_id: str) -> List[Dict[str, Any]]:
+        """El chunk con el ID y las copias renombradas del mismo ID en otras políticas del documento"""
+        position = self.position(chunk_id)
+        if position is None:
+            return []
+        prefix = f"{chunk_id}__parte_"
+        return [self.chunk(position)] + [
+            self.chunk(other) for other in self.document_range(self._document_names[self._record(position)[6]])
+            if self.chunk_id(other).startswith(prefix)
+        ]
+
+    # --- Búsquedas por documento ---
+
+    def documents(self) -> List[str]:
+        return list(self._document_names)
+
+    def document_range(self, document: str) -> range:
+        """Posiciones de los chunks del documento (vacío si no existe)"""
+        first, count = self._documents.get(document, (0, 0))
+        return range(first, first + count)
+
+    def document_chunks(
+        self,
+        document: str,
+        start: Optional[int] = None,
+        stop: Optional[int] = None,
+        part: Optional[int] = None,
+    ) -> List[Dict[str, Any]]:
+        """Chunks del documento (o solo de la política `part`), opcionalmente los de `numero_chunk` en [start, stop)"""
+        positions = self.document_range(document)
+        if start is not None or stop is not None or part is not None:
+            positions = [
+                position for position in positions
+                if (part is None or self._record(position)[5] == part)
+                and (start is None or self._record(position)[4] >= start)
+                and (stop is None or self._record(position)[4] < stop)
+            ]
+        return [self.chunk(position) for position in positions]
+
+    # --- Búsqueda por texto ---
+
+    def find_text(self, text: str, documents: List[str], snippet: int = 200) -> Optional[int]:
+        """Posición del chunk de `documents` que corresponde a un fragmento de texto, o None.
+
+        Vertex RAG regresa solo el texto y el archivo de cada contexto, troceado
+        con su propia configuración: el contexto puede ser el chunk completo,
+        contenerlo o ser parte de él. Se comparan los primeros `snippet`
+        caracteres (espacios normalizados) en ambos sentidos, solo contra los
+        chunks de los documentos del archivo.
+        """
+        target = " ".join(text.split())
+        if not target:
+            return None
+        for document in documents:
+            for position in self.document_range(document):
+                chunk_text = " ".join(self.text(position).split())
+                if chunk_text and (chunk_text[:snippet] in target or target[:snippet] in chunk_text):
+                    return position
+        return None
+
+
+def build_chunk_store(corpus_dir: str = CORPUS_DIR, path: str = CHUNK_STORE_PATH) -> ChunkStore:
+    """Empaqueta el corpus en el almacén binario y lo abre"""
+    start = time.perf_counter()
+    chunks = _collect(corpus_dir)
+    write_chunk_store(chunks, path, corpus_signature(corpus_dir))
+    store = ChunkStore(path)
+    logger.info(
+        f"Almacén de chunks construido: {len(store)} chunks, {len(store.documents())} documentos, "
+        f"{os.path.getsize(path) / 1e6:.1f} MB en {time.perf_counter() - start:.2f}s ({path})"
+    )
+    return store
+
+
+def load_or_build_chunk_store(corpus_dir: str = CORPUS_DIR, path: str = CHUNK_STORE_PATH) -> ChunkStore:
+    """Abre el almacén persistido o lo reconstruye si no existe o el corpus cambió"""
+    if os.path.exists(path):
+        try:
+            store = ChunkStore(path)
+            if store.signature == corpus_signature(corpus_dir):
+                return store
+            store.close()
+            logger.info("El corpus cambió desde la última construcción del almacén de chunks")
+        except (OSError, ValueError) as e:
+            logger.warning(f"No se pudo abrir el almacén de chunks: {str(e)}")
+    return build_chunk_store(corpus_dir, path)
+
+
+_default_store: Optional[ChunkStore] = None
+_default_lock = threading.Lock()
+_open_attempted = False
+
+
+def get_chunk_store(build: bool = True) -> Optional[ChunkStore]:
+    """Almacén compartido por proceso (se abre una sola vez).
+
+    Con `build=False` (ruta de las solicitudes) nunca se construye: regresa el
+    almacén ya abierto o el persistido si está al día, o None.
+    """
+    global _default_store, _open_attempted
+    if _default_store is None:
+        with _default_lock:
+            if _default_store is None and build:
+                _default_store = load_or_build_chunk_store()
+            elif _default_store is None and not _open_attempted:
+                _open_attempted = True
+                try:
+                    store = ChunkStore(CHUNK_STORE_PATH)
+                    if store.signature == corpus_signature(CORPUS_DIR):
+                        _default_store = store
+                    else:
+                        store.close()
+                except (OSError, ValueError) as e:
+                    logger.warning(f"Almacén de chunks no disponible: {str(e)}")
+    return _default_store
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Almacén binario de los chunks del corpus")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser("build", help="Construir y guardar el almacén")
+    build_parser.add_argument("--corpus-dir", default=CORPUS_DIR)
+    get_parser = subparsers.add_parser("get", help="Chunks con un ID")
+    get_parser.add_argument("chunk_id")
+    document_parser = subparsers.add_parser("document", help="Chunks de un documento")
+    document_parser.add_argument("document")
+    document_parser.add_argument("--start", type=int, help="Primer numero_chunk")
+    document_parser.add_argument("--stop", type=int, help="numero_chunk final (exclusivo)")
+    document_parser.add_argument("--part", type=int, help="Solo la política (subdocumento) con esta `parte`")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    if args.command == "build":
+        build_chunk_store(args.corpus_dir).close()
+        return
+
+    store = get_chunk_store()
+    start = time.perf_counter()
+    if args.command == "get":
+        chunks = store.get_all(args.chunk_id)
+    else:
+        chunks = store.document_chunks(args.document, args.start, args.stop, args.part)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    for chunk in chunks:
+        print(f"{chunk['id']} {json.dumps(chunk['metadata'], ensure_ascii=False)}")
+        print(f"    {chunk['text'][:200]!r}")
+    print(f"\n{len(chunks)} chunks en {elapsed_ms:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""Compactación del historial que se envía a Gemini en cada turno.
+
+El ADK reenvía todos los eventos de la sesión en cada llamada al modelo,
+incluidas las respuestas de `document_retrieval` con hasta 20 fragmentos. Con
+la "Guía Progresiva" del prompt las conversaciones tienen varias preguntas de
+seguimiento, así que el prompt y la latencia crecen con cada turno.
+
+`before_model_callback` reescribe `llm_request.contents` antes de cada llamada:
+
+1. las respuestas de la herramienta de turnos anteriores se reemplazan por
+   las referencias (título, código, fecha) de los documentos que el modelo ya
+   citó en sus respuestas; el texto de los fragmentos se omite y el modelo
+   puede volver a buscar si lo necesita (la caché de recuperación lo responde),
+2. si el historial anterior al turno actual sigue excediendo
+   `HISTORY_TOKEN_BUDGET`, se descartan turnos completos, del más antiguo al
+   más reciente.
+
+El turno en curso (pregunta, llamada a la herramienta y su resultado) nunca se
+modifica. Los eventos guardados en la sesión tampoco: solo cambia lo que se
+envía al modelo.
+"""
+
+import json
+import logging
+import os
+from typing import Any, Dict, List, Optional
+
+from google.genai import types
+
+from . import metrics
+from .cache import normalize_query
+from .corpus import estimate_tokens
+from .postprocess import document_title
+
+logger = logging.getLogger(__name__)
+
+HISTORY_COMPACTION = os.getenv("HISTORY_COMPACTION", "TRUE").upper() == "TRUE"
+# Tokens máximos del historial previo al turno actual que se reenvían al modelo
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "4000"))
+RETRIEVAL_TOOL_NAME = "document_retrieval"
+# Campos de metadata que se conservan de cada documento citado
+REFERENCE_FIELDS = ("titulo", "codigo", "fecha", "documento_origen")
+
+
+def content_tokens(content) -> int:
+    """Tokens estimados de un Content (texto, llamadas y respuestas de herramientas)"""
+    total = 0
+    for part in content.parts or []:
+        if part.text:
+            total += estimate_tokens(part.text)
+        elif part.function_call is not None:
+            total += estimate_tokens(json.dumps(part.function_call.args or {}, ensure_ascii=False, default=str))
+        elif part.function_response is not None:
+            total += estimate_tokens(json.dumps(part.function_response.response or {}, ensure_ascii=False, default=str))
+    return total
+
+
+def _is_user_message(content) -> bool:
+    """Mensaje escrito por el usuario (las respuestas de herramientas también tienen role=user)"""
+    return content.role == "user" and any(part.text for part in content.parts or []) and not any(
+        part.function_response is not None for part in content.parts or []
+    )
+
+
+def _turn_starts(contents: List[Any]) -> List[int]:
+    return [index for index, content in enumerate(contents) if _is_user_message(content)]
+
+
+def cited_references(matches: List[Dict[str, Any]], answer_text: str) -> List[Dict[str, Any]]:
+    """Referencias (una por documento) de los resultados que aparecen en las respuestas del modelo"""
+    answer = normalize_query(answer_text)
+    references: Dict[str, Dict[str, Any]] = {}
+    for match in matches:
+        metadata = match.get("metadata") or {}
+        title = document_title(metadata)
+        candidates = [title, metadata.get("codigo"), (metadata.get("documento_origen") or "").replace("_", " ")]
+        if not title or title in references:
+            continue
+        if any(candidate and normalize_query(candidate) and normalize_query(candidate) in answer for candidate in candidates):
+            references[title] = {
+                "titulo": title,
+                **{field: metadata[field] for field in REFERENCE_FIELDS[1:] if metadata.get(field)},
+            }
+    return list(references.values())
+
+
+def _compact_tool_response(part, answer_text: str):
+    """Part con la respuesta de la herramienta reducida a las referencias citadas"""
+    response = part.function_response.response or {}
+    matches = response.get("matches")
+    if not isinstance(matches, list):
+        return part
+    return types.Part(function_response=types.FunctionResponse(
+        id=part.function_response.id,
+        name=part.function_response.name,
+        response={
+            "compactado": True,
+            "nota": "Fragmentos de una búsqueda anterior omitidos; vuelve a usar la herramienta si necesitas el texto.",
+            "referencias_citadas": cited_references(matches, answer_text),
+        },
+    ))
+
+
+def compact_contents(contents: List[Any], budget: int = HISTORY_TOKEN_BUDGET) -> List[Any]:
+    """Historial compactado: resultados de herramientas anteriores reducidos y recorte por presupuesto"""
+    starts = _turn_starts(contents)
+    if len(starts) < 2:
+        return contents
+    current = starts[-1]
+    history, turn = contents[:current], contents[current:]
+
+    # Texto de las respuestas del modelo: define qué documentos se citaron
+    answer_text = "\n".join(
+        part.text for content in history if content.role == "model" for part in content.parts or [] if part.text
+    )
+    compacted = []
+    for content in history:
+        parts = content.parts or []
+        if any(
+            part.function_response is not None and part.function_response.name == RETRIEVAL_TOOL_NAME
+            for part in parts
+        ):
+            parts = [
+                _compact_tool_response(part, answer_text)
+                if part.function_response is not None and part.function_response.name == RETRIEVAL_TOOL_NAME
+                else part
+                for part in parts
+            ]
+            content = types.Content(role=content.role, parts=parts)
+        compacted.append(content)
+
+    # Descartar turnos completos (del más antiguo) hasta entrar en el presupuesto
+    tokens = [content_tokens(content) for content in compacted]
+    total = sum(tokens)
+    first = 0
+    history_starts = [start for start in starts[:-1] if start > 0] + [current]
+    for next_start in history_starts:
+        if total <= budget:
+            break
+        total -= sum(tokens[first:next_start])
+        first = next_start
+    return compacted[first:] + turn
+
+
+def before_model_callback(callback_context, llm_request) -> Optional[Any]:
+    if not HISTORY_COMPACTION or not llm_request.contents:
+        return None
+    before = sum(content_tokens(content) for content in llm_request.contents)
+    llm_request.contents = compact_contents(llm_request.contents)
+    after = sum(content_tokens(content) for content in llm_request.contents)
+    metrics.HISTORY_TOKENS.observe(before, stage="original")
+    metrics.HISTORY_TOKENS.observe(after, stage="compacted")
+    if after < before:
+        logger.info(f"Historial compactado: {before} -> {after} tokens estimados ({before - after} ahorrados)")
+    return None
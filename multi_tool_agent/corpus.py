@@ -0,0 +1,391 @@
+"""Utilidades para leer los chunks JSONL del corpus en data/outputs.
+
+Los archivos generados por el pipeline de extracción guardan el campo `texto`
+como una cadena JSON dentro del JSON (doble codificación) y los cortes de los
+chunks pueden caer a mitad de una secuencia de escape. Este módulo concentra la
+lectura y decodificación para que el índice local y los scripts de ingesta
+compartan exactamente la misma interpretación de los datos.
+"""
+
+import hashlib
+import json
+import os
+import re
+from typing import Any, Dict, Iterator, List, Optional, Set
+
+# Directorio raíz del repositorio (un nivel arriba del paquete del agente)
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Directorio con los chunks originales del corpus
+SOURCE_DIR = os.path.join(REPO_ROOT, "data", "outputs")
+# Chunks limpios y re-divididos (ver normalize_corpus)
+NORMALIZED_DIR = os.path.join(REPO_ROOT, "data", "normalized")
+# Conjunto deduplicado que generan los scripts de ingesta (ver dedup.py)
+DEDUP_DIR = os.path.join(REPO_ROOT, "data", "dedup")
+# Manifiesto de sincronización con Vertex RAG (lo escribe prepare_corpus_and_data.py)
+CORPUS_MANIFEST_PATH = os.getenv(
+    "CORPUS_MANIFEST_PATH", os.path.join(REPO_ROOT, "data", "corpus_manifest.json")
+)
+
+
+def uploaded_corpus_dir(manifest_path: str = CORPUS_MANIFEST_PATH) -> Optional[str]:
+    """Directorio que se cargó a Vertex RAG según el manifiesto, o None si no se registró"""
+    try:
+        with open(manifest_path, encoding="utf-8") as f:
+            corpus_dir = json.load(f).get("corpus_dir")
+    except (OSError, ValueError):
+        return None
+    if not corpus_dir:
+        return None
+    path = os.path.join(REPO_ROOT, corpus_dir)
+    return path if os.path.isdir(path) else None
+
+
+# Corpus que consumen el índice local, el de metadata y el almacén de chunks:
+# el mismo que se cargó a Vertex (registrado en el manifiesto); sin manifiesto,
+# el último paso de ingesta que exista (deduplicado, normalizado u original)
+CORPUS_DIR = os.getenv("CORPUS_DIR") or uploaded_corpus_dir() or next(
+    (path for path in (DEDUP_DIR, NORMALIZED_DIR) if os.path.isdir(path)), SOURCE_DIR
+)
+
+_ESCAPES = {
+    "n": "\n",
+    "t": "\t",
+    "r": "\r",
+    "f": "\f",
+    "b": "\b",
+    '"': '"',
+    "\\": "\\",
+    "/": "/",
+}
+_ESCAPE_RE = re.compile(r'\\(u[0-9a-fA-F]{4}|["\\/bfnrt])')
+
+
+def _unescape(match: "re.Match[str]") -> str:
+    token = match.group(1)
+    if token.startswith("u"):
+        return chr(int(token[1:], 16))
+    return _ESCAPES[token]
+
+
+def decode_texto(raw: str) -> str:
+    """Decodifica el campo `texto` doblemente codificado de un chunk"""
+    if not raw:
+        return ""
+    try:
+        decoded = json.loads(raw)
+        if isinstance(decoded, str):
+            return decoded
+    except ValueError:
+        pass
+
+    # El chunk es un fragmento de la cadena JSON original: quitar las comillas
+    # de apertura/cierre que pudieran quedar y decodificar los escapes a mano.
+    text = raw
+    if text.startswith('"'):
+        text = text[1:]
+    if text.endswith('"') and not text.endswith('\\"'):
+        text = text[:-1]
+    # Un corte justo después de una barra invertida deja un escape incompleto
+    if (len(text) - len(text.rstrip("\\"))) % 2 == 1:
+        text = text[:-1]
+    return _ESCAPE_RE.sub(_unescape, text)
+
+
+def list_jsonl_files(corpus_dir: str = CORPUS_DIR) -> List[str]:
+    """Lista (ordenada) de rutas a los archivos JSONL del corpus"""
+    return sorted(
+        os.path.join(corpus_dir, name)
+        for name in os.listdir(corpus_dir)
+        if name.endswith(".jsonl")
+    )
+
+
+def parse_chunk(record: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Convierte un registro JSONL crudo en un chunk `{id, text, metadata}`.
+
+    Acepta tanto el formato original (`texto` doblemente codificado) como el
+    normalizado (`text`). Los registros que solo contienen embeddings se descartan.
+    """
+    if "text" in record:
+        return {"id": record.get("id"), "text": record["text"], "metadata": record.get("metadata") or {}}
+    if "texto" not in record:
+        return None
+    metadata = record.get("metadata") or {}
+    if isinstance(metadata, str):
+        try:
+            metadata = json.loads(metadata)
+        except ValueError:
+            metadata = {"raw": metadata}
+    return {
+        "id": record.get("id"),
+        "text": decode_texto(record["texto"]),
+        "metadata": metadata,
+    }
+
+
+def iter_file_chunks(path: str) -> Iterator[Dict[str, Any]]:
+    """Itera los chunks decodificados de un archivo JSONL.
+
+    Un archivo puede traer varias políticas seguidas y cada una reinicia
+    `numero_chunk` (y repite los IDs del extractor). Cada chunk recibe en
+    `metadata.parte` el número de su subdocumento dentro del archivo (igual que
+    `split_documents`; se respeta si ya viene, como en el corpus normalizado) y
+    los IDs repetidos se vuelven únicos con el sufijo `__parte_N`.
+    """
+    part, previous = -1, None
+    seen: Set[str] = set()
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            chunk = parse_chunk(json.loads(line))
+            if chunk is None:
+                continue
+            number = chunk["metadata"].get("numero_chunk")
+            if part < 0 or (number is not None and previous is not None and number <= previous):
+                part += 1
+            previous = number
+            chunk["metadata"].setdefault("parte", part)
+            chunk_id = chunk["id"]
+            if chunk_id is not None:
+                base, copy = chunk_id, 1
+                while chunk_id in seen:
+                    suffix = f"__parte_{chunk['metadata']['parte']}"
+                    chunk_id = f"{base}{suffix}" if copy == 1 else f"{base}{suffix}_{copy}"
+                    copy += 1
+                seen.add(chunk_id)
+                chunk["id"] = chunk_id
+            yield chunk
+
+
+def iter_chunks(corpus_dir: str = CORPUS_DIR) -> Iterator[Dict[str, Any]]:
+    """Itera todos los chunks decodificados del corpus"""
+    for path in list_jsonl_files(corpus_dir):
+        yield from iter_file_chunks(path)
+
+
+def corpus_signature(corpus_dir: str = CORPUS_DIR) -> str:
+    """Firma barata (nombre, tamaño y mtime) para detectar cambios en el corpus"""
+    digest = hashlib.sha256()
+    for path in list_jsonl_files(corpus_dir):
+        stat = os.stat(path)
+        digest.update(f"{os.path.basename(path)}:{stat.st_size}:{int(stat.st_mtime)}\n".encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+
+_snapshot_versions: Dict[str, Any] = {}
+
+
+def snapshot_version(manifest_path: str = CORPUS_MANIFEST_PATH) -> Optional[str]:
+    """Versión del corpus cargado a Vertex registrada en el manifiesto, o None si no hay"""
+    try:
+        mtime = os.stat(manifest_path).st_mtime
+    except OSError:
+        return None
+    cached = _snapshot_versions.get(manifest_path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    try:
+        with open(manifest_path, encoding="utf-8") as f:
+            version = (json.load(f).get("snapshot") or {}).get("version")
+    except (OSError, ValueError):
+        version = None
+    _snapshot_versions[manifest_path] = (mtime, version)
+    return version
+
+
+# --- Normalización y re-chunking ---
+# Presupuesto de tokens por chunk normalizado y traslape entre chunks consecutivos
+CHUNK_TOKEN_BUDGET = int(os.getenv("CHUNK_TOKEN_BUDGET", "300"))
+CHUNK_TOKEN_OVERLAP = int(os.getenv("CHUNK_TOKEN_OVERLAP", "40"))
+
+# Campos del encabezado que se repite en cada página de los documentos
+HEADER_FIELDS = {
+    "dirección": "direccion",
+    "área": "area",
+    "proceso": "proceso",
+    "subproceso": "subproceso",
+    "procedimiento": "procedimiento",
+    "política": "politica",
+    "código": "codigo",
+    "fecha": "fecha",
+}
+_HEADER_LINE_RE = re.compile(
+    r"^\s*(Dirección|Área|Proceso|Subproceso|Procedimiento|Política|Código|Fecha|Página)\s*:\s*(.*?)\s*$"
+)
+# Razón social del encabezado de página: "Grupo Restaurantero Gigante",
+# "Restaurantes Toks, S.A. de C.V.", "Operadora y Administradora de Restaurantes Gigante, S.A. de C.V."
+_COMPANY_SUFFIX = r",?\s*S\.?\s*A\.?(?:\s*de\s*C\.?\s*V\.?)?"
+_COMPANY_LINE_RE = re.compile(
+    rf"^\s*(?:(?:Grupo\s+)?Restaurantero\s+Gigante(?:{_COMPANY_SUFFIX})?\.?"
+    rf"|Operadora\s+y\s+Administradora\s+de\s+Restaurantes(?:\s+Gigante)?(?:{_COMPANY_SUFFIX})?"
+    rf"|(?:Restaurantes\s+Toks|Gigante){_COMPANY_SUFFIX})\s*$",
+    re.IGNORECASE,
+)
+# Entradas de la tabla de contenido: "OBJETIVO ........... 2"
+_TOC_LINE_RE = re.compile(r"(\.\s?){4,}\s*\d*\s*$|^\s*TABLA DE CONTENIDO\s*$")
+_MULTISPACE_RE = re.compile(r"[ \t\u00a0]{2,}")
+_BLANK_LINES_RE = re.compile(r"\n{3,}")
+_SENTENCE_RE = re.compile(r"(?<=[.;:])\s+")
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimación de tokens (~4 caracteres por token en español)"""
+    return (len(text) + 3) // 4
+
+
+def parse_header(text: str) -> Dict[str, str]:
+    """Extrae Dirección, Área, Procedimiento/Política, Código y Fecha del encabezado"""
+    header: Dict[str, str] = {}
+    for line in text.split("\n"):
+        match = _HEADER_LINE_RE.match(line)
+        if not match:
+            continue
+        key = HEADER_FIELDS.get(match.group(1).lower())
+        if key and match.group(2) and key not in header:
+            header[key] = _MULTISPACE_RE.sub(" ", match.group(2))
+    titulo = header.get("procedimiento") or header.get("politica") or header.get("subproceso") or header.get("proceso")
+    if titulo:
+        header["titulo"] = titulo
+    return header
+
+
+def clean_text(text: str) -> str:
+    """Quita encabezados de página, razón social, tabla de contenido y espacios de más"""
+    lines = []
+    for line in text.replace("\f", "\n").split("\n"):
+        if _HEADER_LINE_RE.match(line) or _COMPANY_LINE_RE.match(line) or _TOC_LINE_RE.search(line):
+            continue
+        lines.append(_MULTISPACE_RE.sub(" ", line).strip())
+    return _BLANK_LINES_RE.sub("\n\n", "\n".join(lines)).strip()
+
+
+def _split_units(text: str, budget: int) -> List[str]:
+    """Divide en párrafos, y los párrafos demasiado largos en oraciones o palabras"""
+    units = []
+    for paragraph in text.split("\n\n"):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if estimate_tokens(paragraph) <= budget:
+            units.append(paragraph)
+            continue
+        for sentence in _SENTENCE_RE.split(paragraph):
+            if estimate_tokens(sentence) <= budget:
+                units.append(sentence)
+                continue
+            words = sentence.split(" ")
+            step = max(1, budget * 4 // 7)  # ~7 caracteres por palabra
+            units.extend(" ".join(words[i:i + step]) for i in range(0, len(words), step))
+    return units
+
+
+def rechunk(text: str, budget: int = CHUNK_TOKEN_BUDGET, overlap: int = CHUNK_TOKEN_OVERLAP) -> List[str]:
+    """Agrupa párrafos en chunks de hasta `budget` tokens con `overlap` tokens de traslape"""
+    chunks: List[str] = []
+    current: List[str] = []
+    current_tokens = 0
+    for unit in _split_units(text, budget):
+        unit_tokens = estimate_tokens(unit)
+        if current and current_tokens + unit_tokens > budget:
+            chunks.append("\n\n".join(current))
+            # Conservar las últimas unidades como traslape con el siguiente chunk
+            carried: List[str] = []
+            carried_tokens = 0
+            for previous in reversed(current):
+                previous_tokens = estimate_tokens(previous)
+                if carried_tokens + previous_tokens > overlap or carried_tokens + previous_tokens + unit_tokens > budget:
+                    break
+                carried.insert(0, previous)
+                carried_tokens += previous_tokens
+            current, current_tokens = carried, carried_tokens
+        current.append(unit)
+        current_tokens += unit_tokens
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
+
+
+def split_documents(chunks: List[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+    """Separa los chunks de un archivo en documentos (numero_chunk reinicia en cada uno)"""
+    documents: List[List[Dict[str, Any]]] = []
+    previous = None
+    for chunk in chunks:
+        number = chunk["metadata"].get("numero_chunk")
+        if not documents or (number is not None and previous is not None and number <= previous):
+            documents.append([])
+        documents[-1].append(chunk)
+        previous = number
+    return documents
+
+
+def normalize_file(
+    path: str,
+    out_dir: str = NORMALIZED_DIR,
+    budget: int = CHUNK_TOKEN_BUDGET,
+    overlap: int = CHUNK_TOKEN_OVERLAP,
+) -> Dict[str, int]:
+    """Normaliza un archivo JSONL del corpus y regresa sus estadísticas de tokens"""
+    source_chunks = list(iter_file_chunks(path))
+    stats = {
+        "chunks_before": len(source_chunks),
+        "chunks_after": 0,
+        "tokens_before": sum(estimate_tokens(chunk["text"]) for chunk in source_chunks),
+        "tokens_after": 0,
+    }
+    records = []
+    for part, document in enumerate(split_documents(source_chunks)):
+        raw_text = "".join(chunk["text"] for chunk in document)
+        header = parse_header(raw_text)
+        documento_origen = document[0]["metadata"].get("documento_origen") or os.path.basename(path)[:-len(".jsonl")]
+        # Encabezado breve en cada chunk para que el título y el código viajen con el texto
+        prefix = ""
+        if header.get("titulo"):
+            prefix = header["titulo"] + (f" ({header['codigo']})" if header.get("codigo") else "") + "\n\n"
+        for text in rechunk(clean_text(raw_text), budget=budget, overlap=overlap):
+            text = prefix + text
+            tokens = estimate_tokens(text)
+            records.append({
+                "id": f"{documento_origen}__chunk_{len(records)}",
+                "text": text,
+                "metadata": {
+                    "documento_origen": documento_origen,
+                    "numero_chunk": len(records),
+                    "parte": part,
+                    "tokens": tokens,
+                    **header,
+                },
+            })
+            stats["tokens_after"] += tokens
+    stats["chunks_after"] = len(records)
+
+    os.makedirs(out_dir, exist_ok=True)
+    with open(os.path.join(out_dir, os.path.basename(path)), "w", encoding="utf-8") as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    return stats
+
+
+def normalize_corpus(
+    corpus_dir: str = SOURCE_DIR,
+    out_dir: str = NORMALIZED_DIR,
+    budget: int = CHUNK_TOKEN_BUDGET,
+    overlap: int = CHUNK_TOKEN_OVERLAP,
+) -> Dict[str, int]:
+    """Normaliza todo el corpus e imprime la reducción total de tokens"""
+    totals = {"chunks_before": 0, "chunks_after": 0, "tokens_before": 0, "tokens_after": 0}
+    # Los archivos de fuentes eliminadas no deben volver a sincronizarse
+    if os.path.isdir(out_dir):
+        for path in list_jsonl_files(out_dir):
+            os.remove(path)
+    for path in list_jsonl_files(corpus_dir):
+        for key, value in normalize_file(path, out_dir, budget, overlap).items():
+            totals[key] += value
+    saved = totals["tokens_before"] - totals["tokens_after"]
+    print("\nResumen de normalización:")
+    print(f"- Chunks: {totals['chunks_before']} -> {totals['chunks_after']}")
+    print(f"- Tokens estimados: {totals['tokens_before']} -> {totals['tokens_after']}")
+    if totals["tokens_before"]:
+        print(f"- Reducción: {saved} tokens ({saved / totals['tokens_before']:.1%})")
+    print(f"- Salida: {out_dir}")
+    return totals
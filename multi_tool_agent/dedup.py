@@ -0,0 +1,244 @@
+"""Detección de chunks casi duplicados en el corpus (MinHash + LSH).
+
+Muchas políticas comparten encabezados, texto legal y secciones repetidas. Esos
+chunks casi idénticos acaparan los `similarity_top_k` resultados e inflan el
+prompt. Este módulo agrupa los duplicados en tiempo aproximadamente lineal:
+
+1. Cada chunk se representa con sus shingles de palabras y una firma MinHash.
+2. LSH por bandas propone pares candidatos (solo chunks que comparten banda).
+3. Los candidatos se verifican con la similitud de Jaccard exacta y se unen
+   en clusters (union-find).
+
+Se conserva un chunk canónico por cluster con referencias a los documentos de
+los que se eliminaron sus copias, y se escribe un reporte en JSON. Como la
+unión encadena miembros (A~B y B~C no implica A~C), solo se eliminan los
+miembros cuya similitud con el canónico alcanza el umbral; tampoco se eliminan
+los chunks con un código o título que el canónico no tiene, que pueden ser los
+únicos que nombran a su documento.
+"""
+
+import hashlib
+import json
+import os
+import random
+import re
+import time
+from collections import defaultdict
+from typing import Any, Dict, List, Sequence, Set, Tuple
+
+from .corpus import DEDUP_DIR, iter_file_chunks, list_jsonl_files, parse_header
+from .local_retrieval import strip_accents
+
+DEDUP_REPORT_NAME = "dedup_report.json"
+# Similitud de Jaccard mínima para considerar dos chunks duplicados
+DEDUP_THRESHOLD = 0.8
+# 32 permutaciones en 8 bandas de 4 filas: umbral LSH ~0.6, verificado después con Jaccard exacto
+NUM_PERM = 32
+BANDS = 8
+SHINGLE_SIZE = 3
+
+_MASK64 = (1 << 64) - 1
+_WORD_RE = re.compile(r"\w+")
+# Códigos de política/procedimiento/guía: PO-OFF-FOH-CCA, PP-COM-COM-AIU, G-OPE-MER-CNE
+_CODE_RE = re.compile(r"\b[A-Z]{1,4}(?:-[A-Z0-9]{2,5}){2,4}\b")
+
+
+def shingles(text: str, size: int = SHINGLE_SIZE) -> Set[int]:
+    """Hashes (64 bits) de los n-gramas de palabras del texto normalizado"""
+    words = _WORD_RE.findall(strip_accents(text.lower()))
+    if len(words) < size:
+        words = words + [""] * (size - len(words))
+    return {
+        int.from_bytes(hashlib.blake2b(" ".join(words[i:i + size]).encode("utf-8"), digest_size=8).digest(), "little")
+        for i in range(len(words) - size + 1)
+    }
+
+
+class MinHasher:
+    """Firmas MinHash con permutaciones (a*x + b) mod 2^64"""
+
+    def __init__(self, num_perm: int = NUM_PERM, seed: int = 1):
+        rng = random.Random(seed)
+        self.permutations = [(rng.getrandbits(64) | 1, rng.getrandbits(64)) for _ in range(num_perm)]
+
+    def signature(self, hashes: Set[int]) -> Tuple[int, ...]:
+        values = list(hashes)
+        return tuple(min([(a * h + b) & _MASK64 for h in values]) for a, b in self.permutations)
+
+
+def jaccard(a: Set[int], b: Set[int]) -> float:
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+class _UnionFind:
+    def __init__(self, size: int):
+        self.parent = list(range(size))
+
+    def find(self, item: int) -> int:
+        while self.parent[item] != item:
+            self.parent[item] = self.parent[self.parent[item]]
+            item = self.parent[item]
+        return item
+
+    def union(self, a: int, b: int) -> None:
+        root_a, root_b = self.find(a), self.find(b)
+        if root_a != root_b:
+            # El índice menor (primera aparición) queda como raíz/canónico
+            self.parent[max(root_a, root_b)] = min(root_a, root_b)
+
+
+def find_duplicate_clusters(
+    texts: Sequence[str],
+    threshold: float = DEDUP_THRESHOLD,
+    num_perm: int = NUM_PERM,
+    bands: int = BANDS,
+) -> List[List[Tuple[int, float]]]:
+    """Agrupa textos casi duplicados.
+
+    Regresa clusters de más de un elemento como listas `(índice, similitud con
+    el canónico)`; el primer elemento de cada cluster es el canónico y el resto
+    tiene al menos `threshold` de similitud con él (los miembros unidos solo por
+    encadenamiento quedan fuera).
+    """
+    rows = num_perm // bands
+    hasher = MinHasher(num_perm)
+    shingle_sets = [shingles(text) for text in texts]
+
+    buckets: Dict[Tuple[int, Tuple[int, ...]], List[int]] = defaultdict(list)
+    for idx, hashes in enumerate(shingle_sets):
+        signature = hasher.signature(hashes)
+        for band in range(bands):
+            buckets[(band, signature[band * rows:(band + 1) * rows])].append(idx)
+
+    union_find = _UnionFind(len(texts))
+    checked: Set[Tuple[int, int]] = set()
+    for members in buckets.values():
+        if len(members) < 2:
+            continue
+        for i, first in enumerate(members):
+            for second in members[i + 1:]:
+                pair = (first, second)
+                if pair in checked or union_find.find(first) == union_find.find(second):
+                    continue
+                checked.add(pair)
+                if jaccard(shingle_sets[first], shingle_sets[second]) >= threshold:
+                    union_find.union(first, second)
+
+    clusters: Dict[int, List[int]] = defaultdict(list)
+    for idx in range(len(texts)):
+        clusters[union_find.find(idx)].append(idx)
+    result = []
+    for root, members in sorted(clusters.items()):
+        cluster = [(root, 1.0)]
+        for idx in members:
+            if idx == root:
+                continue
+            similarity = jaccard(shingle_sets[root], shingle_sets[idx])
+            if similarity >= threshold:
+                cluster.append((idx, round(similarity, 4)))
+        if len(cluster) > 1:
+            result.append(cluster)
+    return result
+
+
+def document_key(chunk: Dict[str, Any]) -> Tuple[frozenset, str]:
+    """Códigos de documento (encabezado o diagramas: `G-OPE-MER-CNE`) y título del chunk"""
+    metadata = chunk.get("metadata") or {}
+    text = chunk.get("text") or ""
+    header = parse_header(text)
+    codes = set(_CODE_RE.findall(text))
+    if metadata.get("codigo") or header.get("codigo"):
+        codes.add((metadata.get("codigo") or header.get("codigo")).upper())
+    return frozenset(codes), (metadata.get("titulo") or header.get("titulo") or "").lower()
+
+
+def names_other_document(chunk: Dict[str, Any], canonical: Dict[str, Any]) -> bool:
+    """El chunk trae un código o título que el canónico no tiene"""
+    codes, title = document_key(chunk)
+    canonical_codes, canonical_title = document_key(canonical)
+    return bool(codes - canonical_codes) or bool(title and title != canonical_title)
+
+
+def deduplicate_corpus(
+    source_dir: str,
+    out_dir: str = DEDUP_DIR,
+    threshold: float = DEDUP_THRESHOLD,
+) -> Dict[str, Any]:
+    """Escribe el corpus sin duplicados en `out_dir` junto con el reporte"""
+    start = time.perf_counter()
+    chunks: List[Dict[str, Any]] = []
+    files: List[str] = []
+    for path in list_jsonl_files(source_dir):
+        for chunk in iter_file_chunks(path):
+            chunks.append(chunk)
+            files.append(os.path.basename(path))
+
+    clusters = find_duplicate_clusters([chunk["text"] for chunk in chunks], threshold=threshold)
+
+    removed: Set[int] = set()
+    report_clusters = []
+    for cluster in clusters:
+        canonical_idx = cluster[0][0]
+        canonical = chunks[canonical_idx]
+        # Un chunk con el encabezado de otro documento es el que identifica a ese documento
+        cluster = cluster[:1] + [
+            (idx, similarity) for idx, similarity in cluster[1:]
+            if not names_other_document(chunks[idx], canonical)
+        ]
+        if len(cluster) < 2:
+            continue
+        duplicates = [chunks[idx] for idx, _ in cluster[1:]]
+        removed.update(idx for idx, _ in cluster[1:])
+        documentos = sorted({
+            chunk["metadata"].get("documento_origen") for chunk in [canonical] + duplicates
+        } - {None})
+        # Referencias de vuelta a los documentos fuente de las copias eliminadas
+        canonical["metadata"] = {
+            **canonical["metadata"],
+            "duplicados": [chunk["id"] for chunk in duplicates],
+            "documentos_relacionados": documentos,
+        }
+        report_clusters.append({
+            "canonico": canonical["id"],
+            "archivo": files[canonical_idx],
+            "duplicados": [
+                {"id": chunks[idx]["id"], "archivo": files[idx], "similitud": similarity}
+                for idx, similarity in cluster[1:]
+            ],
+            "documentos": documentos,
+        })
+
+    os.makedirs(out_dir, exist_ok=True)
+    for path in list_jsonl_files(out_dir):
+        os.remove(path)
+    by_file: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+    for idx, chunk in enumerate(chunks):
+        if idx not in removed:
+            by_file[files[idx]].append(chunk)
+    for name, kept in by_file.items():
+        with open(os.path.join(out_dir, name), "w", encoding="utf-8") as f:
+            for chunk in kept:
+                f.write(json.dumps(chunk, ensure_ascii=False) + "\n")
+
+    report = {
+        "origen": source_dir,
+        "umbral": threshold,
+        "chunks_totales": len(chunks),
+        "chunks_eliminados": len(removed),
+        "clusters": len(report_clusters),
+        "segundos": round(time.perf_counter() - start, 2),
+        "detalle": sorted(report_clusters, key=lambda item: len(item["duplicados"]), reverse=True),
+    }
+    with open(os.path.join(out_dir, DEDUP_REPORT_NAME), "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    print("\nResumen de deduplicación:")
+    print(f"- Chunks analizados: {len(chunks)}")
+    print(f"- Clusters de duplicados: {len(report_clusters)}")
+    print(f"- Chunks eliminados: {len(removed)} ({len(removed) / max(1, len(chunks)):.1%})")
+    print(f"- Archivos resultantes: {len(by_file)}")
+    print(f"- Tiempo: {report['segundos']}s")
+    print(f"- Reporte: {os.path.join(out_dir, DEDUP_REPORT_NAME)}")
+    return report
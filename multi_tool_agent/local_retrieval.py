@@ -0,0 +1,300 @@
+"""Backend de recuperación local (BM25) sobre los chunks del corpus.
+
+Construye un índice invertido persistido en disco que permite responder las
+llamadas a `document_retrieval` dentro del proceso, sin ir a Vertex RAG. Se usa
+como backend principal (`RAG_BACKEND=local`) o como respaldo cuando Vertex
+responde con errores de cuota o de disponibilidad. Indexa el conjunto
+deduplicado (data/dedup) si existe, si no los chunks de data/outputs.
+
+Uso desde línea de comandos:
+
+    python -m multi_tool_agent.local_retrieval build
+    python -m multi_tool_agent.local_retrieval search "cancelaciones en caja"
+"""
+
+import argparse
+import gzip
+import json
+import logging
+import math
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import Counter, defaultdict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from .corpus import CORPUS_DIR, REPO_ROOT, corpus_signature, iter_chunks
+
+logger = logging.getLogger(__name__)
+
+LOCAL_INDEX_PATH = os.getenv(
+    "LOCAL_INDEX_PATH",
+    os.path.join(REPO_ROOT, "data", "local_index", "bm25_index.json.gz"),
+)
+# 2: IDs únicos y `parte` en la metadata de cada chunk (corpus.iter_file_chunks)
+INDEX_FORMAT_VERSION = 2
+
+# Palabras vacías del español (y algunas muy frecuentes en los encabezados de
+# las políticas) que no aportan a la relevancia.
+STOPWORDS_ES = frozenset("""
+a al algo algun alguna algunas alguno algunos ante antes aquel aquella aquellas
+aquello aquellos aqui asi aun cada como con contra cual cuales cuando de del
+desde donde dos durante e el ella ellas ello ellos en entre era eran es esa esas
+ese eso esos esta estaba estado estan estar estas este esto estos fue fueron ha
+habia han hasta hay la las le les lo los mas me mi mis mucho muy nada ni no nos
+nosotros o os otra otras otro otros para pero poco por porque que quien quienes
+se sea sean segun ser si sido sin sobre solo son su sus tambien tanto te tiene
+tienen toda todas todo todos tu tus u un una unas uno unos usted ustedes y ya
+cual cuales debe deben debera deberan sera seran
+""".split())
+
+_TOKEN_RE = re.compile(r"[a-z0-9ñ]+")
+
+
+def strip_accents(text: str) -> str:
+    """Elimina acentos conservando la letra base (á -> a, ñ -> n)"""
+    normalized = unicodedata.normalize("NFKD", text)
+    return "".join(ch for ch in normalized if not unicodedata.combining(ch))
+
+
+def _stem(token: str) -> str:
+    """Stemming ligero para plurales en español"""
+    if len(token) > 5 and token.endswith("iones"):
+        return token[:-2]
+    if len(token) > 4 and token.endswith("es") and token[-3] not in "aeiou":
+        return token[:-2]
+    if len(token) > 3 and token.endswith("s"):
+        return token[:-1]
+    return token
+
+
+def tokenize(text: str) -> List[str]:
+    """Normaliza (minúsculas, sin acentos, sin stopwords) y separa en términos"""
+    text = strip_accents(text.lower())
+    return [
+        _stem(token)
+        for token in _TOKEN_RE.findall(text)
+        if len(token) > 1 and token not in STOPWORDS_ES
+    ]
+
+
+class BM25Index:
+    """Índice invertido BM25 en memoria con persistencia en JSON comprimido"""
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.ids: List[str] = []
+        self.texts: List[str] = []
+        self.metadata: List[Dict[str, Any]] = []
+        self.doc_lengths: List[int] = []
+        self.postings: Dict[str, List[Tuple[int, int]]] = {}
+        self.signature: Optional[str] = None
+        self._avgdl = 0.0
+        self._idf: Dict[str, float] = {}
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def add_documents(self, chunks: Iterable[Dict[str, Any]]) -> None:
+        """Agrega chunks `{id, text, metadata}` al índice"""
+        postings = defaultdict(list, self.postings)
+        for chunk in chunks:
+            doc_idx = len(self.ids)
+            terms = tokenize(chunk["text"])
+            self.ids.append(chunk["id"])
+            self.texts.append(chunk["text"])
+            self.metadata.append(chunk.get("metadata") or {})
+            self.doc_lengths.append(len(terms))
+            for term, tf in Counter(terms).items():
+                postings[term].append((doc_idx, tf))
+        self.postings = dict(postings)
+        self._refresh_stats()
+
+    def _refresh_stats(self) -> None:
+        total_docs = len(self.ids)
+        self._avgdl = (sum(self.doc_lengths) / total_docs) if total_docs else 0.0
+        self._idf = {
+            term: math.log(1 + (total_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+            for term, docs in self.postings.items()
+        }
+
+    def search(
+        self,
+        query: str,
+        top_k: int = 10,
+        allowed_docs: Optional[set] = None,
+    ) -> List[Tuple[int, float]]:
+        """Regresa una lista `(índice de chunk, score)` ordenada por relevancia"""
+        scores: Dict[int, float] = defaultdict(float)
+        for term in set(tokenize(query)):
+            idf = self._idf.get(term)
+            if idf is None:
+                continue
+            for doc_idx, tf in self.postings[term]:
+                if allowed_docs is not None and doc_idx not in allowed_docs:
+                    continue
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[doc_idx] / self._avgdl)
+                scores[doc_idx] += idf * tf * (self.k1 + 1) / (tf + norm)
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        return ranked[:top_k]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "format_version": INDEX_FORMAT_VERSION,
+            "signature": self.signature,
+            "k1": self.k1,
+            "b": self.b,
+            "ids": self.ids,
+            "texts": self.texts,
+            "metadata": self.metadata,
+            "doc_lengths": self.doc_lengths,
+            "postings": self.postings,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "BM25Index":
+        index = cls(k1=data["k1"], b=data["b"])
+        index.signature = data.get("signature")
+        index.ids = data["ids"]
+        index.texts = data["texts"]
+        index.metadata = data["metadata"]
+        index.doc_lengths = data["doc_lengths"]
+        index.postings = {
+            term: [tuple(posting) for posting in docs]
+            for term, docs in data["postings"].items()
+        }
+        index._refresh_stats()
+        return index
+
+    def save(self, path: str = LOCAL_INDEX_PATH) -> None:
+        """Persiste el índice en disco (JSON comprimido con gzip)"""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str = LOCAL_INDEX_PATH) -> "BM25Index":
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("format_version") != INDEX_FORMAT_VERSION:
+            raise ValueError(f"Formato de índice no soportado en {path}")
+        return cls.from_dict(data)
+
+
+def build_index(corpus_dir: str = CORPUS_DIR, path: str = LOCAL_INDEX_PATH) -> BM25Index:
+    """Construye el índice BM25 sobre el corpus y lo guarda en disco"""
+    start = time.perf_counter()
+    index = BM25Index()
+    index.add_documents(iter_chunks(corpus_dir))
+    index.signature = corpus_signature(corpus_dir)
+    index.save(path)
+    logger.info(
+        f"Índice local construido: {len(index)} chunks, {len(index.postings)} términos "
+        f"en {time.perf_counter() - start:.2f}s ({path})"
+    )
+    return index
+
+
+def load_or_build_index(corpus_dir: str = CORPUS_DIR, path: str = LOCAL_INDEX_PATH) -> BM25Index:
+    """Carga el índice persistido o lo reconstruye si no existe o está desactualizado"""
+    if os.path.exists(path):
+        try:
+            index = BM25Index.load(path)
+            if index.signature == corpus_signature(corpus_dir):
+                return index
+            logger.info("El corpus cambió desde la última construcción del índice local")
+        except (OSError, ValueError) as e:
+            logger.warning(f"No se pudo cargar el índice local: {str(e)}")
+    return build_index(corpus_dir, path)
+
+
+class LocalRagBackend:
+    """Responde consultas con el índice BM25 con la misma forma que Vertex RAG"""
+
+    def __init__(self, corpus_dir: str = CORPUS_DIR, index_path: str = LOCAL_INDEX_PATH):
+        self.corpus_dir = corpus_dir
+        self.index_path = index_path
+        self._index: Optional[BM25Index] = None
+        self._document_positions: Optional[Dict[str, List[int]]] = None
+        self._lock = threading.Lock()
+
+    @property
+    def index(self) -> BM25Index:
+        if self._index is None:
+            with self._lock:
+                if self._index is None:
+                    self._index = load_or_build_index(self.corpus_dir, self.index_path)
+        return self._index
+
+    def allowed_positions(self, documents: Iterable[str]) -> set:
+        """Posiciones en el índice de los chunks de los documentos indicados"""
+        index = self.index
+        if self._document_positions is None:
+            positions: Dict[str, List[int]] = defaultdict(list)
+            for position, metadata in enumerate(index.metadata):
+                positions[metadata.get("documento_origen")].append(position)
+            self._document_positions = dict(positions)
+        return {position for document in documents for position in self._document_positions.get(document, ())}
+
+    def search(
+        self,
+        query: str,
+        top_k: int = 10,
+        documents: Optional[Iterable[str]] = None,
+    ) -> List[Dict[str, Any]]:
+        """Regresa los `top_k` chunks más relevantes como `{text, metadata, score}`.
+
+        Con `documents` la búsqueda se limita a los chunks de esos `documento_origen`.
+        """
+        index = self.index
+        allowed = self.allowed_positions(documents) if documents is not None else None
+        return [
+            {
+                "text": index.texts[doc_idx],
+                "metadata": {"id": index.ids[doc_idx], **index.metadata[doc_idx]},
+                "score": round(score, 4),
+            }
+            for doc_idx, score in index.search(query, top_k=top_k, allowed_docs=allowed)
+        ]
+
+
+_default_backend: Optional[LocalRagBackend] = None
+
+
+def get_local_backend() -> LocalRagBackend:
+    """Instancia compartida del backend local (el índice se carga una sola vez)"""
+    global _default_backend
+    if _default_backend is None:
+        _default_backend = LocalRagBackend()
+    return _default_backend
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Índice BM25 local del corpus")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("build", help="Construir y guardar el índice")
+    search_parser = subparsers.add_parser("search", help="Consultar el índice")
+    search_parser.add_argument("query")
+    search_parser.add_argument("--top-k", type=int, default=5)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    if args.command == "build":
+        build_index()
+    else:
+        start = time.perf_counter()
+        matches = get_local_backend().search(args.query, top_k=args.top_k)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        for match in matches:
+            print(f"[{match['score']:.3f}] {match['metadata'].get('id')}")
+            print(f"    {match['text'][:200]!r}")
+        print(f"\n{len(matches)} resultados en {elapsed_ms:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,297 @@
+"""Índice de metadata estructurada de los documentos del corpus.
+
+Cada documento trae un encabezado con Dirección, Área, Procedimiento/Política,
+Código (p. ej. `PO-OFF-FOH-CCA`) y Fecha. Un `documento_origen` puede contener
+varias políticas seguidas (subdocumentos, `metadata.parte`), cada una con su
+propio encabezado. Este módulo los extrae al ingerir el corpus en un índice
+compacto por `documento_origen` y por subdocumento que permite:
+
+- responder búsquedas exactas por código o título sin búsqueda vectorial, con
+  los chunks y el encabezado de la política que corresponde,
+- restringir la recuperación a una Dirección/Área cuando la consulta lo indica
+  ("área de Tesorería") o la sesión la fija (`state["area"]`): en el índice
+  local como conjunto de chunks y en Vertex como `rag_file_ids` tomados del
+  manifiesto de sincronización,
+- completar título, código y fecha de actualización en los resultados de
+  Vertex, que solo traen el nombre del archivo.
+
+    python -m multi_tool_agent.metadata_index build
+    python -m multi_tool_agent.metadata_index lookup "PO-OFF-FOH-CCA"
+"""
+
+import argparse
+import json
+import logging
+import os
+import re
+import threading
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from .cache import normalize_query
+from .corpus import (
+    CORPUS_DIR,
+    CORPUS_MANIFEST_PATH,
+    HEADER_FIELDS,
+    REPO_ROOT,
+    corpus_signature,
+    iter_file_chunks,
+    list_jsonl_files,
+    parse_header,
+)
+
+logger = logging.getLogger(__name__)
+
+METADATA_INDEX_PATH = os.getenv(
+    "METADATA_INDEX_PATH", os.path.join(REPO_ROOT, "data", "metadata_index.json")
+)
+INDEX_FORMAT_VERSION = 2
+METADATA_FIELDS = tuple(HEADER_FIELDS.values()) + ("titulo",)
+
+# Códigos de política/procedimiento: PO-OFF-FOH-CCA, PP-COM-COM-AIU, CDS-OPE-ASC
+_CODE_RE = re.compile(r"\b[A-Z]{2,4}(?:-[A-Z0-9]{2,5}){2,4}\b")
+# La consulta solo se filtra si nombra el área explícitamente
+_AREA_CUE_RE = r"\b(?:area|direccion|departamento)\s+(?:de\s+(?:la\s+|los\s+)?)?{name}\b"
+# Frases que se ignoran al comparar la consulta con un título
+_TITLE_PREFIX_RE = re.compile(r"^(?:(?:la|el)\s+)?(?:politica|procedimiento|documento|proceso)\s+(?:de\s+(?:la\s+|los\s+|las\s+)?)?")
+
+
+# (documento_origen, parte) de una política
+PartKey = Tuple[str, int]
+
+
+class MetadataIndex:
+    """Metadata por `documento_origen` y por política con búsquedas por código, título y área"""
+
+    def __init__(self, documents: Optional[Dict[str, Dict[str, Any]]] = None, signature: Optional[str] = None):
+        self.documents: Dict[str, Dict[str, Any]] = documents or {}
+        self.signature = signature
+        self.by_code: Dict[str, PartKey] = {}
+        self.by_title: Dict[str, PartKey] = {}
+        self.by_file: Dict[str, List[str]] = defaultdict(list)
+        self.by_area: Dict[str, Set[str]] = defaultdict(set)
+        self._area_patterns: Dict[str, "re.Pattern[str]"] = {}
+        self._ambiguous_titles: Set[str] = set()
+        for document, entry in self.documents.items():
+            self._add_to_lookups(document, entry)
+        # Un título que comparten varias políticas no identifica a ninguna
+        for title in self._ambiguous_titles:
+            del self.by_title[title]
+        for name in self.by_area:
+            self._area_patterns[name] = re.compile(_AREA_CUE_RE.format(name=re.escape(name)))
+
+    def __len__(self) -> int:
+        return len(self.documents)
+
+    def _add_to_lookups(self, document: str, entry: Dict[str, Any]) -> None:
+        parts = entry["partes"]
+        for part in parts:
+            key = (document, part["parte"])
+            if part.get("codigo"):
+                self.by_code.setdefault(part["codigo"].upper(), key)
+            if part.get("titulo"):
+                title = normalize_query(part["titulo"])
+                if self.by_title.setdefault(title, key) != key:
+                    self._ambiguous_titles.add(title)
+            for field in ("area", "direccion"):
+                name = normalize_query(part.get(field) or "").strip("_ ")
+                if re.search(r"[a-z]", name):
+                    self.by_area[name].add(document)
+        # El nombre del archivo solo identifica una política si el documento tiene una
+        if len(parts) == 1:
+            self.by_title.setdefault(normalize_query(document.replace("_", " ")), (document, parts[0]["parte"]))
+        self.by_file[entry["archivo"]].append(document)
+
+    # --- Búsquedas exactas ---
+
+    def lookup(self, query: str) -> Optional[PartKey]:
+        """Política (documento, parte) cuyo código aparece en la consulta o cuyo título es la consulta"""
+        for code in _CODE_RE.findall(query.upper()):
+            if code in self.by_code:
+                return self.by_code[code]
+        normalized = normalize_query(query).strip(" ?")
+        return self.by_title.get(normalized) or self.by_title.get(_TITLE_PREFIX_RE.sub("", normalized))
+
+    def document_chunks(
+        self, document: str, part: Optional[int] = None, corpus_dir: str = CORPUS_DIR
+    ) -> List[Dict[str, Any]]:
+        """Chunks del documento (o solo de la política `part`): del almacén binario si ya está
+        construido (aquí nunca se construye) o del JSONL
+        """
+        entry = self.documents[document]
+        if corpus_dir == CORPUS_DIR:
+            from .chunk_store import get_chunk_store
+
+            store = get_chunk_store(build=False)
+            if store is not None:
+                return store.document_chunks(document, part=part)
+        path = os.path.join(corpus_dir, entry["archivo"])
+        return [
+            chunk for chunk in iter_file_chunks(path)
+            if (chunk["metadata"].get("documento_origen") or document) == document
+            and (part is None or chunk["metadata"]["parte"] == part)
+        ]
+
+    # --- Filtros por área ---
+
+    def detect_area(self, query: str) -> Optional[str]:
+        """Área o Dirección nombrada explícitamente en la consulta ("área de Compras")"""
+        normalized = normalize_query(query)
+        matches = [name for name, pattern in self._area_patterns.items() if pattern.search(normalized)]
+        # Con varias coincidencias gana la más específica ("operaciones off" sobre "operaciones")
+        return max(matches, key=len) if matches else None
+
+    def documents_in_area(self, area: str) -> Set[str]:
+        return set(self.by_area.get(normalize_query(area), ()))
+
+    def files_for_documents(self, documents: Set[str]) -> Set[str]:
+        return {self.documents[document]["archivo"] for document in documents if document in self.documents}
+
+    # --- Enriquecimiento ---
+
+    def metadata_for_document(self, document: str, part: Optional[int] = None) -> Dict[str, Any]:
+        """Encabezado de la política `part`; sin ella, solo los campos que comparten todas las políticas"""
+        parts = self.documents.get(document, {}).get("partes", [])
+        if part is not None:
+            parts = [entry for entry in parts if entry["parte"] == part]
+        header: Dict[str, Any] = {"documento_origen": document}
+        if part is not None:
+            header["parte"] = part
+        for field in METADATA_FIELDS:
+            values = {entry.get(field) for entry in parts}
+            if len(values) == 1 and None not in values:
+                header[field] = values.pop()
+        return header
+
+    def metadata_for_file(self, file_name: Optional[str]) -> Dict[str, Any]:
+        """Metadata del (primer) documento de un archivo, p. ej. `source_display_name` de Vertex"""
+        documents = self.by_file.get(os.path.basename(file_name or ""))
+        return self.metadata_for_document(documents[0]) if documents else {}
+
+    # --- Persistencia ---
+
+    def save(self, path: str = METADATA_INDEX_PATH) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(
+                {"format_version": INDEX_FORMAT_VERSION, "signature": self.signature, "documents": self.documents},
+                f, ensure_ascii=False, indent=1,
+            )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str = METADATA_INDEX_PATH) -> "MetadataIndex":
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("format_version") != INDEX_FORMAT_VERSION:
+            raise ValueError(f"Formato de índice de metadata no soportado en {path}")
+        return cls(data["documents"], data.get("signature"))
+
+
+def extract_documents(corpus_dir: str = CORPUS_DIR) -> Dict[str, Dict[str, Any]]:
+    """Archivo de cada `documento_origen` del corpus y, por política (`parte`), su encabezado y los IDs de sus chunks"""
+    texts: Dict[PartKey, List[str]] = defaultdict(list)
+    documents: Dict[str, Dict[str, Any]] = {}
+    for path in list_jsonl_files(corpus_dir):
+        file_name = os.path.basename(path)
+        for chunk in iter_file_chunks(path):
+            metadata = chunk["metadata"]
+            document = metadata.get("documento_origen") or file_name[:-len(".jsonl")]
+            parts = documents.setdefault(document, {"archivo": file_name, "partes": {}})["partes"]
+            entry = parts.setdefault(metadata["parte"], {"parte": metadata["parte"], "chunks": []})
+            entry["chunks"].append(chunk["id"])
+            # Los chunks normalizados ya traen el encabezado en su metadata
+            for field in METADATA_FIELDS:
+                if metadata.get(field) and field not in entry:
+                    entry[field] = metadata[field]
+            texts[(document, metadata["parte"])].append(chunk["text"])
+    for document, entry in documents.items():
+        for part, part_entry in entry["partes"].items():
+            for field, value in parse_header("".join(texts[(document, part)])).items():
+                part_entry.setdefault(field, value)
+        entry["partes"] = [entry["partes"][part] for part in sorted(entry["partes"])]
+    return documents
+
+
+def build_metadata_index(corpus_dir: str = CORPUS_DIR, path: str = METADATA_INDEX_PATH) -> MetadataIndex:
+    """Extrae la metadata del corpus y guarda el índice"""
+    index = MetadataIndex(extract_documents(corpus_dir), corpus_signature(corpus_dir))
+    index.save(path)
+    logger.info(
+        f"Índice de metadata construido: {len(index)} documentos, "
+        f"{sum(len(entry['partes']) for entry in index.documents.values())} políticas, {len(index.by_code)} códigos, "
+        f"{len(index.by_area)} áreas/direcciones ({path})"
+    )
+    return index
+
+
+def load_or_build_metadata_index(corpus_dir: str = CORPUS_DIR, path: str = METADATA_INDEX_PATH) -> MetadataIndex:
+    """Carga el índice persistido o lo reconstruye si el corpus cambió"""
+    if os.path.exists(path):
+        try:
+            index = MetadataIndex.load(path)
+            if index.signature == corpus_signature(corpus_dir):
+                return index
+            logger.info("El corpus cambió desde la última construcción del índice de metadata")
+        except (OSError, ValueError) as e:
+            logger.warning(f"No se pudo cargar el índice de metadata: {str(e)}")
+    return build_metadata_index(corpus_dir, path)
+
+
+def rag_file_ids(file_names: Set[str], manifest_path: str = CORPUS_MANIFEST_PATH) -> List[str]:
+    """IDs de archivos de Vertex RAG (último segmento de `rag_file`) según el manifiesto"""
+    if not os.path.exists(manifest_path):
+        return []
+    with open(manifest_path, encoding="utf-8") as f:
+        files = json.load(f).get("files", {})
+    return sorted(
+        files[name]["rag_file"].rsplit("/", 1)[-1]
+        for name in file_names
+        if files.get(name, {}).get("rag_file")
+    )
+
+
+_default_index: Optional[MetadataIndex] = None
+_default_lock = threading.Lock()
+
+
+def get_metadata_index() -> MetadataIndex:
+    """Índice compartido por proceso (se carga una sola vez)"""
+    global _default_index
+    if _default_index is None:
+        with _default_lock:
+            if _default_index is None:
+                _default_index = load_or_build_metadata_index()
+    return _default_index
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Índice de metadata de los documentos del corpus")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser("build", help="Construir y guardar el índice")
+    build_parser.add_argument("--corpus-dir", default=CORPUS_DIR)
+    lookup_parser = subparsers.add_parser("lookup", help="Buscar por código, título o área")
+    lookup_parser.add_argument("query")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    if args.command == "build":
+        build_metadata_index(args.corpus_dir)
+        return
+
+    index = get_metadata_index()
+    found = index.lookup(args.query)
+    if found:
+        document, part = found
+        entry = next(entry for entry in index.documents[document]["partes"] if entry["parte"] == part)
+        print(json.dumps({document: entry}, ensure_ascii=False, indent=2))
+    area = index.detect_area(args.query)
+    if area:
+        print(f"Área detectada: {area} ({len(index.documents_in_area(area))} documentos)")
+    if not found and not area:
+        print("Sin coincidencias exactas")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,385 @@
+"""Métricas de latencia por etapa en formato Prometheus.
+
+Registro mínimo de contadores e histogramas (sin dependencias externas) que
+se expone en `/metrics` desde main.py. Se alimenta desde:
+
+- los callbacks `before/after_model_callback` del agente (latencia de Gemini y tokens),
+- `CustomVertexAiRagRetrieval` (latencia, resultados y tamaño de la recuperación),
+- `MetricsMiddleware` (latencia de extremo a extremo de `/run`, `/run_sse` y sesiones),
+- `before/after_agent_callback` (desglose por invocación: modelo, herramienta y resto).
+
+Con `METRICS_SPAN_LOGS=TRUE` cada invocación escribe además una línea de log
+con el desglose de tiempos y el ID de sesión.
+"""
+
+import logging
+import os
+import re
+import threading
+import time
+from bisect import bisect_left
+from typing import Dict, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "TRUE").upper() == "TRUE"
+METRICS_SPAN_LOGS = os.getenv("METRICS_SPAN_LOGS", "FALSE").upper() == "TRUE"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50)
+BYTES_BUCKETS = (1e3, 5e3, 1e4, 2.5e4, 5e4, 1e5, 2.5e5, 1e6)
+TOKEN_BUCKETS = (100, 250, 500, 1000, 2500, 5000, 10000, 25000, 50000, 100000)
+
+LabelValues = Tuple[str, ...]
+
+
+def _format_labels(names: Sequence[str], values: LabelValues, extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Counter:
+    """Contador monótono con etiquetas"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[LabelValues, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(tuple(str(labels.get(name, "")) for name in self.labelnames), 0)
+
+    def render(self) -> str:
+        with self._lock:
+            values = sorted(self._values.items())
+        return "\n".join(
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in values
+        )
+
+
+class Histogram:
+    """Histograma acumulado con cubetas fijas y etiquetas"""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Por etiqueta: conteo por cubeta (la última es +Inf), suma y total
+        self._series: Dict[LabelValues, Tuple[list, list]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        position = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = ([0] * (len(self.buckets) + 1), [0.0, 0])
+            series[0][position] += 1
+            series[1][0] += value
+            series[1][1] += 1
+
+    def count(self, **labels) -> int:
+        series = self._series.get(tuple(str(labels.get(name, "")) for name in self.labelnames))
+        return series[1][1] if series else 0
+
+    def render(self) -> str:
+        with self._lock:
+            snapshot = sorted((key, (list(counts), list(totals))) for key, (counts, totals) in self._series.items())
+        lines = []
+        for key, (counts, (total_sum, total_count)) in snapshot:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else _format_value(bound)
+                le_label = f'le="{le}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le_label)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total_sum)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {total_count}")
+        return "\n".join(lines)
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """Exposición en formato de texto de Prometheus (versión 0.0.4)"""
+        blocks = []
+        for metric in self._metrics:
+            body = metric.render()
+            blocks.append(f"# HELP {metric.name} {metric.documentation}\n# TYPE {metric.name} {metric.kind}")
+            if body:
+                blocks.append(body)
+        return "\n".join(blocks) + "\n"
+
+
+REGISTRY = Registry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+RETRIEVAL_SECONDS = REGISTRY.register(Histogram(
+    "rag_retrieval_seconds", "Latencia de la recuperación RAG", ["backend", "source"]))
+RETRIEVAL_RESULTS = REGISTRY.register(Histogram(
+    "rag_retrieval_results", "Resultados regresados por la recuperación RAG", ["backend"], COUNT_BUCKETS))
+RETRIEVAL_PAYLOAD_BYTES = REGISTRY.register(Histogram(
+    "rag_retrieval_payload_bytes", "Tamaño del resultado de la recuperación enviado al modelo", ["backend"], BYTES_BUCKETS))
+RETRIEVAL_RETRIES = REGISTRY.register(Counter(
+    "rag_retrieval_retries_total", "Reintentos de la recuperación RAG", ["reason"]))
+RETRIEVAL_HEDGES = REGISTRY.register(Counter(
+    "rag_retrieval_hedges_total", "Solicitudes duplicadas a Vertex (sent) y las que respondieron primero (won)", ["outcome"]))
+RETRIEVAL_BREAKER = REGISTRY.register(Counter(
+    "rag_circuit_breaker_transitions_total", "Cambios de estado del circuit breaker de RAG", ["state"]))
+RETRIEVAL_FALLBACKS = REGISTRY.register(Counter(
+    "rag_retrieval_fallbacks_total", "Consultas respondidas por el índice local como respaldo", ["reason"]))
+ANSWER_CACHE_REQUESTS = REGISTRY.register(Counter(
+    "answer_cache_requests_total", "Consultas a la caché de respuestas por resultado", ["result"]))
+PREFETCH = REGISTRY.register(Counter(
+    "rag_prefetch_total", "Búsquedas anticipadas por resultado (started, used, wasted, failed)", ["outcome"]))
+PREFETCH_HIDDEN_SECONDS = REGISTRY.register(Histogram(
+    "rag_prefetch_hidden_seconds", "Latencia de recuperación ocultada por la búsqueda anticipada"))
+ERRORS = REGISTRY.register(Counter(
+    "agent_errors_total", "Errores por etapa", ["stage", "type"]))
+HISTORY_TOKENS = REGISTRY.register(Histogram(
+    "llm_history_tokens", "Tokens estimados del historial enviado al modelo (original y compactado)", ["stage"], TOKEN_BUCKETS))
+MODEL_SECONDS = REGISTRY.register(Histogram(
+    "llm_call_seconds", "Latencia de cada llamada al modelo", ["model"]))
+MODEL_TOKENS = REGISTRY.register(Histogram(
+    "llm_tokens", "Tokens por llamada al modelo", ["model", "kind"], TOKEN_BUCKETS))
+MODEL_TOKENS_TOTAL = REGISTRY.register(Counter(
+    "llm_tokens_total", "Tokens acumulados por tipo", ["model", "kind"]))
+INVOCATION_STAGE_SECONDS = REGISTRY.register(Histogram(
+    "agent_invocation_stage_seconds", "Tiempo por etapa dentro de una invocación del agente", ["stage"]))
+HTTP_SECONDS = REGISTRY.register(Histogram(
+    "http_request_seconds", "Latencia de extremo a extremo por endpoint", ["route", "method", "status"]))
+
+
+# ---------------------------------------------------------------------------
+# Desglose por invocación
+# ---------------------------------------------------------------------------
+
+class _InvocationTimings:
+    __slots__ = ("session_id", "started", "model_started", "stages")
+
+    def __init__(self, session_id: Optional[str]):
+        self.session_id = session_id
+        self.started = time.perf_counter()
+        self.model_started: Optional[float] = None
+        self.stages: Dict[str, float] = {"model": 0.0, "tool": 0.0}
+
+
+_invocations: Dict[str, _InvocationTimings] = {}
+_invocations_lock = threading.Lock()
+# Invocaciones sin after_agent_callback (error a media ejecución) se descartan después de N segundos
+INVOCATION_TTL_SECONDS = 900
+
+
+def session_id_of(context) -> Optional[str]:
+    """ID de sesión de un CallbackContext/ToolContext del ADK"""
+    invocation = getattr(context, "_invocation_context", None)
+    session = getattr(invocation, "session", None)
+    return getattr(session, "id", None)
+
+
+def _timings(context) -> Optional[_InvocationTimings]:
+    invocation_id = getattr(context, "invocation_id", None)
+    if invocation_id is None:
+        return None
+    with _invocations_lock:
+        timings = _invocations.get(invocation_id)
+        if timings is None:
+            timings = _InvocationTimings(session_id_of(context))
+            # Las invocaciones abandonadas no deben acumularse en memoria
+            expired = [
+                key for key, value in _invocations.items()
+                if timings.started - value.started > INVOCATION_TTL_SECONDS
+            ]
+            for key in expired:
+                del _invocations[key]
+            _invocations[invocation_id] = timings
+        return timings
+
+
+def record_tool_time(context, seconds: float) -> None:
+    """Suma el tiempo de una herramienta a la invocación en curso"""
+    timings = _timings(context)
+    if timings is not None:
+        timings.stages["tool"] += seconds
+
+
+def before_agent_callback(callback_context):
+    if METRICS_ENABLED:
+        _timings(callback_context)
+    return None
+
+
+def after_agent_callback(callback_context):
+    if not METRICS_ENABLED:
+        return None
+    with _invocations_lock:
+        timings = _invocations.pop(callback_context.invocation_id, None)
+    if timings is None:
+        return None
+    total = time.perf_counter() - timings.started
+    # Lo que no es modelo ni herramienta: carga de sesión, bucle de eventos del ADK, callbacks
+    other = max(0.0, total - timings.stages["model"] - timings.stages["tool"])
+    for stage, seconds in (("total", total), ("other", other), *timings.stages.items()):
+        INVOCATION_STAGE_SECONDS.observe(seconds, stage=stage)
+    if METRICS_SPAN_LOGS:
+        logger.info(
+            f"span session={timings.session_id} invocation={callback_context.invocation_id} "
+            f"total_ms={total * 1000:.0f} model_ms={timings.stages['model'] * 1000:.0f} "
+            f"tool_ms={timings.stages['tool'] * 1000:.0f} other_ms={other * 1000:.0f}"
+        )
+    return None
+
+
+def before_model_callback(callback_context, llm_request):
+    if METRICS_ENABLED:
+        timings = _timings(callback_context)
+        if timings is not None:
+            timings.model_started = time.perf_counter()
+    return None
+
+
+def model_name(context) -> str:
+    agent = getattr(getattr(context, "_invocation_context", None), "agent", None)
+    model = getattr(agent, "model", "")
+    # `model` puede ser el nombre o una instancia de BaseLlm
+    return model if isinstance(model, str) else str(getattr(model, "model", ""))
+
+
+def after_model_callback(callback_context, llm_response):
+    if not METRICS_ENABLED or getattr(llm_response, "partial", False):
+        return None
+    timings = _timings(callback_context)
+    model = model_name(callback_context)
+    if timings is not None and timings.model_started is not None:
+        elapsed = time.perf_counter() - timings.model_started
+        timings.model_started = None
+        timings.stages["model"] += elapsed
+        MODEL_SECONDS.observe(elapsed, model=model)
+        if METRICS_SPAN_LOGS:
+            logger.info(f"span session={timings.session_id} stage=model ms={elapsed * 1000:.0f}")
+    if getattr(llm_response, "error_code", None):
+        ERRORS.inc(stage="model", type=str(llm_response.error_code))
+    usage = getattr(llm_response, "usage_metadata", None)
+    if usage is not None:
+        for kind, value in (
+            ("prompt", usage.prompt_token_count),
+            ("completion", usage.candidates_token_count),
+        ):
+            if value:
+                MODEL_TOKENS.observe(value, model=model, kind=kind)
+                MODEL_TOKENS_TOTAL.inc(value, model=model, kind=kind)
+    return None
+
+
+def record_retrieval(
+    backend: str,
+    source: str,
+    seconds: float,
+    result_count: int,
+    payload_bytes: int,
+    session_id: Optional[str] = None,
+) -> None:
+    """Registra una consulta de recuperación (source: vertex, local, fallback o cache)"""
+    if not METRICS_ENABLED:
+        return
+    RETRIEVAL_SECONDS.observe(seconds, backend=backend, source=source)
+    RETRIEVAL_RESULTS.observe(result_count, backend=backend)
+    RETRIEVAL_PAYLOAD_BYTES.observe(payload_bytes, backend=backend)
+    if METRICS_SPAN_LOGS:
+        logger.info(
+            f"span session={session_id} stage=retrieval source={source} ms={seconds * 1000:.0f} "
+            f"results={result_count} bytes={payload_bytes}"
+        )
+
+
+# ---------------------------------------------------------------------------
+# Middleware ASGI
+# ---------------------------------------------------------------------------
+
+_ROUTE_PATTERNS = (
+    (re.compile(r"^/apps/[^/]+/users/[^/]+/sessions(/[^/]+)?$"), "/apps/{app}/users/{user}/sessions"),
+    (re.compile(r"^/apps/[^/]+/users/[^/]+/sessions/[^/]+/.*$"), "/apps/{app}/users/{user}/sessions/{id}/..."),
+)
+_TRACKED_ROUTES = ("/run", "/run_sse", "/batch")
+
+
+def route_label(path: str) -> Optional[str]:
+    """Ruta agrupada para las etiquetas (sin IDs); None si no se mide"""
+    if path in _TRACKED_ROUTES:
+        return path
+    for pattern, label in _ROUTE_PATTERNS:
+        if pattern.match(path):
+            return label
+    return None
+
+
+class MetricsMiddleware:
+    """Mide la latencia de extremo a extremo hasta el último fragmento de la respuesta.
+
+    Es un middleware ASGI puro para que en `/run_sse` se mida el stream
+    completo y no solo el tiempo hasta los encabezados.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        route = route_label(scope.get("path", "")) if scope["type"] == "http" and METRICS_ENABLED else None
+        if route is None:
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                HTTP_SECONDS.observe(
+                    time.perf_counter() - start, route=route, method=scope["method"], status=status["code"]
+                )
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except Exception as e:
+            ERRORS.inc(stage="http", type=type(e).__name__)
+            HTTP_SECONDS.observe(time.perf_counter() - start, route=route, method=scope["method"], status=500)
+            raise
+
+
+def render_metrics() -> str:
+    return REGISTRY.render()
@@ -0,0 +1,224 @@
+"""Post-procesamiento de los resultados de recuperación antes de pasarlos a Gemini.
+
+Con `similarity_top_k=20` y `vector_distance_threshold=1` prácticamente todos
+los chunks recuperados llegan al contexto del modelo. Esta etapa:
+
+1. descarta resultados con score muy inferior al mejor (corte relativo/absoluto),
+2. selecciona un subconjunto diverso con MMR (Maximal Marginal Relevance),
+3. une chunks consecutivos de la misma política (`documento_origen` y `parte`;
+   en los resultados de Vertex `agent.py` recupera el chunk local a partir del
+   texto del contexto),
+4. empaqueta el resultado en un presupuesto de tokens, conservando el título
+   del documento y el texto literal que el prompt pide en "Referencias".
+"""
+
+import json
+import logging
+import os
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from .corpus import estimate_tokens
+from .local_retrieval import tokenize
+
+logger = logging.getLogger(__name__)
+
+RAG_POSTPROCESS = os.getenv("RAG_POSTPROCESS", "TRUE").upper() == "TRUE"
+# Presupuesto de tokens para todos los resultados de una llamada
+RAG_CONTEXT_TOKEN_BUDGET = int(os.getenv("RAG_CONTEXT_TOKEN_BUDGET", "3000"))
+# Máximo de resultados tras MMR
+RAG_MAX_RESULTS = int(os.getenv("RAG_MAX_RESULTS", "8"))
+# Balance relevancia/diversidad de MMR (1 = solo relevancia)
+RAG_MMR_LAMBDA = float(os.getenv("RAG_MMR_LAMBDA", "0.7"))
+# Se descartan resultados con relevancia menor a esta fracción de la mejor
+RAG_RELATIVE_SCORE_CUTOFF = float(os.getenv("RAG_RELATIVE_SCORE_CUTOFF", "0.5"))
+# Relevancia mínima absoluta (0 = sin corte)
+RAG_MIN_RELEVANCE = float(os.getenv("RAG_MIN_RELEVANCE", "0"))
+# Si quedan menos tokens que esto, no se agrega un fragmento truncado
+MIN_TRUNCATED_TOKENS = 80
+
+# Campos de metadata que se conservan en el resultado empaquetado
+METADATA_FIELDS = (
+    "id", "titulo", "codigo", "fecha", "direccion", "area", "documento_origen",
+    "numero_chunk", "source_display_name", "source_uri",
+)
+
+
+def config_signature() -> str:
+    """Resumen de la configuración (forma parte de la llave de caché)"""
+    if not RAG_POSTPROCESS:
+        return "raw"
+    return (
+        f"pp:{RAG_CONTEXT_TOKEN_BUDGET}:{RAG_MAX_RESULTS}:{RAG_MMR_LAMBDA}:"
+        f"{RAG_RELATIVE_SCORE_CUTOFF}:{RAG_MIN_RELEVANCE}"
+    )
+
+
+def _relevance(match: Dict[str, Any], score_is_distance: bool) -> float:
+    score = match.get("score")
+    if score is None:
+        return 0.0
+    # Vertex regresa distancia vectorial (menor es mejor); BM25 regresa relevancia
+    return 1.0 - float(score) if score_is_distance else float(score)
+
+
+def _match_tokens(match: Dict[str, Any]) -> int:
+    return estimate_tokens(match.get("text") or "") + estimate_tokens(
+        json.dumps(match.get("metadata") or {}, ensure_ascii=False, default=str)
+    )
+
+
+def document_title(metadata: Dict[str, Any]) -> Optional[str]:
+    """Título del documento para la sección de Referencias"""
+    return (
+        metadata.get("titulo")
+        or metadata.get("documento_origen")
+        or metadata.get("source_display_name")
+    )
+
+
+def score_cutoff(matches: List[Dict[str, Any]], relevances: List[float]) -> List[int]:
+    """Índices de los resultados que pasan el corte relativo y absoluto"""
+    if not matches:
+        return []
+    best = max(relevances)
+    threshold = max(RAG_MIN_RELEVANCE, best * RAG_RELATIVE_SCORE_CUTOFF if best > 0 else best)
+    return [idx for idx, relevance in enumerate(relevances) if relevance >= threshold]
+
+
+def mmr_select(
+    candidates: List[int],
+    relevances: List[float],
+    term_sets: List[Set[str]],
+    limit: int = RAG_MAX_RESULTS,
+    lambda_: float = RAG_MMR_LAMBDA,
+) -> List[int]:
+    """Selección MMR: relevancia menos la similitud máxima con lo ya elegido"""
+    if not candidates:
+        return []
+    top = max(relevances[idx] for idx in candidates)
+    bottom = min(relevances[idx] for idx in candidates)
+    spread = (top - bottom) or 1.0
+    normalized = {idx: (relevances[idx] - bottom) / spread for idx in candidates}
+
+    def similarity(a: int, b: int) -> float:
+        union = term_sets[a] | term_sets[b]
+        return len(term_sets[a] & term_sets[b]) / len(union) if union else 0.0
+
+    selected: List[int] = []
+    remaining = list(candidates)
+    while remaining and len(selected) < limit:
+        best = max(
+            remaining,
+            key=lambda idx: lambda_ * normalized[idx]
+            - (1 - lambda_) * max((similarity(idx, chosen) for chosen in selected), default=0.0),
+        )
+        selected.append(best)
+        remaining.remove(best)
+    return selected
+
+
+def _join_overlapping(first: str, second: str, max_overlap: int = 1200) -> str:
+    """Une dos chunks consecutivos eliminando el texto de traslape entre ellos"""
+    limit = min(len(first), len(second), max_overlap)
+    for size in range(limit, 20, -1):
+        if first.endswith(second[:size]):
+            return first + second[size:]
+    return first + "\n" + second
+
+
+def merge_adjacent(matches: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Une chunks consecutivos (numero_chunk n y n+1) de la misma política.
+
+    Un `documento_origen` puede contener varias políticas que reinician
+    `numero_chunk`; la posición es (documento_origen, parte, numero_chunk).
+    Los resultados sin `parte` (p. ej. contextos de Vertex que no se pudieron
+    identificar) nunca se unen.
+    """
+    def position(metadata: Dict[str, Any]) -> Optional[Tuple[Any, int, int]]:
+        document, part, number = (metadata.get(key) for key in ("documento_origen", "parte", "numero_chunk"))
+        if document and isinstance(part, int) and isinstance(number, int):
+            return document, part, number
+        return None
+
+    merged: List[Dict[str, Any]] = []
+    by_position: Dict[Tuple[Any, int, int], Dict[str, Any]] = {}
+    for match in sorted(matches, key=lambda m: position(m["metadata"]) or ("", -1, -1)):
+        metadata = match["metadata"]
+        key = position(metadata)
+        previous = by_position.get((key[0], key[1], key[2] - 1)) if key is not None else None
+        if previous is not None:
+            previous["text"] = _join_overlapping(previous["text"], match["text"])
+            previous["relevance"] = max(previous["relevance"], match["relevance"])
+            previous["metadata"]["chunks"] = previous["metadata"].get("chunks", [previous["metadata"].get("id")]) + [metadata.get("id")]
+            by_position[key] = previous
+            continue
+        item = {**match, "metadata": dict(metadata)}
+        merged.append(item)
+        if key is not None:
+            by_position[key] = item
+    return sorted(merged, key=lambda m: m["relevance"], reverse=True)
+
+
+def _truncate(text: str, max_tokens: int) -> str:
+    """Corta el texto al final de una oración dentro del presupuesto (prefijo literal)"""
+    limit = max_tokens * 4
+    if len(text) <= limit:
+        return text
+    cut = text[:limit]
+    boundary = max(cut.rfind(". "), cut.rfind(".\n"), cut.rfind("\n\n"))
+    if boundary > limit // 2:
+        cut = cut[:boundary + 1]
+    return cut.rstrip() + " …"
+
+
+def pack(matches: List[Dict[str, Any]], budget: int = RAG_CONTEXT_TOKEN_BUDGET) -> List[Dict[str, Any]]:
+    """Empaqueta los resultados (por relevancia) dentro del presupuesto de tokens"""
+    packed = []
+    used = 0
+    for match in matches:
+        metadata = {key: match["metadata"][key] for key in METADATA_FIELDS if match["metadata"].get(key) is not None}
+        if match["metadata"].get("chunks"):
+            metadata["chunks"] = match["metadata"]["chunks"]
+        title = document_title(match["metadata"])
+        if title:
+            metadata["titulo"] = title
+        item = {"text": match["text"], "metadata": metadata, "score": match.get("score")}
+        tokens = _match_tokens(item)
+        if used + tokens > budget:
+            remaining = budget - used - _match_tokens({"metadata": metadata})
+            if remaining < MIN_TRUNCATED_TOKENS:
+                break
+            item["text"] = _truncate(item["text"], remaining)
+            tokens = _match_tokens(item)
+        packed.append(item)
+        used += tokens
+    return packed
+
+
+def postprocess_matches(
+    matches: List[Dict[str, Any]],
+    score_is_distance: bool = False,
+    budget: int = RAG_CONTEXT_TOKEN_BUDGET,
+) -> List[Dict[str, Any]]:
+    """Corte por score, MMR, unión de chunks adyacentes y empaquetado por tokens"""
+    if not RAG_POSTPROCESS or not matches:
+        return matches
+
+    tokens_before = sum(_match_tokens(match) for match in matches)
+    relevances = [_relevance(match, score_is_distance) for match in matches]
+    term_sets = [set(tokenize(match.get("text") or "")) for match in matches]
+
+    candidates = score_cutoff(matches, relevances)
+    selected = mmr_select(candidates, relevances, term_sets)
+    merged = merge_adjacent([
+        {**matches[idx], "metadata": matches[idx].get("metadata") or {}, "relevance": relevances[idx]}
+        for idx in selected
+    ])
+    packed = pack(merged, budget=budget)
+
+    tokens_after = sum(_match_tokens(match) for match in packed)
+    logger.info(
+        f"Post-procesamiento RAG: {len(matches)} -> {len(packed)} resultados, "
+        f"{tokens_before} -> {tokens_after} tokens ({tokens_before - tokens_after} ahorrados)"
+    )
+    return packed
@@ -0,0 +1,215 @@
+"""Recuperación especulativa en paralelo con la primera llamada al modelo.
+
+El flujo normal es secuencial: Gemini decide llamar a `document_retrieval`, se
+ejecuta la búsqueda y solo entonces empieza la segunda llamada a Gemini. Cuando
+llega un mensaje que no parece conversación casual, `before_agent_callback`
+lanza la búsqueda con el texto del usuario en segundo plano y la deja en un
+espacio por sesión. La búsqueda usa el área de la sesión (`state["area"]`)
+igual que la herramienta. Si la consulta que después genera el modelo se parece
+lo suficiente (Jaccard de términos) y el área sigue siendo la misma,
+`CustomVertexAiRagRetrieval._arun` usa ese resultado en lugar de consultar otra
+vez, y el tiempo ya transcurrido queda oculto detrás de la primera llamada al
+modelo.
+
+Se reporta el tiempo ocultado y cuántas búsquedas anticipadas se desperdiciaron
+(sin llamada a la herramienta o con una consulta distinta). Ambas se suman
+también al consumo de la sesión (`usage.record_prefetch`): una desperdiciada
+es una llamada a la recuperación que no aparece en ninguna herramienta.
+"""
+
+import asyncio
+import logging
+import os
+import re
+import threading
+import time
+from typing import Any, Dict, Optional, Set
+
+from . import metrics, usage
+from .local_retrieval import strip_accents, tokenize
+
+logger = logging.getLogger(__name__)
+
+RAG_PREFETCH = os.getenv("RAG_PREFETCH", "TRUE").upper() == "TRUE"
+# Similitud mínima entre el mensaje del usuario y la consulta del modelo
+RAG_PREFETCH_SIMILARITY = float(os.getenv("RAG_PREFETCH_SIMILARITY", "0.5"))
+# Mensajes con menos términos no justifican una búsqueda anticipada
+PREFETCH_MIN_TERMS = 2
+# Espacios sin reclamar más antiguos que esto se descartan
+PREFETCH_SLOT_TTL_SECONDS = 120.0
+RETRIEVAL_TOOL_NAME = "document_retrieval"
+
+_SMALL_TALK_RE = re.compile(
+    r"^\s*(hola|buen(os|as)\s+(dias|tardes|noches)|gracias|muchas gracias|ok|okay|vale|adios|"
+    r"hasta luego|que tal|como estas|perfecto|entendido|listo)\b[\s!.,?]*$"
+)
+
+
+def is_small_talk(text: str) -> bool:
+    """Saludos, agradecimientos y mensajes sin contenido suficiente para buscar"""
+    normalized = strip_accents(text.lower()).strip()
+    return bool(_SMALL_TALK_RE.match(normalized)) or len(set(tokenize(text))) < PREFETCH_MIN_TERMS
+
+
+def similarity(a: Set[str], b: Set[str]) -> float:
+    union = a | b
+    return len(a & b) / len(union) if union else 0.0
+
+
+class _Slot:
+    __slots__ = ("session_id", "query", "area", "terms", "task", "started", "finished")
+
+    def __init__(self, session_id: str, query: str, area: Optional[str], task: "asyncio.Task"):
+        self.session_id = session_id
+        self.query = query
+        self.area = area
+        self.terms = set(tokenize(query))
+        self.task = task
+        self.started = time.perf_counter()
+        self.finished: Optional[float] = None
+        task.add_done_callback(self._done)
+
+    def _done(self, _task) -> None:
+        self.finished = time.perf_counter()
+
+
+class Prefetcher:
+    """Búsquedas anticipadas por sesión y sus estadísticas"""
+
+    def __init__(self, min_similarity: float = RAG_PREFETCH_SIMILARITY):
+        self.min_similarity = min_similarity
+        self._slots: Dict[str, _Slot] = {}
+        self._lock = threading.Lock()
+        self.started = 0
+        self.used = 0
+        self.wasted = 0
+        self.hidden_seconds = 0.0
+
+    def start(self, session_id: str, query: str, search, area: Optional[str] = None) -> None:
+        """Lanza `search(query)` (corrutina, ya filtrada por `area`) en segundo plano para la sesión"""
+        task = asyncio.get_running_loop().create_task(search(query))
+        now = time.perf_counter()
+        with self._lock:
+            for key in [key for key, slot in self._slots.items() if now - slot.started > PREFETCH_SLOT_TTL_SECONDS]:
+                self._discard(self._slots.pop(key))
+            previous = self._slots.pop(session_id, None)
+            if previous is not None:
+                self._discard(previous)
+            self._slots[session_id] = _Slot(session_id, query, area, task)
+            self.started += 1
+        metrics.PREFETCH.inc(outcome="started")
+
+    def _discard(self, slot: _Slot) -> None:
+        """Cuenta un espacio no usado como desperdicio (la búsqueda se deja terminar)"""
+        self.wasted += 1
+        metrics.PREFETCH.inc(outcome="wasted")
+        usage.record_prefetch(slot.session_id, used=False)
+        # Evita el aviso "Task exception was never retrieved"
+        slot.task.add_done_callback(lambda task: task.cancelled() or task.exception())
+
+    async def claim(self, session_id: str, query: str, area: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """Resultado anticipado si la consulta del modelo y el área coinciden; None si no hay"""
+        with self._lock:
+            slot = self._slots.get(session_id)
+            if slot is None or slot.area != area:
+                return None
+            score = similarity(slot.terms, set(tokenize(query)))
+            if score < self.min_similarity:
+                return None
+            del self._slots[session_id]
+
+        wait_start = time.perf_counter()
+        try:
+            result = await slot.task
+        except Exception as e:
+            logger.warning(f"La búsqueda anticipada falló, se consulta de nuevo: {str(e)}")
+            with self._lock:
+                self.wasted += 1
+            metrics.PREFETCH.inc(outcome="failed")
+            usage.record_prefetch(session_id, used=False)
+            return None
+        waited = time.perf_counter() - wait_start
+        hidden = max(0.0, (slot.finished or time.perf_counter()) - slot.started - waited)
+        with self._lock:
+            self.used += 1
+            self.hidden_seconds += hidden
+        metrics.PREFETCH.inc(outcome="used")
+        usage.record_prefetch(session_id, used=True)
+        metrics.PREFETCH_HIDDEN_SECONDS.observe(hidden)
+        logger.info(
+            f"Búsqueda anticipada usada para {query!r} (mensaje: {slot.query!r}, "
+            f"similitud {score:.2f}, {hidden * 1000:.0f} ms ocultos)"
+        )
+        return result
+
+    def release(self, session_id: str) -> None:
+        """Fin de la invocación: el espacio que nadie reclamó se desperdició"""
+        with self._lock:
+            slot = self._slots.pop(session_id, None)
+            if slot is not None:
+                self._discard(slot)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "started": self.started,
+            "used": self.used,
+            "wasted": self.wasted,
+            "in_flight": len(self._slots),
+            "hit_rate": round(self.used / self.started, 4) if self.started else 0.0,
+            "hidden_seconds": round(self.hidden_seconds, 3),
+            "avg_hidden_ms": round(self.hidden_seconds / self.used * 1000, 1) if self.used else 0.0,
+        }
+
+
+_default_prefetcher: Optional[Prefetcher] = None
+
+
+def get_prefetcher() -> Optional[Prefetcher]:
+    """Prefetcher compartido por proceso, o `None` si está deshabilitado"""
+    global _default_prefetcher
+    if not RAG_PREFETCH:
+        return None
+    if _default_prefetcher is None:
+        _default_prefetcher = Prefetcher()
+    return _default_prefetcher
+
+
+# ---------------------------------------------------------------------------
+# Callbacks del agente
+# ---------------------------------------------------------------------------
+
+def retrieval_tool(agent):
+    return next(
+        (tool for tool in getattr(agent, "tools", []) if getattr(tool, "name", None) == RETRIEVAL_TOOL_NAME),
+        None,
+    )
+
+
+async def before_agent_callback(callback_context):
+    """Lanza la búsqueda con el mensaje del usuario si no es conversación casual"""
+    prefetcher = get_prefetcher()
+    session_id = metrics.session_id_of(callback_context)
+    content = callback_context.user_content
+    if prefetcher is None or session_id is None or content is None or not content.parts:
+        return None
+    text = "".join(part.text for part in content.parts if part.text)
+    if not text or is_small_talk(text):
+        return None
+    tool = retrieval_tool(callback_context._invocation_context.agent)
+    if tool is not None:
+        area = callback_context.state.get("area")
+        prefetcher.start(
+            session_id,
+            text,
+            lambda query: tool._arun(query, session_id=session_id, area=area, use_prefetch=False),
+            area,
+        )
+    return None
+
+
+def after_agent_callback(callback_context):
+    prefetcher = get_prefetcher()
+    session_id = metrics.session_id_of(callback_context)
+    if prefetcher is not None and session_id is not None:
+        prefetcher.release(session_id)
+    return None
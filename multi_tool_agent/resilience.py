@@ -0,0 +1,266 @@
+"""Resiliencia asíncrona para las llamadas a Vertex RAG.
+
+`google.api_core.retry.Retry` es un decorador síncrono: aplicado a una
+corrutina solo envuelve la creación del objeto, no el `await`, así que los
+errores de Vertex nunca se reintentaban. Este módulo implementa la política
+completa sobre asyncio:
+
+- presupuesto de tiempo por solicitud (`Deadline`): todos los intentos,
+  esperas y solicitudes duplicadas comparten el mismo límite,
+- reintentos con backoff exponencial y jitter completo, solo para errores
+  transitorios y solo si queda presupuesto para otro intento,
+- circuit breaker: tras N fallas seguidas las llamadas fallan de inmediato
+  (y el agente usa el índice local) hasta que pasa el tiempo de recuperación
+  y una llamada de prueba tiene éxito,
+- solicitudes duplicadas opcionales (hedging): si la primera no responde
+  después del p95 de las latencias recientes se lanza una segunda y se usa la
+  que termine primero.
+
+Las llamadas bloqueantes al SDK corren en un pool de hilos propio y acotado
+(`run_blocking`), separado del pool por defecto que usa el índice local de
+respaldo. Cancelar la espera no detiene un hilo: el RPC debe recibir también
+el tiempo restante del presupuesto como timeout para que las solicitudes que
+pierden el hedging o agotan el presupuesto terminen y liberen su hilo.
+
+`benchmarks/bench_resilience.py` la ejercita contra un backend falso con
+latencia y errores inyectados.
+"""
+
+import asyncio
+import functools
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Optional, Tuple, Type
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# Tiempo máximo por búsqueda, incluidos reintentos y solicitudes duplicadas
+RAG_DEADLINE_SECONDS = float(os.getenv("RAG_DEADLINE_SECONDS", "10"))
+RAG_RETRY_ATTEMPTS = int(os.getenv("RAG_RETRY_ATTEMPTS", "3"))
+RAG_RETRY_INITIAL_SECONDS = float(os.getenv("RAG_RETRY_INITIAL_SECONDS", "0.2"))
+RAG_RETRY_MAX_SECONDS = float(os.getenv("RAG_RETRY_MAX_SECONDS", "2"))
+# Fallas seguidas que abren el circuito y segundos antes de la llamada de prueba
+RAG_BREAKER_FAILURES = int(os.getenv("RAG_BREAKER_FAILURES", "5"))
+RAG_BREAKER_RESET_SECONDS = float(os.getenv("RAG_BREAKER_RESET_SECONDS", "30"))
+RAG_HEDGE = os.getenv("RAG_HEDGE", "FALSE").upper() == "TRUE"
+# Espera antes de duplicar mientras no hay suficientes latencias para el p95
+RAG_HEDGE_DELAY_SECONDS = float(os.getenv("RAG_HEDGE_DELAY_SECONDS", "1.0"))
+# Hilos para las llamadas bloqueantes a Vertex (las que excedan esperan turno)
+RAG_CALL_THREADS = int(os.getenv("RAG_CALL_THREADS", "16"))
+HEDGE_MIN_SAMPLES = 20
+LATENCY_WINDOW = 200
+
+Operation = Callable[[], Awaitable[Any]]
+
+
+class CircuitOpenError(Exception):
+    """El circuito está abierto: la llamada no se intentó"""
+
+
+class DeadlineExceededError(Exception):
+    """Se agotó el presupuesto de tiempo de la solicitud"""
+
+
+class Deadline:
+    """Presupuesto de tiempo de una solicitud"""
+
+    def __init__(self, seconds: float):
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        return self.expires_at - time.monotonic()
+
+
+class CircuitBreaker:
+    """Circuito cerrado → abierto tras `failure_threshold` fallas → semiabierto tras `reset_seconds`"""
+
+    def __init__(self, failure_threshold: int = RAG_BREAKER_FAILURES, reset_seconds: float = RAG_BREAKER_RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """Si se puede intentar la llamada (en semiabierto, solo una de prueba a la vez)"""
+        with self._lock:
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_seconds:
+                self._transition("half_open")
+            if self.state == "closed":
+                return True
+            if self.state == "half_open" and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self._probe_in_flight = False
+            if self.state != "closed":
+                self._transition("closed")
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            self._probe_in_flight = False
+            if self.state == "half_open" or (self.state == "closed" and self.failures >= self.failure_threshold):
+                self.opened_at = time.monotonic()
+                self._transition("open")
+
+    def release_probe(self) -> None:
+        """La llamada terminó sin indicar el estado del servicio (cancelada o error del cliente)"""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def _transition(self, state: str) -> None:
+        logger.warning(f"Circuit breaker de RAG: {self.state} -> {state}")
+        self.state = state
+        metrics.RETRIEVAL_BREAKER.inc(state=state)
+
+
+class LatencyWindow:
+    """Latencias recientes de las llamadas exitosas para estimar el p95"""
+
+    def __init__(self, size: int = LATENCY_WINDOW):
+        self._samples = deque(maxlen=size)
+
+    def observe(self, seconds: float) -> None:
+        self._samples.append(seconds)
+
+    def percentile(self, fraction: float) -> Optional[float]:
+        if len(self._samples) < HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def backoff_delay(attempt: int, initial: float, maximum: float) -> float:
+    """Backoff exponencial con jitter completo para el reintento número `attempt`"""
+    return random.uniform(0, min(maximum, initial * 2 ** (attempt - 1)))
+
+
+async def hedged(operation: Operation, delay: float) -> Any:
+    """Ejecuta `operation` y, si no termina en `delay` segundos, una copia; gana la primera exitosa"""
+    primary = asyncio.ensure_future(operation())
+    pending = {primary}
+    error: Optional[BaseException] = None
+    try:
+        done, pending = await asyncio.wait(pending, timeout=delay)
+        if done:
+            return primary.result()
+
+        metrics.RETRIEVAL_HEDGES.inc(outcome="sent")
+        backup = asyncio.ensure_future(operation())
+        pending = {primary, backup}
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task is backup:
+                        metrics.RETRIEVAL_HEDGES.inc(outcome="won")
+                    return task.result()
+                error = error or task.exception()
+        raise error
+    finally:
+        # Se deja de esperar a la solicitud que pierde (o a todas, si se cancela
+        # la búsqueda); su hilo termina con el timeout del RPC
+        for task in pending:
+            task.cancel()
+
+
+class ResiliencePolicy:
+    """Presupuesto, reintentos, circuit breaker y hedging alrededor de una llamada asíncrona"""
+
+    def __init__(
+        self,
+        retry_on: Tuple[Type[BaseException], ...] = (),
+        deadline_seconds: float = RAG_DEADLINE_SECONDS,
+        max_attempts: int = RAG_RETRY_ATTEMPTS,
+        initial_backoff: float = RAG_RETRY_INITIAL_SECONDS,
+        max_backoff: float = RAG_RETRY_MAX_SECONDS,
+        breaker: Optional[CircuitBreaker] = None,
+        hedge: bool = RAG_HEDGE,
+        hedge_delay: float = RAG_HEDGE_DELAY_SECONDS,
+        max_threads: int = RAG_CALL_THREADS,
+    ):
+        self.retry_on = retry_on
+        self.deadline_seconds = deadline_seconds
+        self.max_attempts = max(1, max_attempts)
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.breaker = breaker or CircuitBreaker()
+        self.hedge = hedge
+        self.default_hedge_delay = hedge_delay
+        self.latencies = LatencyWindow()
+        self.max_threads = max(1, max_threads)
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._executor_lock = threading.Lock()
+
+    def deadline(self) -> Deadline:
+        return Deadline(self.deadline_seconds)
+
+    def run_blocking(self, function: Callable[..., Any], *args: Any) -> Awaitable[Any]:
+        """Ejecuta `function(*args)` en el pool de hilos de la política"""
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.max_threads, thread_name_prefix="rag-call")
+        return asyncio.get_running_loop().run_in_executor(self._executor, functools.partial(function, *args))
+
+    def hedge_delay(self) -> float:
+        p95 = self.latencies.percentile(0.95)
+        return p95 if p95 is not None else self.default_hedge_delay
+
+    async def _attempt(self, operation: Operation) -> Any:
+        start = time.monotonic()
+        result = await (hedged(operation, self.hedge_delay()) if self.hedge else operation())
+        self.latencies.observe(time.monotonic() - start)
+        return result
+
+    async def call(self, operation: Operation, deadline: Optional[Deadline] = None) -> Any:
+        """Ejecuta `operation` (fábrica de corrutinas) dentro del presupuesto `deadline`"""
+        deadline = deadline or self.deadline()
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                raise CircuitOpenError("Circuito de RAG abierto por fallas recientes")
+            remaining = deadline.remaining()
+            if remaining <= 0:
+                raise DeadlineExceededError("Presupuesto de tiempo de la búsqueda agotado")
+            attempt += 1
+            try:
+                result = await asyncio.wait_for(self._attempt(operation), timeout=remaining)
+            except asyncio.TimeoutError:
+                self.breaker.record_failure()
+                raise DeadlineExceededError(
+                    f"Sin respuesta en el presupuesto de {self.deadline_seconds:.1f}s (intento {attempt})"
+                ) from None
+            except self.retry_on as e:
+                self.breaker.record_failure()
+                delay = backoff_delay(attempt, self.initial_backoff, self.max_backoff)
+                if attempt >= self.max_attempts or delay >= deadline.remaining():
+                    raise
+                metrics.RETRIEVAL_RETRIES.inc(reason=type(e).__name__)
+                logger.warning(f"Reintentando la búsqueda en {delay:.2f}s (intento {attempt}): {str(e)}")
+                await asyncio.sleep(delay)
+                continue
+            except asyncio.CancelledError:
+                self.breaker.release_probe()
+                raise
+            except Exception:
+                # Errores del cliente (p. ej. argumentos inválidos) no indican una caída del
+                # servicio, pero tampoco que se recuperó: no cierran un circuito semiabierto
+                self.breaker.release_probe()
+                raise
+            self.breaker.record_success()
+            return result
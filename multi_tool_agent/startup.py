@@ -0,0 +1,197 @@
+"""Warmup del agente y reporte de tiempos de arranque.
+
+El paquete y `agent.py` ya no construyen el agente al importarse: el ADK lo
+pide en la primera solicitud. `warmup()` adelanta ese trabajo (importar el ADK
+y Vertex AI, construir `root_agent`, precargar el índice local, el de metadata
+y el almacén de chunks) y main.py lo ejecuta en un hilo al arrancar para que el
+puerto abra de inmediato; /healthz no reporta listo hasta que termina. Después,
+ya con el worker listo, el mismo hilo precalienta la caché de recuperación (no
+la de respuestas) con las consultas más frecuentes del historial (ver
+cache_warmup.py).
+
+El reporte mide cada etapa en un proceso nuevo (arranque en frío) y lista los
+módulos que más tardan en importarse (`python -X importtime`):
+
+    python -m multi_tool_agent.startup --top 15
+"""
+
+import argparse
+import json
+import logging
+import os
+import subprocess
+import sys
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from .corpus import REPO_ROOT
+
+logger = logging.getLogger(__name__)
+
+WARMUP_ON_STARTUP = os.getenv("WARMUP_ON_STARTUP", "TRUE").upper() == "TRUE"
+
+# Estado del warmup en este proceso: pending, running, done o failed
+warmup_state = {"state": "pending", "seconds": None}
+
+
+def warmup() -> Dict[str, float]:
+    """Construye el agente y precarga lo necesario para la primera consulta"""
+    timings: Dict[str, float] = {}
+
+    start = time.perf_counter()
+    from . import agent
+    timings["import_agent"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    agent.get_root_agent()
+    timings["build_agent"] = time.perf_counter() - start
+
+    if agent.RAG_BACKEND == "local":
+        from .local_retrieval import get_local_backend
+
+        start = time.perf_counter()
+        get_local_backend().index
+        timings["local_index"] = time.perf_counter() - start
+
+    if agent.RAG_METADATA_FILTERS:
+        from .metadata_index import get_metadata_index
+
+        start = time.perf_counter()
+        get_metadata_index()
+        timings["metadata_index"] = time.perf_counter() - start
+
+        # Las búsquedas exactas y la identificación de contextos de Vertex leen el almacén
+        # binario; las solicitudes nunca lo construyen, así que se construye aquí
+        from .chunk_store import get_chunk_store
+
+        start = time.perf_counter()
+        get_chunk_store()
+        timings["chunk_store"] = time.perf_counter() - start
+
+    cache = agent.get_retrieval_cache()
+    if cache is not None:
+        start = time.perf_counter()
+        cache.corpus_version
+        timings["corpus_version"] = time.perf_counter() - start
+
+    logger.info(
+        "Warmup completo: "
+        + ", ".join(f"{stage}={seconds * 1000:.0f}ms" for stage, seconds in timings.items())
+    )
+    return timings
+
+
+def warm_retrieval_cache() -> None:
+    """Consultas frecuentes del historial en la caché de recuperación (no bloquea /healthz)"""
+    from .cache_warmup import WARMUP_TOP_QUERIES, warm_from_history
+
+    if WARMUP_TOP_QUERIES <= 0:
+        return
+    try:
+        warmup_state["cache_warmup"] = warm_from_history(WARMUP_TOP_QUERIES)
+    except Exception as e:
+        logger.error(f"Error al precalentar la caché de recuperación: {str(e)}")
+        warmup_state["cache_warmup"] = {"error": str(e)}
+
+
+def start_background_warmup() -> threading.Thread:
+    """Ejecuta `warmup()` en un hilo para no retrasar la apertura del puerto"""
+
+    def run():
+        warmup_state["state"] = "running"
+        start = time.perf_counter()
+        try:
+            warmup()
+            warmup_state["state"] = "done"
+        except Exception as e:
+            # La primera solicitud volverá a intentarlo y mostrará el error
+            logger.error(f"Error en el warmup del agente: {str(e)}")
+            warmup_state["state"] = "failed"
+        warmup_state["seconds"] = round(time.perf_counter() - start, 3)
+        if warmup_state["state"] == "done":
+            warm_retrieval_cache()
+
+    thread = threading.Thread(target=run, name="agent-warmup", daemon=True)
+    thread.start()
+    return thread
+
+
+# ---------------------------------------------------------------------------
+# Reporte de arranque
+# ---------------------------------------------------------------------------
+
+# Cada etapa se mide en un intérprete nuevo; el código imprime los segundos
+STAGES = [
+    ("python", "pass"),
+    ("import fastapi + ADK", "import google.adk.cli.fast_api"),
+    ("import main (app lista)", "import main"),
+    ("import multi_tool_agent.agent", "import multi_tool_agent.agent"),
+    ("construir root_agent", "import multi_tool_agent.agent as a; a.get_root_agent()"),
+]
+
+
+def _time_stage(code: str) -> Optional[float]:
+    """Segundos de la etapa en un intérprete nuevo, o None si falla"""
+    script = (
+        "import time; _start = time.perf_counter()\n"
+        f"{code}\n"
+        "print(time.perf_counter() - _start)"
+    )
+    env = {**os.environ, "WARMUP_ON_STARTUP": "FALSE"}
+    result = subprocess.run(
+        [sys.executable, "-c", script], cwd=REPO_ROOT, env=env, capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        error = (result.stderr.strip().splitlines() or ["error desconocido"])[-1]
+        print(f"  ({code}: {error})")
+        return None
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def import_breakdown(module: str = "main", top: int = 15) -> List[Tuple[str, float]]:
+    """Paquetes de primer nivel con mayor tiempo acumulado de importación"""
+    env = {**os.environ, "WARMUP_ON_STARTUP": "FALSE"}
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=REPO_ROOT, env=env, capture_output=True, text=True,
+    ).stderr
+    packages: Dict[str, float] = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        # Solo los módulos importados directamente (sin sangría) y agrupados por paquete raíz
+        if name.startswith("  "):
+            continue
+        root = name.strip().split(".")[0]
+        packages[root] = packages.get(root, 0.0) + int(cumulative) / 1e6
+    return sorted(packages.items(), key=lambda item: item[1], reverse=True)[:top]
+
+
+def startup_report(top: int = 15) -> Dict[str, object]:
+    stages = [(name, _time_stage(code)) for name, code in STAGES]
+    breakdown = import_breakdown(top=top)
+
+    print("\nArranque en frío por etapa (proceso nuevo en cada una):")
+    for name, seconds in stages:
+        print(f"- {name:<32} " + (f"{seconds * 1000:>8.0f} ms" if seconds is not None else "   error"))
+    print(f"\nImportaciones más costosas de `import main` (top {top}):")
+    for package, seconds in breakdown:
+        print(f"- {package:<32} {seconds * 1000:>8.0f} ms")
+    return {"stages": dict(stages), "imports": dict(breakdown)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reporte de tiempos de arranque")
+    parser.add_argument("--top", type=int, default=15, help="Paquetes a mostrar en el desglose")
+    parser.add_argument("--json", action="store_true", help="Imprimir también el resultado en JSON")
+    args = parser.parse_args()
+
+    report = startup_report(top=args.top)
+    if args.json:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
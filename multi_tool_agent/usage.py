@@ -0,0 +1,274 @@
+"""Contabilidad de tokens y de recuperación por sesión y por día.
+
+Los callbacks del agente acumulan, por invocación, los tokens de prompt y de
+respuesta que reporta Gemini (`usage_metadata`), los tokens estimados del
+resultado de la herramienta que se envía al modelo y el número de llamadas a
+la recuperación, incluidas las búsquedas anticipadas de prefetch.py (usadas
+y desperdiciadas). Al terminar la invocación los contadores se suman en memoria
+por sesión y por (día, versión del prompt, tipo de pregunta, modelo); un hilo
+los escribe en lote en las tablas `usage_sessions` y `usage_daily` de
+sessions.db (junto a `sessions_agent`; el esquema está en usage_schema.py,
+que también usa `db.init_db`), así que cada respuesta no agrega escrituras a
+SQLite.
+
+El tipo de pregunta es el área de la sesión o la detectada por el índice de
+metadata (solo con `RAG_METADATA_FILTERS`), `charla` para saludos y
+agradecimientos, o `general`. `usage_report.py` muestra los mayores
+consumidores y el promedio de tokens por respuesta.
+"""
+
+import atexit
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+from . import metrics
+from .corpus import REPO_ROOT, estimate_tokens
+from .usage_schema import COUNTERS, create_usage_tables
+
+logger = logging.getLogger(__name__)
+
+USAGE_ENABLED = os.getenv("USAGE_ENABLED", "TRUE").upper() == "TRUE"
+# Los contadores se escriben cada N segundos o cuando hay N sesiones pendientes
+USAGE_FLUSH_SECONDS = float(os.getenv("USAGE_FLUSH_SECONDS", "10"))
+USAGE_FLUSH_SIZE = 200
+# Misma base que db.DB_PATH
+USAGE_DB_PATH = os.getenv("USAGE_DB_PATH", os.path.join(REPO_ROOT, "sessions.db"))
+# Invocaciones sin after_agent_callback (error a media ejecución) se descartan después de N segundos
+INVOCATION_TTL_SECONDS = 900
+
+
+def add_usage(session_rows, daily_rows, db_path: str = USAGE_DB_PATH) -> None:
+    """Suma en una sola transacción los contadores de consumo acumulados en memoria.
+
+    `session_rows`: (session_id, contadores, first_at, last_at); `daily_rows`:
+    (day, prompt_version, question_type, model, contadores), con los contadores
+    en el orden de COUNTERS.
+    """
+    columns = ", ".join(COUNTERS)
+    placeholders = ", ".join("?" for _ in COUNTERS)
+    increments = ", ".join(f"{name} = {name} + excluded.{name}" for name in COUNTERS)
+    conn = sqlite3.connect(db_path, timeout=5)
+    try:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        create_usage_tables(conn)
+        conn.executemany(f"""
+            INSERT INTO usage_sessions (session_id, {columns}, first_at, last_at)
+            VALUES (?, {placeholders}, ?, ?)
+            ON CONFLICT(session_id) DO UPDATE SET {increments}, last_at = excluded.last_at
+        """, [(session_id, *counters, first_at, last_at) for session_id, counters, first_at, last_at in session_rows])
+        conn.executemany(f"""
+            INSERT INTO usage_daily (day, prompt_version, question_type, model, {columns})
+            VALUES (?, ?, ?, ?, {placeholders})
+            ON CONFLICT(day, prompt_version, question_type, model) DO UPDATE SET {increments}
+        """, [(*key, *counters) for *key, counters in daily_rows])
+        conn.commit()
+    finally:
+        conn.close()
+
+
+class _InvocationUsage:
+    __slots__ = ("session_id", "question_type", "model", "counters", "started")
+
+    def __init__(self, session_id: str, question_type: str):
+        self.session_id = session_id
+        self.question_type = question_type
+        self.model = ""
+        self.counters: Dict[str, int] = dict.fromkeys(COUNTERS, 0)
+        self.started = time.monotonic()
+
+
+class UsageBuffer:
+    """Acumula contadores por sesión y por día y los escribe en lote (write-behind)"""
+
+    def __init__(
+        self,
+        flush_seconds: float = USAGE_FLUSH_SECONDS,
+        flush_size: int = USAGE_FLUSH_SIZE,
+        db_path: str = USAGE_DB_PATH,
+    ):
+        self.flush_seconds = flush_seconds
+        self.flush_size = flush_size
+        self.db_path = db_path
+        self._sessions: Dict[str, list] = {}
+        self._daily: Dict[Tuple[str, str, str, str], Dict[str, int]] = defaultdict(lambda: dict.fromkeys(COUNTERS, 0))
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def add(self, usage: _InvocationUsage, prompt_version: str) -> None:
+        now = datetime.now()
+        with self._lock:
+            entry = self._sessions.get(usage.session_id)
+            if entry is None:
+                entry = self._sessions[usage.session_id] = [dict.fromkeys(COUNTERS, 0), now.isoformat(), None]
+            entry[2] = now.isoformat()
+            daily = self._daily[(now.date().isoformat(), prompt_version, usage.question_type, usage.model)]
+            for name, value in usage.counters.items():
+                entry[0][name] += value
+                daily[name] += value
+            pending = len(self._sessions)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="usage-flusher", daemon=True)
+                self._thread.start()
+        if pending >= self.flush_size:
+            self._wakeup.set()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_seconds)
+            self._wakeup.clear()
+            self.flush()
+
+    def flush(self) -> int:
+        """Escribe los contadores pendientes en una transacción; regresa las sesiones escritas"""
+        with self._lock:
+            sessions, self._sessions = self._sessions, {}
+            daily, self._daily = self._daily, defaultdict(lambda: dict.fromkeys(COUNTERS, 0))
+        if not sessions and not daily:
+            return 0
+        try:
+            add_usage(
+                [(session_id, [counters[name] for name in COUNTERS], first_at, last_at)
+                 for session_id, (counters, first_at, last_at) in sessions.items()],
+                [(*key, [counters[name] for name in COUNTERS]) for key, counters in daily.items()],
+                self.db_path,
+            )
+            return len(sessions)
+        except Exception as e:
+            logger.error(f"Error al guardar el consumo de tokens: {str(e)}")
+            metrics.ERRORS.inc(stage="usage", type=type(e).__name__)
+            # Reintentar en el siguiente ciclo sumando a lo acumulado mientras tanto
+            with self._lock:
+                for session_id, (counters, first_at, last_at) in sessions.items():
+                    entry = self._sessions.setdefault(session_id, [dict.fromkeys(COUNTERS, 0), first_at, last_at])
+                    for name, value in counters.items():
+                        entry[0][name] += value
+                for key, counters in daily.items():
+                    for name, value in counters.items():
+                        self._daily[key][name] += value
+            return 0
+
+
+_buffer = UsageBuffer()
+_invocations: Dict[str, _InvocationUsage] = {}
+_invocations_lock = threading.Lock()
+
+
+def flush_usage() -> int:
+    """Forzar la escritura del consumo pendiente"""
+    return _buffer.flush()
+
+
+atexit.register(flush_usage)
+
+
+def question_type(question: str, area: Optional[str] = None, tool=None) -> str:
+    """Área de la sesión o nombrada en la pregunta, `charla` o `general`"""
+    from .prefetch import is_small_talk
+
+    if is_small_talk(question):
+        return "charla"
+    if area:
+        return area
+    # El índice de la herramienta de recuperación: no se carga si los filtros están apagados o falló
+    index = tool._metadata_index() if tool is not None else None
+    return (index.detect_area(question) if index is not None else None) or "general"
+
+
+def _usage(context) -> Optional[_InvocationUsage]:
+    with _invocations_lock:
+        return _invocations.get(getattr(context, "invocation_id", None))
+
+
+# ---------------------------------------------------------------------------
+# Callbacks del agente
+# ---------------------------------------------------------------------------
+
+def before_agent_callback(callback_context):
+    session_id = metrics.session_id_of(callback_context)
+    if not USAGE_ENABLED or session_id is None:
+        return None
+    content = callback_context.user_content
+    question = "".join(part.text for part in content.parts if part.text) if content and content.parts else ""
+    from .prefetch import retrieval_tool
+
+    tool = retrieval_tool(callback_context._invocation_context.agent)
+    usage = _InvocationUsage(session_id, question_type(question, callback_context.state.get("area"), tool))
+    with _invocations_lock:
+        # Invocaciones abandonadas: no deben acumularse en memoria
+        expired = [key for key, value in _invocations.items() if usage.started - value.started > INVOCATION_TTL_SECONDS]
+        for key in expired:
+            del _invocations[key]
+        _invocations[callback_context.invocation_id] = usage
+    return None
+
+
+def record_prefetch(session_id: str, used: bool) -> None:
+    """Búsqueda anticipada reclamada o desperdiciada de la sesión.
+
+    Se suma a la invocación en curso de la sesión; si ya terminó (espacio
+    reemplazado o vencido), va directo al búfer con el tipo de pregunta
+    `prefetch`. Una desperdiciada también cuenta como llamada a la recuperación.
+    """
+    if not USAGE_ENABLED:
+        return
+    with _invocations_lock:
+        usage = next((value for value in _invocations.values() if value.session_id == session_id), None)
+    finished = usage is None
+    if finished:
+        usage = _InvocationUsage(session_id, "prefetch")
+    if used:
+        usage.counters["prefetch_used"] += 1
+    else:
+        usage.counters["prefetch_wasted"] += 1
+        usage.counters["retrieval_calls"] += 1
+    if finished:
+        from .answer_cache import prompt_version
+
+        _buffer.add(usage, prompt_version())
+
+
+def after_model_callback(callback_context, llm_response):
+    if not USAGE_ENABLED or getattr(llm_response, "partial", False):
+        return None
+    usage = _usage(callback_context)
+    if usage is None:
+        return None
+    usage.model = usage.model or metrics.model_name(callback_context)
+    usage.counters["model_calls"] += 1
+    metadata = getattr(llm_response, "usage_metadata", None)
+    if metadata is not None:
+        usage.counters["prompt_tokens"] += metadata.prompt_token_count or 0
+        usage.counters["completion_tokens"] += metadata.candidates_token_count or 0
+    return None
+
+
+def record_tool_result(tool_context, result) -> None:
+    """Tokens estimados del resultado de la recuperación que se envía al modelo"""
+    usage = _usage(tool_context) if USAGE_ENABLED else None
+    if usage is None:
+        return
+    usage.counters["retrieval_calls"] += 1
+    usage.counters["tool_payload_tokens"] += estimate_tokens(json.dumps(result, ensure_ascii=False, default=str))
+
+
+def after_agent_callback(callback_context):
+    if not USAGE_ENABLED:
+        return None
+    with _invocations_lock:
+        usage = _invocations.pop(callback_context.invocation_id, None)
+    if usage is None:
+        return None
+    usage.counters["answers"] = 1
+    from .answer_cache import prompt_version
+
+    _buffer.add(usage, prompt_version())
+    return None
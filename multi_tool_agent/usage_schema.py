@@ -0,0 +1,43 @@
+"""Esquema de las tablas de consumo (`usage_sessions` y `usage_daily`).
+
+Sin dependencias del resto del paquete: lo importan usage.py, que escribe las
+tablas, y db.py y usage_report.py, que las crean y las leen desde procesos que
+no cargan el agente (Streamlit, retention.py).
+"""
+
+# Columnas de contadores de usage_sessions y usage_daily. `retrieval_calls`
+# incluye las búsquedas anticipadas desperdiciadas (`prefetch_wasted`); las
+# usadas ya cuentan como la llamada a la herramienta que las reclamó
+COUNTERS = (
+    "answers", "model_calls", "prompt_tokens", "completion_tokens", "tool_payload_tokens", "retrieval_calls",
+    "prefetch_used", "prefetch_wasted",
+)
+_COUNTERS_DDL = ",\n            ".join(f"{name} INTEGER NOT NULL DEFAULT 0" for name in COUNTERS)
+
+
+def create_usage_tables(conn) -> None:
+    """Crea las tablas de consumo si no existen (el llamador hace commit)"""
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS usage_sessions (
+            session_id TEXT PRIMARY KEY,
+            {_COUNTERS_DDL},
+            first_at TIMESTAMP NOT NULL,
+            last_at TIMESTAMP NOT NULL
+        )
+    """)
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS usage_daily (
+            day TEXT NOT NULL,
+            prompt_version TEXT NOT NULL,
+            question_type TEXT NOT NULL,
+            model TEXT NOT NULL,
+            {_COUNTERS_DDL},
+            PRIMARY KEY (day, prompt_version, question_type, model)
+        )
+    """)
+    # Bases creadas antes de agregar contadores
+    for table in ("usage_sessions", "usage_daily"):
+        existing = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+        for name in COUNTERS:
+            if name not in existing:
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN {name} INTEGER NOT NULL DEFAULT 0")
@@ -1,7 +1,31 @@
 from google.auth import default
 import vertexai
 from vertexai.preview import rag
+from google.api_core import exceptions as google_exceptions
+import argparse
+import hashlib
+import json
 import os
+import random
+import statistics
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from multi_tool_agent.chunk_store import build_chunk_store
+from multi_tool_agent.corpus import (
+    CHUNK_TOKEN_BUDGET,
+    CHUNK_TOKEN_OVERLAP,
+    NORMALIZED_DIR,
+    REPO_ROOT,
+    normalize_corpus,
+)
+from multi_tool_agent.dedup import DEDUP_DIR, DEDUP_THRESHOLD, deduplicate_corpus
+from multi_tool_agent.metadata_index import build_metadata_index
 
 
 # --- Please fill in your configurations ---
@@ -12,6 +36,14 @@ CORPUS_DISPLAY_NAME = "procesos_Corpus"
 CORPUS_DESCRIPTION = "Corpus containing data from JSONL files"
 JSONL_DIR_PATH = "data/outputs"
 ENV_FILE_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", ".env"))
+# Manifiesto local con el hash de contenido de cada archivo cargado al corpus
+MANIFEST_PATH = "data/corpus_manifest.json"
+# Progreso de la carga en curso, para reanudar si se interrumpe
+CHECKPOINT_PATH = "data/upload_checkpoint.json"
+# Cargas simultáneas y cargas por segundo permitidas (cuota de Vertex RAG)
+UPLOAD_CONCURRENCY = 8
+UPLOAD_RATE_PER_SECOND = 5.0
+UPLOAD_MAX_RETRIES = 6
 
 
 # --- Start of the script ---
@@ -44,47 +76,40 @@ def create_or_get_corpus():
     return corpus
 
 
-def upload_jsonl_to_corpus(corpus_name, jsonl_path, display_name, description):
-    """Uploads a JSONL file to the specified corpus."""
-    print(f"Uploading {display_name} to corpus...")
-    try:
-        rag_file = rag.upload_file(
-            corpus_name=corpus_name,
-            path=jsonl_path,
-            display_name=display_name,
-            description=description,
-        )
-        print(f"Successfully uploaded {display_name} to corpus")
-        return rag_file
-    except Exception as e:
-        print(f"Error uploading file {display_name}: {e}")
-        return None
-
-
-def upload_all_jsonl_files(corpus_name):
+def upload_all_jsonl_files(
+    corpus_name,
+    concurrency=UPLOAD_CONCURRENCY,
+    rate=UPLOAD_RATE_PER_SECOND,
+    jsonl_dir=JSONL_DIR_PATH,
+    manifest_path=MANIFEST_PATH,
+):
     """Uploads all JSONL files from the specified directory to the corpus."""
-    successful_uploads = 0
-    failed_uploads = 0
-    
     try:
         # Obtener lista de archivos JSONL en el directorio
-        jsonl_files = [f for f in os.listdir(JSONL_DIR_PATH) if f.endswith('.jsonl')]
-        total_files = len(jsonl_files)
+        local_hashes = local_file_hashes(jsonl_dir)
+        total_files = len(local_hashes)
         print(f"\nEncontramos {total_files} archivos JSONL para cargar...")
         
-        # Cargar cada archivo JSONL
-        for jsonl_file in jsonl_files:
-            file_path = os.path.join(JSONL_DIR_PATH, jsonl_file)
-            result = upload_jsonl_to_corpus(
-                corpus_name=corpus_name,
-                jsonl_path=file_path,
-                display_name=jsonl_file,
-                description=f"Data from {jsonl_file}"
-            )
-            if result:
-                successful_uploads += 1
-            else:
-                failed_uploads += 1
+        # Cargar los archivos JSONL con un pool de trabajadores
+        results = upload_files_concurrently(
+            VertexCorpusBackend(corpus_name),
+            local_hashes,
+            jsonl_dir=jsonl_dir,
+            concurrency=concurrency,
+            rate=rate,
+        )
+        successful_uploads = sum(1 for result in results.values() if result.rag_file)
+        failed_uploads = total_files - successful_uploads
+
+        # La recarga completa reemplaza el manifiesto y define una nueva versión del corpus
+        manifest = load_manifest(manifest_path)
+        manifest["files"] = {
+            name: {"sha256": local_hashes[name], "rag_file": result.rag_file}
+            for name, result in results.items()
+            if result.rag_file
+        }
+        record_snapshot(manifest, jsonl_dir)
+        save_manifest(manifest, manifest_path)
         
         print(f"\nResumen de carga:")
         print(f"- Archivos cargados exitosamente: {successful_uploads}")
@@ -95,6 +120,445 @@ def upload_all_jsonl_files(corpus_name):
         print(f"Error al procesar el directorio de archivos JSONL: {e}")
 
 
+# --- Carga concurrente con límite de tasa ---
+class TokenBucket:
+    """Limitador de tasa: `rate` permisos por segundo con ráfagas de `capacity`."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Bloquea hasta obtener un permiso"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+                self._updated_at = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+def is_quota_error(error):
+    """True si el error es de cuota/saturación y conviene reintentar"""
+    if isinstance(error, (google_exceptions.ResourceExhausted,
+                          google_exceptions.TooManyRequests,
+                          google_exceptions.ServiceUnavailable)):
+        return True
+    message = str(error).lower()
+    return "429" in message or "quota" in message or "rate limit" in message
+
+
+def backoff_delay(attempt, base=1.0, cap=60.0):
+    """Backoff exponencial con jitter completo"""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+@dataclass
+class UploadResult:
+    display_name: str
+    rag_file: Optional[str] = None
+    attempts: int = 0
+    seconds: float = 0.0
+    error: Optional[str] = None
+
+
+def upload_with_backoff(backend, path, display_name, bucket, max_retries=UPLOAD_MAX_RETRIES):
+    """Carga un archivo respetando el límite de tasa y reintentando errores de cuota"""
+    result = UploadResult(display_name=display_name)
+    start = time.perf_counter()
+    for attempt in range(max_retries + 1):
+        bucket.acquire()
+        result.attempts = attempt + 1
+        try:
+            remote = backend.upload_file(path, display_name=display_name, description=f"Data from {display_name}")
+            result.rag_file = remote.name
+            result.error = None
+            break
+        except Exception as e:
+            result.error = str(e)
+            if not is_quota_error(e) or attempt == max_retries:
+                break
+            delay = backoff_delay(attempt)
+            print(f"Cuota excedida al cargar {display_name}, reintentando en {delay:.1f}s")
+            time.sleep(delay)
+    result.seconds = time.perf_counter() - start
+    return result
+
+
+def load_checkpoint(checkpoint_path=CHECKPOINT_PATH):
+    """Archivos ya cargados en una ejecución previa interrumpida"""
+    if not os.path.exists(checkpoint_path):
+        return {}
+    with open(checkpoint_path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def print_upload_stats(results, wall_seconds):
+    """Imprime estadísticas de tiempo por archivo"""
+    timings = sorted(result.seconds for result in results if result.rag_file)
+    print("\nEstadísticas de carga:")
+    print(f"- Tiempo total: {wall_seconds:.1f}s")
+    if not timings:
+        return
+    retries = sum(result.attempts - 1 for result in results)
+    p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+    print(f"- Archivos por segundo: {len(timings) / wall_seconds:.2f}")
+    print(f"- Por archivo: min {timings[0]:.2f}s, media {statistics.mean(timings):.2f}s, "
+          f"p50 {statistics.median(timings):.2f}s, p95 {p95:.2f}s, max {timings[-1]:.2f}s")
+    print(f"- Reintentos por cuota: {retries}")
+    for result in sorted(results, key=lambda r: r.seconds, reverse=True)[:5]:
+        print(f"  {result.seconds:6.2f}s {result.display_name}")
+
+
+def upload_files_concurrently(
+    backend,
+    file_hashes,
+    jsonl_dir=JSONL_DIR_PATH,
+    concurrency=UPLOAD_CONCURRENCY,
+    rate=UPLOAD_RATE_PER_SECOND,
+    checkpoint_path=CHECKPOINT_PATH,
+):
+    """Carga archivos con un pool de hilos, límite de tasa y checkpoint reanudable.
+
+    `file_hashes` mapea display name -> hash de contenido. Los archivos que el
+    checkpoint registra con el mismo hash se omiten. Regresa un diccionario
+    display name -> UploadResult.
+    """
+    checkpoint = load_checkpoint(checkpoint_path)
+    results = {}
+    pending = []
+    for display_name, sha256 in file_hashes.items():
+        entry = checkpoint.get(display_name)
+        if entry and entry.get("sha256") == sha256:
+            results[display_name] = UploadResult(display_name=display_name, rag_file=entry["rag_file"])
+        else:
+            pending.append(display_name)
+    if results:
+        print(f"Reanudando carga: {len(results)} archivos ya cargados según {checkpoint_path}")
+
+    bucket = TokenBucket(rate)
+    lock = threading.Lock()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = {
+            executor.submit(
+                upload_with_backoff, backend, os.path.join(jsonl_dir, display_name), display_name, bucket
+            ): display_name
+            for display_name in pending
+        }
+        for done, future in enumerate(as_completed(futures), start=1):
+            result = future.result()
+            results[result.display_name] = result
+            if result.rag_file:
+                print(f"[{done}/{len(pending)}] Successfully uploaded {result.display_name} ({result.seconds:.2f}s)")
+                with lock:
+                    checkpoint[result.display_name] = {
+                        "sha256": file_hashes[result.display_name],
+                        "rag_file": result.rag_file,
+                    }
+                    save_manifest(checkpoint, checkpoint_path)
+            else:
+                print(f"[{done}/{len(pending)}] Error uploading file {result.display_name}: {result.error}")
+
+    print_upload_stats([results[name] for name in pending], time.perf_counter() - start)
+    # Si todo se cargó, el checkpoint ya no hace falta
+    if all(result.rag_file for result in results.values()) and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    return results
+
+
+# --- Sincronización incremental del corpus ---
+@dataclass
+class RemoteFile:
+    name: str
+    display_name: str
+
+
+class CorpusBackend:
+    """Operaciones sobre el corpus remoto que necesita la sincronización."""
+
+    def list_files(self) -> List[RemoteFile]:
+        raise NotImplementedError
+
+    def upload_file(self, path, display_name, description) -> RemoteFile:
+        raise NotImplementedError
+
+    def delete_file(self, name) -> None:
+        raise NotImplementedError
+
+
+class VertexCorpusBackend(CorpusBackend):
+    """Corpus de Vertex RAG."""
+
+    def __init__(self, corpus_name):
+        self.corpus_name = corpus_name
+
+    def list_files(self):
+        return [
+            RemoteFile(name=file.name, display_name=file.display_name)
+            for file in rag.list_files(corpus_name=self.corpus_name)
+        ]
+
+    def upload_file(self, path, display_name, description):
+        rag_file = rag.upload_file(
+            corpus_name=self.corpus_name,
+            path=path,
+            display_name=display_name,
+            description=description,
+        )
+        return RemoteFile(name=rag_file.name, display_name=rag_file.display_name)
+
+    def delete_file(self, name):
+        rag.delete_file(name=name)
+
+
+class InMemoryCorpusBackend(CorpusBackend):
+    """Corpus falso en memoria para probar la sincronización sin Vertex."""
+
+    def __init__(self, files=None):
+        self.files: Dict[str, RemoteFile] = {}
+        self.contents: Dict[str, bytes] = {}
+        self._next_id = 0
+        for display_name, content in (files or {}).items():
+            self._add(display_name, content)
+
+    def _add(self, display_name, content):
+        self._next_id += 1
+        name = f"corpora/fake/ragFiles/{self._next_id}"
+        self.files[name] = RemoteFile(name=name, display_name=display_name)
+        self.contents[name] = content
+        return self.files[name]
+
+    def list_files(self):
+        return list(self.files.values())
+
+    def upload_file(self, path, display_name, description):
+        with open(path, "rb") as f:
+            return self._add(display_name, f.read())
+
+    def delete_file(self, name):
+        del self.files[name]
+        del self.contents[name]
+
+
+@dataclass
+class SyncPlan:
+    new: List[str] = field(default_factory=list)
+    changed: List[str] = field(default_factory=list)
+    removed: List[str] = field(default_factory=list)
+    # Archivos sin cambios -> nombre de recurso de la copia remota que se conserva
+    kept: Dict[str, str] = field(default_factory=dict)
+    # Nombres de recurso remotos a borrar (archivos eliminados o duplicados)
+    deletions: List[str] = field(default_factory=list)
+    # Archivos modificados -> copias remotas anteriores, se borran tras cargar la nueva
+    replaced: Dict[str, List[str]] = field(default_factory=dict)
+
+    @property
+    def unchanged(self):
+        return list(self.kept)
+
+    @property
+    def uploads(self):
+        return self.new + self.changed
+
+
+def file_sha256(path):
+    """Hash SHA-256 del contenido de un archivo"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 16), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def load_manifest(manifest_path=MANIFEST_PATH):
+    if not os.path.exists(manifest_path):
+        return {"files": {}}
+    with open(manifest_path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_manifest(manifest, manifest_path=MANIFEST_PATH):
+    os.makedirs(os.path.dirname(manifest_path) or ".", exist_ok=True)
+    tmp_path = f"{manifest_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+
+
+def snapshot_version(file_hashes):
+    """ID de versión del corpus: hash de los nombres y hashes de contenido de sus archivos"""
+    digest = hashlib.sha256()
+    for name in sorted(file_hashes):
+        digest.update(f"{name}:{file_hashes[name]}\n".encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+
+def record_snapshot(manifest, jsonl_dir=JSONL_DIR_PATH):
+    """Registra en el manifiesto la versión del corpus cargado (la lee el agente para sus cachés).
+
+    También registra el directorio cargado: el índice local, el de metadata y
+    el almacén de chunks del agente se construyen con ese mismo corpus.
+    """
+    manifest["corpus_dir"] = os.path.relpath(os.path.abspath(jsonl_dir), REPO_ROOT)
+    # Las cargas fallidas de archivos nuevos no están en el corpus
+    files = {name: entry for name, entry in manifest.get("files", {}).items() if entry.get("rag_file")}
+    version = snapshot_version({name: entry["sha256"] for name, entry in files.items()})
+    previous = manifest.get("snapshot") or {}
+    if previous.get("version") != version:
+        manifest["snapshot"] = {
+            "version": version,
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+            "files": len(files),
+            "previous_version": previous.get("version"),
+        }
+    print(f"Versión del corpus: {version}" + (" (sin cambios)" if previous.get("version") == version else ""))
+    return version
+
+
+def local_file_hashes(jsonl_dir=JSONL_DIR_PATH):
+    """Hash de contenido de cada archivo JSONL local, por nombre de archivo"""
+    return {
+        name: file_sha256(os.path.join(jsonl_dir, name))
+        for name in sorted(os.listdir(jsonl_dir))
+        if name.endswith(".jsonl")
+    }
+
+
+def compute_sync_plan(local_hashes, manifest, remote_files):
+    """Compara archivos locales, manifiesto y archivos remotos (por display name).
+
+    Un archivo remoto sin entrada en el manifiesto (p. ej. cargado antes de
+    existir la sincronización) se adopta como vigente en lugar de recargarse.
+    """
+    plan = SyncPlan()
+    recorded = manifest.get("files", {})
+    remote_by_name: Dict[str, List[RemoteFile]] = {}
+    for remote in remote_files:
+        remote_by_name.setdefault(remote.display_name, []).append(remote)
+
+    for display_name, sha256 in local_hashes.items():
+        copies = remote_by_name.get(display_name, [])
+        if not copies:
+            plan.new.append(display_name)
+            continue
+        entry = recorded.get(display_name)
+        if entry is not None and entry.get("sha256") != sha256:
+            plan.changed.append(display_name)
+            plan.replaced[display_name] = [copy.name for copy in copies]
+            continue
+        # Conservar la copia registrada (o la primera) y borrar duplicados
+        keep = next(
+            (copy for copy in copies if entry and copy.name == entry.get("rag_file")),
+            copies[0],
+        )
+        plan.kept[display_name] = keep.name
+        plan.deletions.extend(copy.name for copy in copies if copy is not keep)
+
+    for display_name, copies in remote_by_name.items():
+        if display_name not in local_hashes:
+            plan.removed.append(display_name)
+            plan.deletions.extend(copy.name for copy in copies)
+
+    return plan
+
+
+def print_sync_summary(plan):
+    print("\nResumen de sincronización:")
+    print(f"- Archivos nuevos: {len(plan.new)}")
+    print(f"- Archivos modificados: {len(plan.changed)}")
+    print(f"- Archivos sin cambios: {len(plan.unchanged)}")
+    print(f"- Archivos eliminados: {len(plan.removed)}")
+    print(f"- Copias remotas a borrar: {len(plan.deletions) + sum(len(names) for names in plan.replaced.values())}")
+    for label, names in (("+", plan.new), ("~", plan.changed), ("-", plan.removed)):
+        for name in names:
+            print(f"  {label} {name}")
+
+
+def sync_corpus(
+    backend,
+    jsonl_dir=JSONL_DIR_PATH,
+    manifest_path=MANIFEST_PATH,
+    dry_run=False,
+    concurrency=UPLOAD_CONCURRENCY,
+    rate=UPLOAD_RATE_PER_SECOND,
+    checkpoint_path=CHECKPOINT_PATH,
+):
+    """Sincroniza el corpus remoto con los archivos JSONL locales.
+
+    Solo carga archivos nuevos o modificados y borra las copias remotas de los
+    archivos eliminados o reemplazados. La copia anterior de un archivo
+    modificado se borra solo después de cargar la nueva: si la carga falla, el
+    documento sigue en el corpus y el manifiesto conserva su hash anterior (y
+    el error), así que la siguiente sincronización lo vuelve a intentar.
+    Regresa el plan ejecutado.
+    """
+    local_hashes = local_file_hashes(jsonl_dir)
+    manifest = load_manifest(manifest_path)
+    # Las cargas de una sincronización interrumpida ya están en el corpus
+    manifest.setdefault("files", {}).update(load_checkpoint(checkpoint_path))
+    remote_files = backend.list_files()
+    plan = compute_sync_plan(local_hashes, manifest, remote_files)
+    print_sync_summary(plan)
+    if dry_run:
+        return plan
+
+    files = {
+        display_name: {"sha256": local_hashes[display_name], "rag_file": rag_file}
+        for display_name, rag_file in plan.kept.items()
+    }
+
+    for name in plan.deletions:
+        try:
+            backend.delete_file(name)
+        except Exception as e:
+            print(f"Error al borrar el archivo remoto {name}: {e}")
+
+    results = upload_files_concurrently(
+        backend,
+        {display_name: local_hashes[display_name] for display_name in plan.uploads},
+        jsonl_dir=jsonl_dir,
+        concurrency=concurrency,
+        rate=rate,
+        checkpoint_path=checkpoint_path,
+    )
+    failed_uploads = 0
+    recorded = manifest.get("files", {})
+    for display_name, result in results.items():
+        if result.rag_file:
+            files[display_name] = {"sha256": local_hashes[display_name], "rag_file": result.rag_file}
+            for name in plan.replaced.get(display_name, []):
+                try:
+                    backend.delete_file(name)
+                except Exception as e:
+                    print(f"Error al borrar el archivo remoto {name}: {e}")
+            continue
+        failed_uploads += 1
+        previous = plan.replaced.get(display_name)
+        if previous:
+            # La copia anterior sigue vigente en el corpus
+            files[display_name] = {
+                "sha256": (recorded.get(display_name) or {}).get("sha256"),
+                "rag_file": previous[0],
+                "error": result.error,
+            }
+        else:
+            files[display_name] = {"sha256": None, "rag_file": None, "error": result.error}
+
+    manifest["files"] = files
+    record_snapshot(manifest, jsonl_dir)
+    save_manifest(manifest, manifest_path)
+    print(f"\nSincronización terminada ({failed_uploads} cargas con error)")
+    return plan
+
+
 def list_corpus_files(corpus_name):
     """Lists files in the specified corpus."""
     files = list(rag.list_files(corpus_name=corpus_name))
@@ -138,12 +602,43 @@ def test_rag_functionality(corpus_name):
         return False
 
 
-def main():
+def prepare_and_upload(args, normalized_dir=NORMALIZED_DIR, dedup_dir=DEDUP_DIR):
+    """Prepara los JSONL (normalización, deduplicación e índices locales) y sincroniza el corpus"""
+    jsonl_dir = JSONL_DIR_PATH
+    if args.normalize:
+        normalize_corpus(JSONL_DIR_PATH, normalized_dir, budget=args.chunk_tokens, overlap=args.chunk_overlap)
+        jsonl_dir = normalized_dir
+    if args.dedup:
+        # La carga y el índice local consumen solo el conjunto deduplicado
+        deduplicate_corpus(jsonl_dir, dedup_dir, threshold=args.dedup_threshold)
+        jsonl_dir = dedup_dir
+    # Código, título, área y fecha de cada documento para búsquedas exactas y filtros
+    # y almacén binario con los chunks para leerlos por ID o documento sin parsear JSONL
+    if not args.dry_run:
+        build_metadata_index(jsonl_dir)
+        build_chunk_store(jsonl_dir).close()
+
     initialize_vertex_ai()
     corpus = create_or_get_corpus()
     
-    # Cargar todos los archivos JSONL del directorio
-    upload_all_jsonl_files(corpus_name=corpus.name)
+    if args.mode == "sync":
+        sync_corpus(
+            VertexCorpusBackend(corpus.name),
+            jsonl_dir=jsonl_dir,
+            dry_run=args.dry_run,
+            concurrency=args.concurrency,
+            rate=args.rate,
+        )
+        if args.dry_run:
+            return
+    else:
+        # Cargar todos los archivos JSONL del directorio
+        upload_all_jsonl_files(
+            corpus_name=corpus.name,
+            concurrency=args.concurrency,
+            rate=args.rate,
+            jsonl_dir=jsonl_dir,
+        )
     
     # List all files in the corpus
     list_corpus_files(corpus_name=corpus.name)
@@ -151,5 +646,47 @@ def main():
     # Verificar la funcionalidad del RAG
     test_rag_functionality(corpus_name=corpus.name)
 
+
+def main():
+    parser = argparse.ArgumentParser(description="Prepara y carga el corpus RAG")
+    parser.add_argument(
+        "--mode",
+        choices=["sync", "full"],
+        default="sync",
+        help="sync: carga solo archivos nuevos o modificados; full: recarga todo",
+    )
+    parser.add_argument("--dry-run", action="store_true", help="Solo mostrar el plan de sincronización (--mode sync)")
+    parser.add_argument("--concurrency", type=int, default=UPLOAD_CONCURRENCY, help="Cargas simultáneas")
+    parser.add_argument("--rate", type=float, default=UPLOAD_RATE_PER_SECOND, help="Cargas por segundo")
+    parser.add_argument(
+        "--normalize",
+        action="store_true",
+        help=f"Limpiar y re-dividir los chunks antes de cargarlos (salida en {NORMALIZED_DIR})",
+    )
+    parser.add_argument("--chunk-tokens", type=int, default=CHUNK_TOKEN_BUDGET, help="Tokens por chunk normalizado")
+    parser.add_argument("--chunk-overlap", type=int, default=CHUNK_TOKEN_OVERLAP, help="Tokens de traslape")
+    parser.add_argument(
+        "--dedup",
+        action="store_true",
+        help=f"Eliminar chunks casi duplicados antes de cargarlos (salida en {DEDUP_DIR})",
+    )
+    parser.add_argument("--dedup-threshold", type=float, default=DEDUP_THRESHOLD, help="Similitud de Jaccard mínima")
+    args = parser.parse_args()
+    if args.dry_run and args.mode == "full":
+        # El modo full no calcula un plan: recarga todo el corpus
+        parser.error("--dry-run solo está disponible con --mode sync")
+
+    # En dry-run la normalización y la deduplicación se escriben en un directorio
+    # temporal: el plan refleja lo que se cargaría sin tocar data/normalized ni data/dedup
+    scratch = tempfile.TemporaryDirectory(prefix="corpus_dry_run_") if args.dry_run else None
+    normalized_dir = os.path.join(scratch.name, "normalized") if scratch else NORMALIZED_DIR
+    dedup_dir = os.path.join(scratch.name, "dedup") if scratch else DEDUP_DIR
+    try:
+        prepare_and_upload(args, normalized_dir, dedup_dir)
+    finally:
+        if scratch:
+            scratch.cleanup()
+
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,236 @@
+"""Retención y compactación de sessions.db.
+
+Borra las sesiones inactivas (desactivadas o sin uso por más de N días) y las
+que exceden el máximo por usuario, junto con su historial de chat y sus eventos
+del ADK (tablas `sessions`/`events` que main.py crea en el mismo archivo). El borrado
+se hace en lotes con transacciones acotadas para no bloquear a la aplicación,
+y después se ejecuta un VACUUM incremental para devolver el espacio al disco.
+
+El VACUUM incremental requiere `auto_vacuum=INCREMENTAL`, y activarlo en una
+base existente reescribe todo el archivo con un VACUUM completo que bloquea a
+la aplicación y al ADK mientras dura. Por eso solo se hace con
+`--enable-incremental-vacuum`, en una ventana de mantenimiento; sin él, los
+barridos no compactan si la base no lo tiene activado.
+
+    python retention.py --idle-days 30 --max-per-user 200
+    python retention.py --every 3600      # barrido periódico
+    python retention.py --dry-run
+    python retention.py --enable-incremental-vacuum   # una sola vez, con el servicio detenido
+"""
+
+import argparse
+import os
+import time
+from datetime import datetime, timedelta
+
+from db import db_connection, flush_touches, init_db
+
+# Días sin uso tras los cuales una sesión se elimina
+RETENTION_IDLE_DAYS = float(os.getenv("RETENTION_IDLE_DAYS", "30"))
+# Máximo de sesiones conservadas por usuario (0 = sin límite)
+RETENTION_MAX_SESSIONS_PER_USER = int(os.getenv("RETENTION_MAX_SESSIONS_PER_USER", "0"))
+# Sesiones borradas por transacción
+RETENTION_BATCH_SIZE = 500
+# Páginas liberadas por cada paso de VACUUM incremental
+VACUUM_PAGES_PER_STEP = 2000
+
+
+def _table_exists(conn, name):
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)
+    ).fetchone() is not None
+
+
+def ensure_adk_indexes(conn):
+    """Índices sobre las tablas del ADK para borrar eventos por sesión sin recorrer la tabla"""
+    conn.execute(
+        'CREATE INDEX IF NOT EXISTS idx_events_session ON events (app_name, user_id, session_id)'
+    )
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_sessions_update_time ON sessions (update_time)')
+    conn.commit()
+
+
+def database_size(conn):
+    """Tamaño lógico de la base (bytes) y páginas libres"""
+    page_size = conn.execute('PRAGMA page_size').fetchone()[0]
+    page_count = conn.execute('PRAGMA page_count').fetchone()[0]
+    freelist = conn.execute('PRAGMA freelist_count').fetchone()[0]
+    return page_count * page_size, freelist * page_size
+
+
+def _expired_batch(conn, cutoff, batch_size):
+    """Siguiente lote de sesiones inactivas o sin uso: (session_id, user_id, app_name)"""
+    return conn.execute('''
+        SELECT session_id, user_id, app_name FROM sessions_agent
+        WHERE is_active = 0 OR last_used_at < ?
+        LIMIT ?
+    ''', (cutoff.isoformat(), batch_size)).fetchall()
+
+
+def _over_limit_sessions(conn, max_per_user):
+    """Todas las sesiones que exceden el máximo por usuario (una sola lectura de la tabla por barrido)"""
+    return conn.execute('''
+        SELECT session_id, user_id, app_name FROM (
+            SELECT session_id, user_id, app_name,
+                   ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY last_used_at DESC) AS position
+            FROM sessions_agent
+        )
+        WHERE position > ?
+    ''', (max_per_user,)).fetchall()
+
+
+def _orphan_adk_batch(conn, cutoff, batch_size):
+    """Sesiones del ADK sin registro en sessions_agent y sin uso desde `cutoff`"""
+    return conn.execute('''
+        SELECT id, user_id, app_name FROM sessions
+        WHERE update_time < ?
+          AND id NOT IN (SELECT session_id FROM sessions_agent)
+        LIMIT ?
+    ''', (cutoff.strftime('%Y-%m-%d %H:%M:%S'), batch_size)).fetchall()
+
+
+def _delete_batch(conn, batch, has_adk_tables):
+    """Borra un lote de sesiones, su historial de chat y sus eventos del ADK; regresa los eventos borrados"""
+    deleted_events = 0
+    if has_adk_tables:
+        keys = [(app_name, user_id, session_id) for session_id, user_id, app_name in batch]
+        deleted_events = conn.executemany(
+            'DELETE FROM events WHERE app_name = ? AND user_id = ? AND session_id = ?', keys
+        ).rowcount
+        conn.executemany(
+            'DELETE FROM sessions WHERE app_name = ? AND user_id = ? AND id = ?', keys
+        )
+    session_ids = [(row[0],) for row in batch]
+    conn.executemany('DELETE FROM chat_messages WHERE session_id = ?', session_ids)
+    # usage_daily conserva los totales por día de las sesiones borradas
+    conn.executemany('DELETE FROM usage_sessions WHERE session_id = ?', session_ids)
+    conn.executemany('DELETE FROM sessions_agent WHERE session_id = ?', session_ids)
+    return deleted_events
+
+
+def has_incremental_vacuum(conn):
+    return conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 2
+
+
+def enable_incremental_vacuum(conn):
+    """Activa auto_vacuum=INCREMENTAL con un VACUUM completo (bloquea la base mientras dura)"""
+    if has_incremental_vacuum(conn):
+        return False
+    print("Activando auto_vacuum incremental (VACUUM completo por única vez)...")
+    conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+    conn.execute('VACUUM')
+    return True
+
+
+def incremental_vacuum(conn, pages_per_step=VACUUM_PAGES_PER_STEP):
+    """Libera las páginas vacías en pasos cortos para no retener el candado"""
+    while conn.execute('PRAGMA freelist_count').fetchone()[0] > 0:
+        conn.execute(f'PRAGMA incremental_vacuum({pages_per_step})').fetchall()
+        conn.commit()
+    conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+
+
+def run_retention(
+    idle_days=RETENTION_IDLE_DAYS,
+    max_per_user=RETENTION_MAX_SESSIONS_PER_USER,
+    batch_size=RETENTION_BATCH_SIZE,
+    dry_run=False,
+    vacuum=True,
+    enable_vacuum=False,
+):
+    """Ejecuta un barrido de retención y regresa las estadísticas"""
+    start = time.perf_counter()
+    init_db()
+    # Los usos pendientes en memoria deben quedar escritos antes del barrido
+    flush_touches()
+    cutoff = datetime.now() - timedelta(days=idle_days)
+    stats = {"sessions": 0, "adk_sessions": 0, "events": 0, "reclaimed_bytes": 0}
+
+    with db_connection() as conn:
+        has_adk_tables = _table_exists(conn, "sessions") and _table_exists(conn, "events")
+        if has_adk_tables:
+            ensure_adk_indexes(conn)
+        size_before, _ = database_size(conn)
+
+        if dry_run:
+            stats["sessions"] = conn.execute(
+                'SELECT COUNT(*) FROM sessions_agent WHERE is_active = 0 OR last_used_at < ?',
+                (cutoff.isoformat(),),
+            ).fetchone()[0]
+            print(f"Sesiones que se borrarían (inactivas o sin uso desde {cutoff:%Y-%m-%d}): {stats['sessions']}")
+            return stats
+
+        while True:
+            batch = _expired_batch(conn, cutoff, batch_size)
+            if not batch:
+                break
+            stats["events"] += _delete_batch(conn, batch, has_adk_tables)
+            stats["sessions"] += len(batch)
+            conn.commit()
+
+        over_limit = _over_limit_sessions(conn, max_per_user) if max_per_user else []
+        for offset in range(0, len(over_limit), batch_size):
+            batch = over_limit[offset:offset + batch_size]
+            stats["events"] += _delete_batch(conn, batch, has_adk_tables)
+            stats["sessions"] += len(batch)
+            conn.commit()
+
+        while has_adk_tables:
+            batch = _orphan_adk_batch(conn, cutoff, batch_size)
+            if not batch:
+                break
+            stats["events"] += _delete_batch(conn, batch, has_adk_tables)
+            stats["adk_sessions"] += len(batch)
+            conn.commit()
+
+        if enable_vacuum:
+            enable_incremental_vacuum(conn)
+        if vacuum and has_incremental_vacuum(conn):
+            incremental_vacuum(conn)
+        elif vacuum:
+            print("auto_vacuum incremental no está activo: no se compacta "
+                  "(activarlo una vez con --enable-incremental-vacuum)")
+        size_after, _ = database_size(conn)
+
+    stats["reclaimed_bytes"] = max(0, size_before - size_after)
+    stats["seconds"] = round(time.perf_counter() - start, 3)
+    print("\nResumen de retención:")
+    print(f"- Sesiones borradas: {stats['sessions']}")
+    print(f"- Sesiones del ADK sin registro borradas: {stats['adk_sessions']}")
+    print(f"- Eventos del ADK borrados: {stats['events']}")
+    print(f"- Espacio recuperado: {stats['reclaimed_bytes'] / 1024:.1f} KiB "
+          f"({size_before / 1024:.1f} -> {size_after / 1024:.1f} KiB)")
+    print(f"- Tiempo: {stats['seconds']}s")
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Retención y compactación de sessions.db")
+    parser.add_argument("--idle-days", type=float, default=RETENTION_IDLE_DAYS)
+    parser.add_argument("--max-per-user", type=int, default=RETENTION_MAX_SESSIONS_PER_USER)
+    parser.add_argument("--batch-size", type=int, default=RETENTION_BATCH_SIZE)
+    parser.add_argument("--no-vacuum", action="store_true", help="No ejecutar VACUUM incremental")
+    parser.add_argument(
+        "--enable-incremental-vacuum", action="store_true",
+        help="Activar auto_vacuum incremental con un VACUUM completo (bloquea la base; solo en mantenimiento)",
+    )
+    parser.add_argument("--dry-run", action="store_true", help="Solo contar las sesiones expiradas")
+    parser.add_argument("--every", type=float, default=0, help="Repetir el barrido cada N segundos")
+    args = parser.parse_args()
+
+    while True:
+        run_retention(
+            idle_days=args.idle_days,
+            max_per_user=args.max_per_user,
+            batch_size=args.batch_size,
+            dry_run=args.dry_run,
+            vacuum=not args.no_vacuum,
+            enable_vacuum=args.enable_incremental_vacuum,
+        )
+        if not args.every:
+            break
+        time.sleep(args.every)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""Modo de producción del servidor del ADK.
+
+Ejecuta main:app con varios workers de uvicorn (sin auto-recarga), apagado
+ordenado ante SIGTERM y warmup del agente en cada worker. Antes de iniciar
+los workers crea el esquema de sesiones una sola vez y verifica que
+SESSION_SERVICE_URI se pueda compartir entre procesos, de modo que una sesión
+creada en un worker se pueda continuar en cualquier otro.
+
+    python serve.py --workers 4 --port 8000
+    WEB_CONCURRENCY=4 python serve.py
+
+Los encabezados X-Forwarded-For/-Proto solo se aceptan de las IPs del proxy
+en FORWARDED_ALLOW_IPS (p. ej. `127.0.0.1,10.0.0.5`); vacío = no se aceptan.
+
+Para desarrollo con auto-recarga sigue usándose `python main.py`.
+"""
+
+import argparse
+import os
+
+import uvicorn
+from dotenv import load_dotenv
+
+# Antes de leer la configuración de este módulo y de iniciar los workers
+load_dotenv(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".env"))
+
+from session_store import check_session_service_uri, prepare_session_store  # noqa: E402
+
+DEFAULT_WORKERS = int(os.getenv("WEB_CONCURRENCY", "2"))
+# Segundos que se esperan las solicitudes en curso (p. ej. un /run_sse largo) al apagar
+GRACEFUL_SHUTDOWN_SECONDS = int(os.getenv("GRACEFUL_SHUTDOWN_SECONDS", "30"))
+# Proxies de confianza para X-Forwarded-* (vacío = deshabilitado)
+FORWARDED_ALLOW_IPS = os.getenv("FORWARDED_ALLOW_IPS", "")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor del ADK con varios workers")
+    parser.add_argument("--app", default="main:app", help="Aplicación ASGI (módulo:atributo)")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8000")))
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS)
+    parser.add_argument("--graceful-timeout", type=int, default=GRACEFUL_SHUTDOWN_SECONDS)
+    parser.add_argument("--keep-alive", type=int, default=5, help="Segundos de keep-alive HTTP")
+    parser.add_argument("--no-warmup", action="store_true", help="No construir el agente al arrancar cada worker")
+    parser.add_argument(
+        "--forwarded-allow-ips", default=FORWARDED_ALLOW_IPS,
+        help="IPs de proxies de confianza para X-Forwarded-* separadas por comas",
+    )
+    args = parser.parse_args()
+
+    session_uri = os.getenv("SESSION_SERVICE_URI", "sqlite:///./sessions.db")
+    check_session_service_uri(session_uri, args.workers)
+    prepare_session_store(session_uri)
+    if args.no_warmup:
+        os.environ["WARMUP_ON_STARTUP"] = "FALSE"
+
+    print(f"Iniciando {args.app} con {args.workers} workers en {args.host}:{args.port} (sesiones: {session_uri})")
+    uvicorn.run(
+        args.app,
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        reload=False,
+        timeout_keep_alive=args.keep_alive,
+        timeout_graceful_shutdown=args.graceful_timeout,
+        proxy_headers=bool(args.forwarded_allow_ips),
+        forwarded_allow_ips=args.forwarded_allow_ips or None,
+    )
+
+
+if __name__ == "__main__":
+    main()
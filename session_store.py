@@ -0,0 +1,77 @@
+"""Servicio de sesiones del ADK compartido entre workers.
+
+Con varios workers de uvicorn cada proceso abre su propio `DatabaseSessionService`
+sobre el mismo `SESSION_SERVICE_URI`, así que una sesión creada en un worker se
+puede continuar en cualquier otro. Para SQLite se aplican a cada conexión de
+SQLAlchemy los mismos PRAGMA que usa db.py (WAL, busy_timeout) para que los
+escritores de distintos procesos esperen en lugar de fallar con "database is
+locked". Cualquier otra URL de SQLAlchemy (p. ej. `postgresql://...`) se usa
+tal cual.
+"""
+
+import os
+import sqlite3
+import threading
+
+from db import configure_connection
+
+# URIs que no se pueden compartir entre procesos
+IN_MEMORY_URIS = ("", "memory", "memory://", "sqlite://", "sqlite:///:memory:")
+
+_pragmas_installed = False
+_pragmas_lock = threading.Lock()
+
+
+def is_sqlite_uri(uri):
+    return uri.startswith("sqlite")
+
+
+def sqlite_path(uri):
+    """Ruta del archivo de una URI `sqlite:///ruta` (relativa al directorio actual)"""
+    path = uri.split(":///", 1)[1] if ":///" in uri else ""
+    return os.path.abspath(path.split("?", 1)[0]) if path else None
+
+
+def check_session_service_uri(uri, workers):
+    """Falla si la URI no se puede compartir entre `workers` procesos"""
+    if workers > 1 and uri in IN_MEMORY_URIS:
+        raise ValueError(
+            f"SESSION_SERVICE_URI={uri!r} guarda las sesiones en memoria del proceso; "
+            "con varios workers usa sqlite:///ruta.db o una base de datos compartida"
+        )
+
+
+def _configure_sqlite(dbapi_connection, connection_record):
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        configure_connection(dbapi_connection)
+
+
+def install_sqlite_pragmas():
+    """Aplica WAL y busy_timeout a toda conexión SQLite que abra SQLAlchemy"""
+    global _pragmas_installed
+    with _pragmas_lock:
+        if _pragmas_installed:
+            return
+        from sqlalchemy import event
+        from sqlalchemy.engine import Engine
+
+        event.listen(Engine, "connect", _configure_sqlite)
+        _pragmas_installed = True
+
+
+def prepare_session_store(uri):
+    """Crea el esquema del ADK una sola vez, antes de iniciar los workers.
+
+    Si cada worker lo creara al arrancar, dos procesos podrían intentar crear
+    las mismas tablas al mismo tiempo.
+    """
+    if uri in IN_MEMORY_URIS:
+        return
+    if is_sqlite_uri(uri):
+        install_sqlite_pragmas()
+        path = sqlite_path(uri)
+        if path:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+    from google.adk.sessions import DatabaseSessionService
+
+    DatabaseSessionService(db_url=uri)
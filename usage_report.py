@@ -0,0 +1,117 @@
+"""Reporte del consumo de tokens y de recuperación guardado en sessions.db.
+
+Lee las tablas `usage_daily` y `usage_sessions` que llena el agente
+(multi_tool_agent/usage.py) y muestra los totales por día, los tipos de
+pregunta y versiones del prompt más costosos, las sesiones que más consumen y
+el promedio de tokens por respuesta, para medir optimizaciones como reducir
+`similarity_top_k`.
+
+    python usage_report.py --days 7 --top 10
+    python usage_report.py --days 30 --json
+"""
+
+import argparse
+import json
+from datetime import date, timedelta
+
+from db import db_connection, init_db
+from multi_tool_agent.usage_schema import COUNTERS as USAGE_COLUMNS
+
+SUMS = ', '.join(f'SUM({column}) AS {column}' for column in USAGE_COLUMNS)
+
+
+def _rows(conn, sql, params):
+    cursor = conn.execute(sql, params)
+    names = [description[0] for description in cursor.description]
+    return [dict(zip(names, row)) for row in cursor.fetchall()]
+
+
+def _with_averages(row):
+    """Agrega total de tokens y promedios por respuesta a una fila de sumas"""
+    answers = row.get('answers') or 0
+    row = {key: (value or 0) if key in USAGE_COLUMNS else value for key, value in row.items()}
+    row['total_tokens'] = row['prompt_tokens'] + row['completion_tokens']
+    row['tokens_per_answer'] = round(row['total_tokens'] / answers, 1) if answers else 0.0
+    row['payload_tokens_per_answer'] = round(row['tool_payload_tokens'] / answers, 1) if answers else 0.0
+    row['retrievals_per_answer'] = round(row['retrieval_calls'] / answers, 2) if answers else 0.0
+    return row
+
+
+def usage_report(days=7, top=10):
+    """Consumo de los últimos `days` días agrupado por día, tipo de pregunta, prompt y sesión"""
+    init_db()
+    since = (date.today() - timedelta(days=days - 1)).isoformat()
+    with db_connection() as conn:
+        report = {'since': since}
+        report['totals'] = _with_averages(
+            _rows(conn, f'SELECT {SUMS} FROM usage_daily WHERE day >= ?', (since,))[0]
+        )
+        for name, group in (('by_day', 'day'), ('by_question_type', 'question_type'),
+                            ('by_prompt_version', 'prompt_version'), ('by_model', 'model')):
+            report[name] = [
+                _with_averages(row) for row in _rows(
+                    conn,
+                    f'SELECT {group}, {SUMS} FROM usage_daily WHERE day >= ? GROUP BY {group} '
+                    f'ORDER BY {"day" if group == "day" else "SUM(prompt_tokens + completion_tokens) DESC"}',
+                    (since,),
+                )
+            ]
+        report['top_sessions'] = [
+            _with_averages(row) for row in _rows(conn, f'''
+                SELECT session_id, {', '.join(USAGE_COLUMNS)}, last_at FROM usage_sessions
+                WHERE last_at >= ?
+                ORDER BY prompt_tokens + completion_tokens DESC
+                LIMIT ?
+            ''', (since, top))
+        ]
+    return report
+
+
+def print_report(report, top):
+    totals = report['totals']
+    print(f"\nConsumo desde {report['since']}:")
+    print(f"- Respuestas: {totals['answers']}")
+    print(f"- Llamadas al modelo: {totals['model_calls']}")
+    print(f"- Tokens de prompt / respuesta: {totals['prompt_tokens']} / {totals['completion_tokens']}")
+    print(f"- Tokens del resultado de la herramienta (estimados): {totals['tool_payload_tokens']}")
+    print(f"- Llamadas a la recuperación: {totals['retrieval_calls']} "
+          f"({totals['prefetch_wasted']} búsquedas anticipadas desperdiciadas, {totals['prefetch_used']} usadas)")
+    print(f"- Promedio por respuesta: {totals['tokens_per_answer']} tokens "
+          f"({totals['payload_tokens_per_answer']} de recuperación, {totals['retrievals_per_answer']} búsquedas)")
+
+    header = f"{'respuestas':>10} {'tokens':>12} {'tokens/resp':>12} {'tok. recup.':>12}"
+    for title, name, key in (
+        ('Por día', 'by_day', 'day'),
+        (f'Tipos de pregunta más costosos (top {top})', 'by_question_type', 'question_type'),
+        ('Por versión del prompt', 'by_prompt_version', 'prompt_version'),
+        ('Por modelo', 'by_model', 'model'),
+    ):
+        print(f"\n{title}:")
+        print(f"{'':<36} {header}")
+        for row in report[name][:top] if name == 'by_question_type' else report[name]:
+            print(f"{str(row[key] or '-'):<36} {row['answers']:>10} {row['total_tokens']:>12} "
+                  f"{row['tokens_per_answer']:>12} {row['payload_tokens_per_answer']:>12}")
+
+    print(f"\nSesiones con mayor consumo (top {top}):")
+    print(f"{'':<36} {header}")
+    for row in report['top_sessions']:
+        print(f"{row['session_id']:<36} {row['answers']:>10} {row['total_tokens']:>12} "
+              f"{row['tokens_per_answer']:>12} {row['payload_tokens_per_answer']:>12}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reporte del consumo de tokens por sesión y por día")
+    parser.add_argument("--days", type=int, default=7, help="Días hacia atrás, incluido hoy")
+    parser.add_argument("--top", type=int, default=10, help="Sesiones y tipos de pregunta a mostrar")
+    parser.add_argument("--json", action="store_true", help="Imprimir el reporte en JSON")
+    args = parser.parse_args()
+
+    report = usage_report(days=args.days, top=args.top)
+    if args.json:
+        print(json.dumps(report, indent=2, ensure_ascii=False))
+    else:
+        print_report(report, args.top)
+
+
+if __name__ == "__main__":
+    main()